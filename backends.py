@@ -0,0 +1,253 @@
+''' Execution backends Network uses to map agent solves over agents. All backends have the same
+interface - a context manager with map(fn, tasks, timeout=None) - and differ in where tasks run:
+
+  - serial: in process. No dispatch overhead, no parallelism.
+  - thread: on a thread pool. Cheap dispatch, but only parallel where solves release the GIL.
+  - process: on a process Pool. Fully parallel, but every task is pickled to and from a worker.
+  - auto: measures the first steps and picks one of the above, @see AutoBackend.
+
+Lots of tiny devices favour serial or threads; a few big ones favour processes. Backends that run
+tasks on the calling thread say so with `inline`, so a profiler of the caller already sees them.
+'''
+import os
+import math
+import time
+import logging
+import multiprocessing
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor, wait
+from device_kit_market_simulations.transport import SocketAgentPool
+from device_kit_market_simulations.scheduler import LPTScheduler
+
+
+logger = logging.getLogger(__name__)
+
+
+def _map_chunk(fn, chunk):
+  return [fn(task) for task in chunk]
+
+
+def _map_chunk_timed(fn, chunk):
+  results = []
+  for task in chunk:
+    t = time.perf_counter()
+    results.append((fn(task), time.perf_counter() - t))
+  return results
+
+
+def _noop(task):
+  return None
+
+
+def chunked(tasks, chunksize):
+  return [tasks[i:i+chunksize] for i in range(0, len(tasks), chunksize)]
+
+
+class SerialBackend():
+  ''' Run tasks in process, one after another. A timeout can't be enforced here. '''
+  name = 'serial'
+  inline = True       # Whether tasks run on the calling thread.
+
+  def __init__(self, processes=None, schedule=None):
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    pass
+
+  def map(self, fn, tasks, timeout=None):
+    ''' Map fn over tasks. Results are in task order. If `timeout` is given any task not done within
+    timeout seconds of the call gets a TimeoutError instance as its result.
+    '''
+    return [fn(task) for task in tasks]
+
+
+class ThreadBackend(SerialBackend):
+  ''' Run tasks on a thread pool. '''
+  name = 'thread'
+  inline = False
+  executor = None
+
+  def __init__(self, processes=None, schedule=None):
+    self.executor = ThreadPoolExecutor(max_workers=processes)
+
+  def close(self):
+    self.executor.shutdown(wait=False)
+
+  def map(self, fn, tasks, timeout=None):
+    futures = [self.executor.submit(fn, task) for task in tasks]
+    wait(futures, timeout=timeout)
+    return [f.result() if f.done() else TimeoutError() for f in futures]
+
+
+class ProcessBackend(SerialBackend):
+  ''' Run tasks on a process Pool, `chunksize` tasks per dispatch. With schedule 'lpt' tasks are
+  instead packed into one chunk per worker by an LPTScheduler (@see scheduler.py), balanced on the
+  solve times measured in the workers on previous calls.
+  '''
+  name = 'process'
+  inline = False
+  pool = None
+  chunksize = 1
+  workers = None      # Number of chunks tasks are packed into when scheduled.
+  scheduler = None
+
+  def __init__(self, processes=None, schedule=None, chunksize=1):
+    self.pool = Pool(processes=processes)
+    self.chunksize = chunksize
+    self.workers = min(processes, os.cpu_count()) if processes else os.cpu_count()
+    if schedule == 'lpt':
+      self.scheduler = LPTScheduler()
+    elif schedule:
+      raise Exception('Unknown schedule "%s"' % (schedule,))
+
+  def close(self):
+    self.pool.terminate()
+
+  def map(self, fn, tasks, timeout=None):
+    if self.scheduler:
+      return self._map_scheduled(fn, list(tasks), timeout)
+    if timeout is None:
+      return self.pool.map(fn, tasks, self.chunksize)
+    deadline = time.time() + timeout
+    chunks = chunked(list(tasks), self.chunksize)
+    pending = [self.pool.apply_async(_map_chunk, (fn, chunk)) for chunk in chunks]
+    results = []
+    for (chunk, r) in zip(chunks, pending):
+      try:
+        results += r.get(timeout=max(deadline - time.time(), 0))
+      except multiprocessing.TimeoutError:
+        results += [TimeoutError() for task in chunk]
+    return results
+
+  def _map_scheduled(self, fn, tasks, timeout=None):
+    deadline = time.time() + timeout if timeout else None
+    bins = self.scheduler.schedule(len(tasks), self.workers)
+    pending = [self.pool.apply_async(_map_chunk_timed, (fn, [tasks[i] for i in _bin])) for _bin in bins]
+    results = [None]*len(tasks)
+    times = {}
+    for (_bin, r) in zip(bins, pending):
+      try:
+        chunk = r.get(timeout=None if deadline is None else max(deadline - time.time(), 0))
+      except multiprocessing.TimeoutError:
+        chunk = [(TimeoutError(), timeout) for i in _bin]
+      for (i, (result, elapsed)) in zip(_bin, chunk):
+        results[i] = result
+        times[i] = elapsed
+    self.scheduler.update(times)
+    logger.debug('LPT schedule of %d tasks on %d workers; makespan=%.4fs imbalance=%.3f',
+      len(tasks), len(bins), self.scheduler.makespan, self.scheduler.imbalance)
+    return results
+
+
+class AutoBackend(SerialBackend):
+  ''' Pick a backend by measuring the first two steps. The first map() is run serially, timing each
+  task, and the second on threads. Then the process dispatch overhead is measured by mapping a no-op
+  over the same tasks and the process step time is estimated from that plus the measured solve times.
+  The fastest is used from then on. The process chunksize is set so a chunk's solve time covers the
+  per task dispatch overhead, but no larger than an even split of tasks over processes. If the tasks
+  can't be sent to worker processes it picks from serial and thread.
+  '''
+  name = 'auto'
+  processes = None
+  backend = None      # The chosen backend once decided.
+  timings = {}        # Measured or estimated step time by backend name.
+  task_times = []     # Serial solve time of each task on the first step.
+
+  def __init__(self, processes=None, schedule=None):
+    self.processes = min(processes, os.cpu_count()) if processes else os.cpu_count()
+    self.schedule = schedule
+    self.backend = None
+    self.timings = {}
+    self.task_times = []
+    self._thread = None
+
+  @property
+  def inline(self):
+    ''' The first step is run serially, the second on threads, then it's up to the chosen backend. '''
+    if self.backend:
+      return self.backend.inline
+    return 'serial' not in self.timings
+
+  def close(self):
+    if self.backend:
+      self.backend.close()
+    elif self._thread:
+      self._thread.close()
+
+  def map(self, fn, tasks, timeout=None):
+    if self.backend:
+      return self.backend.map(fn, tasks, timeout)
+    tasks = list(tasks)
+    if 'serial' not in self.timings:
+      results = []
+      for task in tasks:
+        t = time.perf_counter()
+        results.append(fn(task))
+        self.task_times.append(time.perf_counter() - t)
+      self.timings['serial'] = sum(self.task_times)
+      return results
+    self._thread = ThreadBackend(self.processes)
+    t = time.perf_counter()
+    results = self._thread.map(fn, tasks, timeout)
+    self.timings['thread'] = time.perf_counter() - t
+    self._choose(tasks)
+    return results
+
+  def _choose(self, tasks):
+    process = self._measure_process(tasks)
+    name = min(self.timings, key=self.timings.get)
+    logger.info('Auto backend chose %s [%s; process chunksize=%s]', name,
+      ', '.join('%s=%.4fs' % (k, v) for (k, v) in self.timings.items()), process.chunksize if process else None)
+    chosen = {'serial': SerialBackend(), 'thread': self._thread, 'process': process}
+    self.backend = chosen.pop(name)
+    [backend.close() for backend in chosen.values() if backend]
+
+  def _measure_process(self, tasks):
+    ''' Estimate the process step time into timings and return the ProcessBackend. If tasks can't be
+    sent to worker processes - devices that can't be pickled, say - processes are left out of the
+    choice and None is returned.
+    '''
+    n = len(tasks)
+    processes = max(1, min(self.processes, n))
+    process = None
+    try:
+      process = ProcessBackend(processes, self.schedule)
+      process.map(_noop, tasks[0:processes])  # Warm up workers.
+      t = time.perf_counter()
+      process.map(_noop, tasks)
+      overhead = time.perf_counter() - t
+    except Exception as e:
+      logger.warning('Auto backend can\'t use worker processes, choosing from serial and thread [%s: %s]', e.__class__.__name__, e)
+      if process:
+        process.close()
+      return None
+    mean_time = max(self.timings['serial']/max(n, 1), 1e-9)
+    self.timings['process'] = overhead + max(self.timings['serial']/processes, max(self.task_times, default=0))
+    process.chunksize = int(min(max(math.ceil((overhead/max(n, 1))/mean_time), 1), math.ceil(n/processes)))
+    return process
+
+
+backends = {
+  'serial': SerialBackend,
+  'thread': ThreadBackend,
+  'process': ProcessBackend,
+  'auto': AutoBackend,
+}
+
+
+def make_backend(name='process', processes=None, addresses=None, schedule=None):
+  ''' Make a backend by name. If agent worker `addresses` are given agents are solved remotely on
+  them over a SocketAgentPool (@see transport.py) whatever the name. `schedule` only applies to
+  process backends.
+  '''
+  if addresses:
+    return SocketAgentPool(addresses)
+  if name not in backends:
+    raise Exception('Unknown execution backend "%s"' % (name,))
+  return backends[name](processes, schedule)
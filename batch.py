@@ -0,0 +1,72 @@
+''' Batched evaluation of agents' utilities and derivatives over many (flow, price) pairs at once -
+the steps of a run, say. Flows are stacked (k, rows, T) and prices (k, T), and the work is split into
+tasks of one agent over a chunk of the k pairs, mapped over a `pool` if given (anything with a
+map(fn, tasks) method: a multiprocessing Pool or a backend from backends.py). Whole trajectory welfare
+analysis is then a handful of pool calls rather than agents*steps separate ones.
+'''
+import os
+import math
+import numpy as np
+from device_kit_market_simulations.compat import utility, utility_deriv
+
+
+def _u(task):
+  (device, s, price) = task
+  return np.array([utility(device, _s, _p) for (_s, _p) in zip(s, price)])
+
+
+def _deriv(task):
+  (device, s, price) = task
+  return np.array([np.asarray(utility_deriv(device, _s, _p)).reshape(_s.shape) for (_s, _p) in zip(s, price)])
+
+
+def stack(deviceset, s, price=0):
+  ''' Flows as (k, rows, T) and prices broadcast to (k, T). A single flow matrix is a stack of one. '''
+  s = np.asarray(s, dtype=float)
+  s = s.reshape((-1,) + tuple(deviceset.shape))
+  price = np.broadcast_to(np.asarray(price, dtype=float), (len(s), len(deviceset)))
+  return (s, price)
+
+
+def chunk_size(k, agents, pool=None):
+  ''' Pairs per task. All of them in process, else enough tasks to keep every CPU busy. '''
+  if pool is None:
+    return max(k, 1)
+  return max(1, math.ceil(k*agents/(4*(os.cpu_count() or 1))))
+
+
+def _map(fn, deviceset, s, price, pool):
+  ''' Map fn over (device, flows, prices) tasks and return the results of each agent in deviceset
+  order, concatenated over chunks.
+  '''
+  slices = deviceset.slices
+  n = chunk_size(len(s), len(slices), pool)
+  tasks = [
+    (device, s[i:i+n, slice(*_slice), :], price[i:i+n])
+    for (device, _slice) in slices
+    for i in range(0, len(s), n)
+  ]
+  results = list((pool.map if pool else map)(fn, tasks))
+  chunks = math.ceil(len(s)/n)
+  return [np.concatenate(results[j*chunks:(j+1)*chunks]) for j in range(0, len(slices))]
+
+
+def batch_u(deviceset, s, price=0, pool=None):
+  ''' Utility of each agent (top level device) at each of the stacked flows `s` (k, rows, T) and
+  prices `price` (k, T), or any price broadcastable to that. Returns a (k, agents) array.
+  '''
+  (s, price) = stack(deviceset, s, price)
+  if not len(s):
+    return np.zeros((0, len(deviceset.devices)))
+  return np.stack(_map(_u, deviceset, s, price, pool), axis=1)
+
+
+def batch_deriv(deviceset, s, price=0, pool=None):
+  ''' Derivative of batch_u()'s utility with respect to flows at each of the stacked flows and prices.
+  With cost based devices that's -deviceset.deriv() (@see compat.utility_deriv()). Returns a (k, rows,
+  T) array.
+  '''
+  (s, price) = stack(deviceset, s, price)
+  if not len(s):
+    return np.zeros(s.shape)
+  return np.concatenate(_map(_deriv, deviceset, s, price, pool), axis=1)
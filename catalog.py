@@ -0,0 +1,110 @@
+''' SQLite catalog of runs. run.py records every finished run - scenario hash, the parameters that
+determine its result, steps, convergence, final metrics, timing and where its output is - so past runs
+can be found by parameters. With run.py --reuse an identical run (same scenario source, scenario args,
+parameters and simulator code) is looked up and reused instead of run again. Data files a scenario
+reads aren't part of a run's identity, so only reuse runs of scenarios whose inputs haven't changed.
+'''
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+default_catalog_path = os.path.join(os.path.expanduser('~'), '.cache', 'device_kit_market_simulations', 'catalog.sqlite')
+
+_schema = '''
+create table if not exists runs (
+  id integer primary key autoincrement,
+  key text not null,
+  scenario text not null,
+  scenario_hash text not null,
+  params text not null,
+  output_dir text not null,
+  steps integer,
+  stable integer,
+  utility real,
+  excess_max real,
+  price_avg real,
+  load_factor real,
+  started real,
+  elapsed real
+);
+create index if not exists runs_key on runs (key);
+create index if not exists runs_scenario_hash on runs (scenario_hash);
+'''
+
+
+def code_hash(root=None):
+  ''' Hash of the source of the simulator package under `root` - this package by default. '''
+  root = root if root else os.path.dirname(os.path.abspath(__file__))
+  h = hashlib.sha256()
+  for (dirpath, dirnames, filenames) in os.walk(root):
+    dirnames[:] = sorted(d for d in dirnames if not d.startswith('.') and d not in ('tests', '__pycache__'))
+    for filename in sorted(f for f in filenames if f.endswith('.py')):
+      path = os.path.join(dirpath, filename)
+      h.update(os.path.relpath(path, root).encode())
+      with open(path, 'rb') as f:
+        h.update(f.read())
+  return h.hexdigest()[0:16]
+
+
+def run_key(scenario_hash, params, code=None):
+  ''' Identity of a run: hash of the scenario hash, the result determining parameters and the
+  simulator's code hash (@see code_hash()).
+  '''
+  return hashlib.sha256((scenario_hash + json.dumps(params, sort_keys=True, default=str) + (code or '')).encode()).hexdigest()[0:16]
+
+
+class RunCatalog():
+  ''' Catalog of runs in an SQLite database at `path`. '''
+  path = None
+  conn = None
+
+  def __init__(self, path=None):
+    self.path = path if path else default_catalog_path
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+    self.conn = sqlite3.connect(self.path, timeout=30)
+    self.conn.row_factory = sqlite3.Row
+    self.conn.executescript(_schema)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.conn.close()
+
+  def record(self, key, scenario, scenario_hash, params, output_dir, summary, started, elapsed):
+    ''' Record a finished run. `summary` is the NetworkSummary of its last step. '''
+    with self.conn:
+      self.conn.execute(
+        'insert into runs (key, scenario, scenario_hash, params, output_dir, steps, stable, utility,'
+        ' excess_max, price_avg, load_factor, started, elapsed) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+          key, scenario, scenario_hash, json.dumps(params, sort_keys=True, default=str), os.path.abspath(output_dir),
+          int(summary.steps), int(summary.stable), float(summary.utility), float(abs(summary.excess).max()),
+          float(summary.price.mean()), float(summary.load_factor), started, elapsed,
+        )
+      )
+
+  def lookup(self, key):
+    ''' Get the latest run with `key` whose output still exists, as a dict, or None. '''
+    for row in self.conn.execute('select * from runs where key = ? order by id desc', (key,)):
+      if os.path.isdir(row['output_dir']):
+        return dict(row)
+    return None
+
+  def find(self, scenario_hash=None, **params):
+    ''' Runs, latest first, of a scenario (by hash) whose parameters include `params`. '''
+    if scenario_hash:
+      rows = self.conn.execute('select * from runs where scenario_hash = ? order by id desc', (scenario_hash,))
+    else:
+      rows = self.conn.execute('select * from runs order by id desc')
+    rows = [dict(row) for row in rows]
+    return [row for row in rows if all(json.loads(row['params']).get(k) == v for (k, v) in params.items())]
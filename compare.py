@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+''' Compare several runs (@see run.py) of the same scenario. The final state of each run is stacked
+into arrays - flows (runs, rows, T) and prices (runs, T) - and all differences are taken against the
+first (reference) run in one go: per device flow deltas, price deltas, welfare gaps and convergence
+curves (max |excess| by step). Step files are read as plain JSON rather than deserialized into
+Networks (only the reference's last step is, for device labels), and convergence curves come from each
+run's summary.csv where it has the columns, so dozens of runs compare quickly. Example:
+
+    ./compare.py run-a run-b run-c -o compare-out
+'''
+import os
+import re
+import sys
+import json
+import argparse
+import logging
+from glob import glob
+import numpy as np
+import pandas as pd
+from device_kit_market_simulations.network import expand_rows
+from device_kit_market_simulations.reporting.writer import NetworkReader
+from device_kit_market_simulations.reporting.summary import summarize
+
+
+logging.basicConfig()
+logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def step_files(run_dir):
+  ''' network-N.json files of a run in step order. '''
+  sort_key = lambda f: int(re.match(r'.*-(\d+)\.json$', f).groups()[0])
+  return sorted(glob(run_dir + '/network-*.json'), key=sort_key)
+
+
+def load_state(filename):
+  ''' Get (steps, price, s) from a network JSON file without building the Network. '''
+  with open(filename, 'r') as f:
+    d = json.load(f)
+  s = expand_rows(d['s'], 'float64') if isinstance(d['s'], dict) else np.array(d['s'], dtype=float)
+  return (d['steps'], np.array(d['price'], dtype=float), s)
+
+
+def load_curve(run_dir, files):
+  ''' (steps, max |excess|) of each recorded step, from summary.csv if it has them, else from the step
+  files. Steps needn't be consecutive - a run may only write every Nth step.
+  '''
+  filename = run_dir + '/summary.csv'
+  if os.path.isfile(filename):
+    summary = pd.read_csv(filename)
+    if 'steps' in summary and 'excess_max' in summary:
+      return (summary['steps'].values, summary['excess_max'].values)
+  states = [load_state(f) for f in files]
+  return (np.array([state[0] for state in states]), np.array([np.abs(state[2].sum(axis=0)).max() for state in states]))
+
+
+def load_utility(run_dir):
+  ''' Final utility from summary.csv, else from the last network - the one step that is deserialized. '''
+  filename = run_dir + '/summary.csv'
+  if os.path.isfile(filename):
+    return pd.read_csv(filename)['utility'].values[-1]
+  return summarize(NetworkReader(run_dir).last()).utility
+
+
+class RunComparison():
+  ''' Final states and convergence curves of `run_dirs` stacked for vectorised comparison. The first
+  run is the reference.
+  '''
+  run_dirs = []
+  labels = []         # Device (row) labels.
+  steps = None        # (runs,) steps taken.
+  price = None        # (runs, T) final prices.
+  s = None            # (runs, rows, T) final flows.
+  curves = None       # (runs, max recorded steps) max |excess| of each recorded step, NaN padded.
+  curve_steps = None  # (runs, max recorded steps) the step number of each entry of curves, -1 padded.
+  utility = None      # (runs,) final utility.
+
+  def __init__(self, run_dirs):
+    self.run_dirs = run_dirs
+    files = [step_files(run_dir) for run_dir in run_dirs]
+    for (run_dir, f) in zip(run_dirs, files):
+      if not f:
+        raise ValueError('No network files in %s' % (run_dir,))
+    finals = [load_state(f[-1]) for f in files]
+    shapes = set(state[2].shape for state in finals)
+    if len(shapes) > 1:
+      raise ValueError('Runs have different flow shapes %s. Not the same scenario?' % (shapes,))
+    self.steps = np.array([state[0] for state in finals])
+    self.price = np.stack([state[1] for state in finals])
+    self.s = np.stack([state[2] for state in finals])
+    curves = [load_curve(run_dir, f) for (run_dir, f) in zip(run_dirs, files)]
+    self.curves = np.full((len(curves), max(len(c) for (_steps, c) in curves)), np.nan)
+    self.curve_steps = np.full(self.curves.shape, -1)
+    for (i, (_steps, c)) in enumerate(curves):
+      (self.curve_steps[i, 0:len(c)], self.curves[i, 0:len(c)]) = (_steps, c)
+    self.utility = np.array([load_utility(run_dir) for run_dir in run_dirs])
+    reference = NetworkReader(run_dirs[0]).last()
+    self.labels = [label for (label, row) in reference.deviceset.map(reference.s)]
+
+  @property
+  def names(self):
+    return [os.path.basename(run_dir.rstrip('/')) for run_dir in self.run_dirs]
+
+  def flow_deltas(self):
+    ''' (runs, rows) sum over time of |flow - reference flow| for each device. '''
+    return np.abs(self.s - self.s[0]).sum(axis=2)
+
+  def price_deltas(self):
+    ''' (runs, T) price - reference price. '''
+    return self.price - self.price[0]
+
+  def steps_to(self, tol):
+    ''' (runs,) first recorded step with max |excess| <= tol, or -1 if never. '''
+    below = self.curves <= tol
+    return np.where(below.any(axis=1), self.curve_steps[np.arange(len(below)), below.argmax(axis=1)], -1)
+
+  def convergence(self):
+    ''' DataFrame of max |excess| indexed by step, a column per run. NaN where a run has no record. '''
+    return pd.concat([
+      pd.Series(c[_steps >= 0], index=_steps[_steps >= 0]) for (_steps, c) in zip(self.curve_steps, self.curves)
+    ], axis=1, keys=self.names)
+
+  def summary(self, tol=None):
+    ''' DataFrame with a row per run. '''
+    flow_deltas = self.flow_deltas()
+    price_deltas = self.price_deltas()
+    worst = flow_deltas.argmax(axis=1)
+    df = pd.DataFrame({
+      'steps': self.steps,
+      'excess_max': self.curves[np.arange(len(self.curves)), np.sum(~np.isnan(self.curves), axis=1) - 1],
+      'utility': self.utility,
+      'welfare_gap': self.utility - self.utility[0],
+      'price_max_delta': np.abs(price_deltas).max(axis=1),
+      'price_rms_delta': np.sqrt(np.square(price_deltas).mean(axis=1)),
+      'flow_delta': flow_deltas.sum(axis=1),
+      'worst_device': [self.labels[i] if flow_deltas[r, i] else '' for (r, i) in enumerate(worst)],
+      'worst_device_delta': flow_deltas[np.arange(len(worst)), worst],
+    }, index=self.names)
+    if tol is not None:
+      df['steps_to_tol'] = self.steps_to(tol)
+    return df
+
+  def write(self, output_dir, tol=None):
+    ''' Write the summary, per device and price deltas and convergence curves as CSVs. '''
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+    self.summary(tol).to_csv(output_dir + '/summary.csv')
+    pd.DataFrame(self.flow_deltas(), index=self.names, columns=self.labels).to_csv(output_dir + '/flow-deltas.csv')
+    pd.DataFrame(self.price_deltas(), index=self.names).to_csv(output_dir + '/price-deltas.csv')
+    self.convergence().to_csv(output_dir + '/convergence.csv', index_label='step')
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Compare runs of the same scenario against the first.')
+  parser.add_argument('run_dirs', nargs='+',
+    help='directories of runs (@see run.py). The first is the reference'
+  )
+  parser.add_argument('--tol', '-t',
+    dest='tol', type=float, default=None,
+    help='also report the first step each run got max |excess| within TOL'
+  )
+  parser.add_argument('-o',
+    dest='output_dir', type=str, default=None,
+    help='directory to write summary, flow, price delta and convergence CSVs to'
+  )
+  args = parser.parse_args()
+  for run_dir in args.run_dirs:
+    if not os.path.isdir(run_dir):
+      print('Not a directory [%s]' % (run_dir,))
+      sys.exit(1)
+  comparison = RunComparison(args.run_dirs)
+  with pd.option_context('display.width', 200, 'display.max_columns', 20):
+    print(comparison.summary(args.tol).to_string(float_format=lambda v: '%.4g' % (v,)))
+  if args.output_dir:
+    comparison.write(args.output_dir, args.tol)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,26 @@
+''' device_kit API differences. Older device_kit devices have a utility u(s, p), which agents
+maximize; newer ones have a cost(s, p), which is minimized, with deriv() and hess() of that. Code
+that needs the value of a device or deviceset goes through these so it works with either.
+'''
+import numpy as np
+
+
+def utility(device, s, p=0):
+  ''' Utility of flows s at price p: u(s, p), or -cost(s, p). '''
+  if hasattr(device, 'u'):
+    return device.u(s, p)
+  return -device.cost(s, p)
+
+
+def utility_deriv(device, s, p=0):
+  ''' Derivative of utility() with respect to flows: -deriv() of a cost device, deriv() of a utility one. '''
+  if hasattr(device, 'cost'):
+    return -np.asarray(device.deriv(s, p))
+  return device.deriv(s, p)
+
+
+def cost(device, s, p=0):
+  ''' Cost of flows s at price p: cost(s, p), or -u(s, p). '''
+  if hasattr(device, 'cost'):
+    return device.cost(s, p)
+  return -device.u(s, p)
@@ -0,0 +1,117 @@
+''' Compression of agent bids on their way back to the network. Every step every agent sends back its
+whole flow slice, though usually little of it changed. With a BidCodec the agent side instead sends
+the change from its start point s0 - which the network sent it, and so already has - leaving out
+unchanged (or below `threshold`) cells, optionally only the `topk` largest changes, and optionally
+quantized to `bits` bit integers.
+
+The lossy options are made safe by error feedback: the network only ever holds the decoded bid, and
+that's the s0 the agent gets next step, so whatever was dropped or rounded off is still in the
+difference between the agent's next bid and s0 and is sent then. Near equilibrium bids stop changing
+and the residual error is sent down to nothing, so the equilibrium found is the same, it may just
+take a few more steps. @see Network.map_agents().
+
+Compression is one way, agent to network. The price and start point going out to agents are sent in
+full: a backend's tasks can land on any worker, and workers keep no state between steps, so there's
+no previous broadcast on the far side to encode against. Network.traffic counts both directions, so
+what compression saves overall is the received bytes saved out of sent plus received.
+'''
+import math
+import numpy as np
+
+
+class CompressedBid():
+  ''' A bid encoded relative to a start point s0: s = s0 + scatter of values*scale at indices into the
+  flattened shape. indices is None when all cells are sent. scale is None when values are unquantized.
+  '''
+  __slots__ = ('shape', 'indices', 'values', 'scale')
+
+  def __init__(self, shape, indices, values, scale=None):
+    self.shape = tuple(shape)
+    self.indices = indices
+    self.values = values
+    self.scale = scale
+
+  def __getstate__(self):
+    return (self.shape, self.indices, self.values, self.scale)
+
+  def __setstate__(self, state):
+    (self.shape, self.indices, self.values, self.scale) = state
+
+  @property
+  def nbytes(self):
+    ''' Payload bytes: indices, values, and the scale if any. '''
+    return (self.indices.nbytes if self.indices is not None else 0) + self.values.nbytes + (8 if self.scale is not None else 0)
+
+
+class BidCodec():
+  ''' Encodes bids as changes from their start point. Options are:
+
+    - threshold: changes of magnitude <= threshold aren't sent. 0 sends every cell that changed at all.
+    - topk: only send this fraction (0, 1] of the cells, the largest changes.
+    - bits: quantize the changes to bits bit integers (8, 16 or 32) scaled to the largest change.
+
+  Whichever of the sparse or dense form is smaller is sent. Only bids going back to the network are
+  encoded; the broadcast to agents isn't.
+  '''
+  threshold = 0
+  topk = None
+  bits = None
+
+  def __init__(self, threshold=None, topk=None, bits=None):
+    self.threshold = threshold if threshold is not None else self.threshold
+    self.topk = topk
+    self.bits = bits
+    if topk is not None and not 0 < topk <= 1:
+      raise ValueError('topk must be a fraction in (0, 1], got %s' % (topk,))
+    if bits is not None and bits not in (8, 16, 32):
+      raise ValueError('bits must be one of 8, 16 or 32, got %s' % (bits,))
+
+  def __eq__(self, other):
+    return isinstance(other, BidCodec) and self.to_dict() == other.to_dict()
+
+  def __hash__(self):
+    return hash(tuple(sorted(self.to_dict().items())))
+
+  def __repr__(self):
+    return 'BidCodec(%s)' % (', '.join('%s=%s' % kv for kv in self.to_dict().items()),)
+
+  def to_dict(self):
+    return {'threshold': self.threshold, 'topk': self.topk, 'bits': self.bits}
+
+  def encode(self, s, s0):
+    ''' Encode bid s as a CompressedBid relative to start point s0. '''
+    s = np.asarray(s)
+    d = (s - np.asarray(s0, dtype=s.dtype).reshape(s.shape)).ravel()
+    indices = np.flatnonzero(np.abs(d) > self.threshold)
+    if self.topk is not None:
+      k = max(1, math.ceil(self.topk*d.size))
+      if len(indices) > k:
+        indices = np.sort(indices[np.argpartition(-np.abs(d[indices]), k - 1)[0:k]])
+    indices = indices.astype(np.int32)
+    values = d[indices]
+    if self.bits and len(values):
+      itype = np.dtype('int%d' % (self.bits,))
+      scale = float(np.abs(values).max())/np.iinfo(itype).max
+      values = np.round(values/scale).astype(itype) if scale else np.zeros(len(values), dtype=itype)
+    else:
+      scale = None
+    if len(indices)*(indices.itemsize + values.itemsize) >= d.size*values.itemsize:
+      dense = np.zeros(d.size, dtype=values.dtype)
+      dense[indices] = values
+      return CompressedBid(s.shape, None, dense, scale)
+    return CompressedBid(s.shape, indices, values, scale)
+
+  def decode(self, bid, s0):
+    ''' Inverse of encode(), in s0's dtype. Anything that isn't a CompressedBid - an uncompressed
+    bid, say the start point returned for an agent that failed - is returned as is.
+    '''
+    if not isinstance(bid, CompressedBid):
+      return bid
+    s0 = np.asarray(s0)
+    values = bid.values*bid.scale if bid.scale is not None else bid.values
+    d = np.zeros(int(np.prod(bid.shape)))
+    if bid.indices is None:
+      d[:] = values
+    else:
+      d[bid.indices] = values
+    return (s0.reshape(bid.shape) + d.reshape(bid.shape)).astype(s0.dtype)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+''' Monte Carlo ensembles of a scenario. A perturbation function - perturb(deviceset, rng) - makes
+randomised variants of the scenario's deviceset (preferences, arrival times, supply costs ...), one per
+member, each with its own reproducible seed spawned from a base seed. Each member's market is run on a
+bounded process pool, and members' final prices, flows and convergence statistics are folded into
+streaming aggregates as they finish: exact mean and std (Welford) and quantiles from a fixed size
+reservoir sample. Memory use doesn't grow with the number of members. Example:
+
+    ./ensemble.py scenario/lcl/lcl_scenario.py -n 200 --perturb my_perturbations.shift_arrivals -o lcl-ensemble
+
+If --perturb isn't given the scenario module's own perturb() is used.
+'''
+import os
+import sys
+import copy
+import argparse
+import importlib
+import logging
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting.summary import summarize
+from device_kit_market_simulations.run import load_scenario, make_module_path, parse_scenario_args
+
+
+logging.basicConfig()
+logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+_devicesets = {}  # Per process cache of built base devicesets by scenario. @see run_member().
+
+
+class StreamingStats():
+  ''' Streaming statistics of a stream of equally shaped arrays. Mean and variance are exact (Welford's
+  algorithm); quantiles are estimated from a uniform reservoir sample of `reservoir` whole arrays.
+  Memory is O(reservoir * array size) however many arrays are added.
+  '''
+  count = 0
+  reservoir_size = 256
+
+  def __init__(self, shape, reservoir=None, seed=None):
+    self.reservoir_size = reservoir if reservoir is not None else self.reservoir_size
+    self.count = 0
+    self._mean = np.zeros(shape)
+    self._m2 = np.zeros(shape)
+    self.min = np.full(shape, np.inf)
+    self.max = np.full(shape, -np.inf)
+    self.reservoir = np.empty((self.reservoir_size,) + tuple(shape))
+    self.rng = np.random.default_rng(seed)
+
+  def update(self, x):
+    x = np.asarray(x, dtype=float)
+    self.count += 1
+    delta = x - self._mean
+    self._mean += delta/self.count
+    self._m2 += delta*(x - self._mean)
+    self.min = np.minimum(self.min, x)
+    self.max = np.maximum(self.max, x)
+    if self.count <= self.reservoir_size:
+      self.reservoir[self.count - 1] = x
+    else:
+      j = self.rng.integers(0, self.count)
+      if j < self.reservoir_size:
+        self.reservoir[j] = x
+
+  @property
+  def mean(self):
+    return self._mean
+
+  @property
+  def std(self):
+    return np.sqrt(self._m2/(self.count - 1)) if self.count > 1 else np.zeros(self._mean.shape)
+
+  def quantiles(self, qs):
+    ''' Array of shape (len(qs),) + shape of the estimated quantiles. '''
+    return np.quantile(self.reservoir[0:min(self.count, self.reservoir_size)], qs, axis=0)
+
+
+def resolve_perturb(scenario, perturb=None):
+  ''' Get the perturbation function: `perturb` is a fully qualified function name, else the
+  scenario module's perturb().
+  '''
+  if perturb:
+    (module, fn) = make_module_path(perturb).rsplit('.', 1)
+    return getattr(importlib.import_module(module), fn)
+  module = importlib.import_module(make_module_path(scenario))
+  if not hasattr(module, 'perturb'):
+    raise ValueError('Scenario "%s" has no perturb() and no --perturb was given' % (scenario,))
+  return module.perturb
+
+
+def run_member(x):
+  ''' Pool entry point. Build member i's deviceset - the scenario's, deep copied and perturbed with a
+  generator seeded from `seed` - run its market serially and return its final state and statistics.
+  '''
+  (i, seed, scenario, scenario_args, perturb, network_params) = x
+  if scenario not in _devicesets:
+    _devicesets[scenario] = load_scenario(scenario, scenario_args)[0]
+  deviceset = copy.deepcopy(_devicesets[scenario])
+  deviceset = resolve_perturb(scenario, perturb)(deviceset, np.random.default_rng(seed)) or deviceset
+  network = Network(deviceset, backend='serial', **network_params)
+  try:
+    network.run([])
+  except Exception as e:
+    return (i, None, '%s: %s' % (e.__class__.__name__, e))
+  summary = summarize(network)
+  return (i, {
+    'price': network.price,
+    's': network.s,
+    'steps': network.steps,
+    'stable': summary.stable,
+    'utility': summary.utility,
+    'excess_max': np.abs(summary.excess).max(),
+    'load_factor': summary.load_factor,
+  }, None)
+
+
+class Ensemble():
+  ''' Ensemble of `n` perturbed members of `scenario`, run over a Pool of `processes`. Member i gets
+  the i-th seed spawned from `seed`, so any member can be reproduced alone.
+  '''
+  scalars = ['steps', 'stable', 'utility', 'excess_max', 'load_factor']
+  stats = None        # Name to StreamingStats, once run.
+  failures = []       # (member, error) of members whose run failed.
+
+  def __init__(self, scenario, n, perturb=None, seed=0, scenario_args=None, network_params=None, processes=None, reservoir=None):
+    self.scenario = scenario
+    self.n = n
+    self.perturb = perturb
+    self.seed = seed
+    self.scenario_args = scenario_args or {}
+    self.network_params = network_params or {}
+    self.processes = processes
+    self.reservoir = reservoir
+    self.stats = None
+    self.failures = []
+
+  def member_seed(self, i):
+    ''' Seed of member i. The same as the i-th of SeedSequence(seed).spawn(n), made on demand. '''
+    return np.random.SeedSequence(self.seed, spawn_key=(i,))
+
+  def tasks(self):
+    for i in range(0, self.n):
+      yield (i, self.member_seed(i), self.scenario, self.scenario_args, self.perturb, self.network_params)
+
+  def run(self):
+    ''' Run all members and aggregate them as they finish. Returns stats. '''
+    with Pool(self.processes) as pool:
+      for (i, result, error) in pool.imap_unordered(run_member, self.tasks()):
+        if error:
+          logger.warning('Ensemble member %d failed [%s]', i, error)
+          self.failures.append((i, error))
+          continue
+        self.add(result)
+        logger.info('Ensemble member %d done in %d steps (%d/%d)', i, result['steps'], self.stats['price'].count, self.n)
+    return self.stats
+
+  def add(self, result):
+    if self.stats is None:
+      self.stats = {k: StreamingStats(np.shape(result[k]), self.reservoir, self.seed) for k in ['price', 's'] + self.scalars}
+    if np.shape(result['s']) != self.stats['s'].mean.shape:
+      raise ValueError('Perturbed devicesets must keep the shape of the deviceset')
+    for (k, stats) in self.stats.items():
+      stats.update(result[k])
+
+  def summary(self, qs=(0.05, 0.5, 0.95)):
+    ''' DataFrame of count, mean, std, min, max and quantiles of the scalar statistics. '''
+    rows = {}
+    for k in self.scalars:
+      stats = self.stats[k]
+      row = {'count': stats.count, 'mean': stats.mean, 'std': stats.std, 'min': stats.min, 'max': stats.max}
+      row.update({'q%g' % (q,): v for (q, v) in zip(qs, stats.quantiles(qs))})
+      rows[k] = {name: float(v) for (name, v) in row.items()}
+    return pd.DataFrame(rows).transpose()
+
+  def write(self, output_dir, qs=(0.05, 0.5, 0.95)):
+    ''' Write summary.csv and ensemble.npz holding mean, std and quantiles of price and flows. '''
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+    self.summary(qs).to_csv(output_dir + '/summary.csv')
+    arrays = {'quantiles': np.array(qs)}
+    for k in ['price', 's']:
+      arrays.update({
+        '%s_mean' % (k,): self.stats[k].mean,
+        '%s_std' % (k,): self.stats[k].std,
+        '%s_quantiles' % (k,): self.stats[k].quantiles(qs),
+      })
+    np.savez_compressed(output_dir + '/ensemble.npz', **arrays)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Run a Monte Carlo ensemble of perturbed variants of a scenario.')
+  parser.add_argument('scenario', action='store',
+    help='name of a python module containing device_kit scenario'
+  )
+  parser.add_argument('-n', dest='n', type=int, default=100,
+    help='number of ensemble members'
+  )
+  parser.add_argument('--perturb', dest='perturb', type=str, default=None,
+    help='fully qualified name of a perturb(deviceset, rng) function. Defaults to the scenario\'s perturb()'
+  )
+  parser.add_argument('--seed', dest='seed', type=int, default=0,
+    help='base seed members\' seeds are spawned from'
+  )
+  parser.add_argument('--scenario-arg', '-a', dest='scenario_args', action='append', default=[],
+    help='KEY=VALUE argument to the scenario\'s make_deviceset(). Repeatable'
+  )
+  parser.add_argument('--stepsize', '-l', dest='stepsize', type=str, default=None,
+    help='step size gradient ascent. Can be an expression'
+  )
+  parser.add_argument('--tol', '-t', dest='tol', type=float, default=None,
+    help='tolerance for convergence of solution'
+  )
+  parser.add_argument('--maxsteps', '-i', dest='maxsteps', type=int, default=None,
+    help='maximum number of iterations to perform'
+  )
+  parser.add_argument('--agent-strategy', '-x', dest='agent_strategy', default=None,
+    help='agent bid strategy'
+  )
+  parser.add_argument('--quantiles', '-q', dest='quantiles', default='0.05,0.5,0.95',
+    type=lambda v: tuple(float(q) for q in v.split(',')),
+    help='comma separated quantiles to report'
+  )
+  parser.add_argument('--reservoir', dest='reservoir', type=int, default=None,
+    help='number of members sampled for quantile estimates'
+  )
+  parser.add_argument('-j', dest='processes', type=int, default=None,
+    help='number of processes to run members on'
+  )
+  parser.add_argument('-o', dest='output_dir', type=str, default=None,
+    help='directory to write summary.csv and ensemble.npz to'
+  )
+  args = parser.parse_args()
+  network_params = {k: v for (k, v) in vars(args).items() if k in ['stepsize', 'tol', 'maxsteps', 'agent_strategy'] and v is not None}
+  ensemble = Ensemble(
+    args.scenario, args.n, args.perturb, args.seed, parse_scenario_args(args.scenario_args), network_params,
+    args.processes, args.reservoir
+  )
+  ensemble.run()
+  if ensemble.stats is None:
+    logger.error('All ensemble members failed')
+    sys.exit(1)
+  with pd.option_context('display.width', 200):
+    print(ensemble.summary(args.quantiles).to_string(float_format=lambda v: '%.4g' % (v,)))
+  if ensemble.failures:
+    print('%d members failed' % (len(ensemble.failures),))
+  if args.output_dir:
+    ensemble.write(args.output_dir, args.quantiles)
+
+
+if __name__ == '__main__':
+  main()
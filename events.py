@@ -0,0 +1,91 @@
+''' Listeners of Network runs. Network.run() sends events - 'before-start', 'after-step', 'agent-failure'
+and 'after-done' - to listeners, callbacks of the form cb(network, event). An EventBus holds the
+subscriptions: each says which events it wants, for step events how often, and its priority.
+
+    bus = EventBus()
+    bus.subscribe(writer.update, events=['after-step'], every=10)   # Steps 1, 10, 20, ... and the last.
+    bus.subscribe(print_progress, priority=10)                      # Everything, before the writer.
+    network.run(bus)
+
+Events a listener doesn't want cost a dict lookup, and steps it doesn't want an integer test, so
+instrumentation only costs anything on the steps it is interested in. A plain list of callbacks is
+still accepted anywhere a bus is, and means every event, every step.
+'''
+
+
+step_events = ('after-step', 'agent-failure')  # Events sent every step, which `every` applies to.
+
+
+class Listener():
+  ''' A subscription of `cb` to `events` - all events if None. Step events are only sent every
+  `every`-th step, plus the first and last step. Listeners with higher `priority` are called first,
+  listeners with the same priority in the order they subscribed.
+  '''
+  cb = None
+  events = None
+  every = 1
+  priority = 0
+
+  def __init__(self, cb, events=None, every=1, priority=0):
+    if every < 1:
+      raise ValueError('every must be at least 1, got %s' % (every,))
+    self.cb = cb
+    self.events = frozenset(events) if events is not None else None
+    self.every = every
+    self.priority = priority
+
+  def wants(self, event, steps, last=False):
+    ''' Whether to send `event` on step `steps`. `last` is whether it is the run's last step. '''
+    if self.every == 1 or event not in step_events:
+      return True
+    return steps % self.every == 0 or steps == 1 or last
+
+
+class EventBus():
+  ''' Subscriptions to a Network's events, in the order they're called. '''
+  listeners = []
+
+  def __init__(self, listeners=()):
+    self.listeners = []
+    self._index = {}    # Event to listeners that want it, in call order.
+    self._any = []      # Listeners that want any event, in call order.
+    for listener in listeners:
+      self.subscribe(listener)
+
+  @classmethod
+  def of(cls, listeners):
+    ''' `listeners` if it's already an EventBus, else a bus of the callbacks or Listeners in it. '''
+    return listeners if isinstance(listeners, EventBus) else cls(listeners)
+
+  def __len__(self):
+    return len(self.listeners)
+
+  def subscribe(self, cb, events=None, every=1, priority=0):
+    ''' Subscribe callback `cb` (@see Listener), or a Listener as is. Returns the Listener. '''
+    listener = cb if isinstance(cb, Listener) else Listener(cb, events, every, priority)
+    self.listeners.append(listener)
+    self._reindex()
+    return listener
+
+  def unsubscribe(self, listener):
+    ''' Remove a Listener, or every subscription of a callback. '''
+    self.listeners = [l for l in self.listeners if l is not listener and l.cb is not listener]
+    self._reindex()
+
+  def wants(self, event):
+    ''' Whether anyone is subscribed to `event` at all. '''
+    return bool(self._index.get(event, self._any))
+
+  def emit(self, network, event, last=False):
+    ''' Send `event` to the listeners that want it at network's current step. '''
+    for listener in self._index.get(event, self._any):
+      if listener.wants(event, network.steps, last):
+        listener.cb(network, event)
+
+  def _reindex(self):
+    ordered = sorted(self.listeners, key=lambda l: -l.priority)
+    events = set()
+    for listener in ordered:
+      events |= listener.events or set()
+    self._any = [l for l in ordered if l.events is None]
+    self._index = {event: [l for l in ordered if l.events is None or event in l.events] for event in events}
@@ -0,0 +1,141 @@
+''' Memo cache of agent price responses. Agents are often asked to bid at (nearly) the same price -
+every run starts from zero price, oscillating runs revisit prices, and sweeps repeat whole runs - and
+each bid is a full solve. ResponseCache remembers responses keyed on the device, the strategy, the
+price vector quantized to `quantum`, prox, and where the response depends on it, the start point.
+It's used on the coordinator side (@see Network.map_agents()), so hits aren't even dispatched to
+workers. Responses are kept in memory in an LRU per agent - so an agent bidding at many distinct
+prices only evicts its own responses - and optionally in an SQLite file shared between processes
+and runs. Writes to the file are buffered and committed once per step (@see flush()).
+'''
+import pickle
+import sqlite3
+import hashlib
+import logging
+from collections import OrderedDict
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache():
+  ''' Per agent LRU cache of agent responses, optionally backed by an SQLite file at `path`. Keys
+  are "<device fingerprint>:<digest>"; the part before the last ":" picks the agent's LRU.
+  '''
+  maxsize = 256       # Max responses held in memory per agent.
+  quantum = 1e-6      # Prices (and start points) are rounded to multiples of this for keys.
+  path = None
+  hits = misses = disk_hits = evictions = 0
+
+  def __init__(self, maxsize=None, quantum=None, path=None):
+    self.maxsize = maxsize if maxsize is not None else self.maxsize
+    self.quantum = quantum if quantum is not None else self.quantum
+    self.path = path
+    self.responses = {}
+    self.pending = OrderedDict()
+    self.fingerprints = {}
+    self.hits = self.misses = self.disk_hits = self.evictions = 0
+    self.conn = None
+    if path:
+      self.conn = sqlite3.connect(path, timeout=30)
+      self.conn.execute('pragma journal_mode=wal')
+      self.conn.execute('create table if not exists responses (key text primary key, value blob)')
+
+  def close(self):
+    if self.conn:
+      self.flush()
+      self.conn.close()
+      self.conn = None
+
+  def fingerprint(self, device):
+    ''' Content hash of device, computed once per device object. None if it can't be pickled. '''
+    cached = self.fingerprints.get(id(device))
+    if cached is not None and cached[0] is device:
+      return cached[1]
+    try:
+      fingerprint = hashlib.sha256(pickle.dumps(device)).hexdigest()
+    except Exception as e:
+      logger.warning('Not caching responses of %s. Can\'t fingerprint it [%s]', device.id, e)
+      fingerprint = None
+    self.fingerprints[id(device)] = (device, fingerprint)
+    return fingerprint
+
+  def key(self, task, uses_s0=True):
+    ''' Key of an agent task (strategy, device, p, s0, prox, timeout), or None if it can't be cached.
+    s0 is only part of the key if `uses_s0`: whether the response depends on the start point.
+    '''
+    (strategy, device, p, s0, prox, timeout) = task
+    fingerprint = self.fingerprint(device)
+    if fingerprint is None:
+      return None
+    h = hashlib.sha256(fingerprint.encode())
+    h.update(('%s.%s|%r|%s' % (strategy.__module__, strategy.__name__, prox, np.asarray(s0).dtype)).encode())
+    h.update(self._quantize(p).tobytes())
+    if uses_s0:
+      h.update(self._quantize(s0).tobytes())
+    return '%s:%s' % (fingerprint, h.hexdigest())
+
+  def get(self, key):
+    ''' Get the cached response for key, or None. '''
+    responses = self.responses.get(self._agent(key), {})
+    if key in responses:
+      responses.move_to_end(key)
+      self.hits += 1
+      return responses[key]
+    if key in self.pending:
+      self._remember(key, self.pending[key])
+      self.hits += 1
+      return self.pending[key]
+    if self.conn:
+      row = self.conn.execute('select value from responses where key = ?', (key,)).fetchone()
+      if row:
+        response = pickle.loads(row[0])
+        self._remember(key, response)
+        (self.hits, self.disk_hits) = (self.hits + 1, self.disk_hits + 1)
+        return response
+    self.misses += 1
+    return None
+
+  def put(self, key, response):
+    ''' Cache response for key. Writes to the file are only buffered; @see flush(). '''
+    self._remember(key, response)
+    if self.conn:
+      self.pending[key] = response
+
+  def flush(self):
+    ''' Write buffered responses to the file in a single transaction. Network.map_agents() calls
+    this once per step, so the coordinator doesn't wait on a commit per response.
+    '''
+    if self.conn and self.pending:
+      with self.conn:
+        self.conn.executemany(
+          'insert or replace into responses (key, value) values (?, ?)',
+          [(key, pickle.dumps(response)) for (key, response) in self.pending.items()]
+        )
+      self.pending.clear()
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'disk_hits': self.disk_hits,
+      'evictions': self.evictions,
+      'size': sum(len(responses) for responses in self.responses.values()),
+      'agents': len(self.responses),
+      'hit_rate': self.hits/lookups if lookups else 0,
+    }
+
+  def _remember(self, key, response):
+    responses = self.responses.setdefault(self._agent(key), OrderedDict())
+    responses[key] = response
+    responses.move_to_end(key)
+    while len(responses) > self.maxsize:
+      responses.popitem(last=False)
+      self.evictions += 1
+
+  def _agent(self, key):
+    return key.rpartition(':')[0]
+
+  def _quantize(self, a):
+    return np.round(np.asarray(a, dtype=float)/self.quantum).astype(np.int64)
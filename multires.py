@@ -0,0 +1,289 @@
+''' Coarse to fine (multi-resolution) market clearing. Long fine grained horizons - 5 minute slots over
+days say - make every step expensive. MultiResolution first clears the market on coarsened horizons,
+where `factor` slots are aggregated into one, then upsamples each equilibrium as the warm start of the
+next finer level, and finally of the full resolution network. Most steps are then spent on the small
+coarse problems, and the full resolution run only has to refine.
+
+A CoarseDevice presents a device over the coarse horizon. A coarse flow is the total flow over the
+block of fine slots it covers, and is spread back over those slots by interpolating between each
+cell's bounds - every fine cell in a block sits at the same fraction of the way from its lower to
+upper bound - so any coarse flow within the coarse bounds is a feasible fine flow (as far as cell
+bounds go). Where bounds aren't finite the flow is spread evenly. Coarse prices are the mean of the
+fine prices over the block, and upsample to fine prices by repeating. Idle slots, where nothing can
+be consumed, are the exception: their flows are pinned to zero and their price to the cold start
+price of zero (@see CoarseDeviceSet).
+'''
+import time
+import logging
+import contextlib
+import numpy as np
+from scipy import linalg
+from device_kit_market_simulations.compat import utility, cost
+
+
+logger = logging.getLogger(__name__)
+
+
+def coarse_blocks(length, factor):
+  ''' Index of the coarse slot each of `length` fine slots falls in, and start of each block. '''
+  blocks = np.arange(0, length)//factor
+  return (blocks, np.arange(0, length, factor))
+
+
+class CoarseDevice():
+  ''' View of `device` over a horizon coarsened by `factor`. Like windows.WindowedDevice it looks
+  enough like a device to be passed to device_kit.solve() and step(). Fine flows are base + weights
+  times the coarse flow of their block, and the cost, its derivatives and the constraints are
+  evaluated on that (@see upsample()), with derivatives carried back to the coarse flows by chain().
+  Fine cells in `idle` slots (@see CoarseDeviceSet) whose bounds allow it are pinned to zero flow.
+  '''
+  device = None
+  factor = 1
+  base = weights = None   # Fine flow is base + weights*coarse flow of the block. Both device.shape.
+  coarse_bounds = None    # (rows*coarse slots, 2) array.
+
+  def __init__(self, device, factor, idle=None):
+    self.device = device
+    self.factor = factor
+    (rows, length) = device.shape
+    (self.blocks, self.starts) = coarse_blocks(length, factor)
+    bounds = np.array(device.bounds, dtype=float).reshape(rows, length, 2)
+    (lo, hi) = (bounds[..., 0], bounds[..., 1])
+    pinned = (idle if idle is not None else np.zeros(length, dtype=bool)) & (lo <= 0) & (hi >= 0)
+    (lo, hi) = (np.where(pinned, 0, lo), np.where(pinned, 0, hi))
+    (lo_sum, hi_sum) = (self.downsample(lo), self.downsample(hi))
+    sizes = np.add.reduceat((~pinned).astype(float), self.starts, axis=1)  # Free cells per block.
+    finite = np.isfinite(lo_sum) & np.isfinite(hi_sum)
+    span = (hi_sum - lo_sum)[:, self.blocks]
+    interpolate = finite[:, self.blocks] & (span > 0)
+    even = np.where(pinned, 0, 1/np.maximum(sizes, 1)[:, self.blocks])
+    self.weights = np.where(interpolate, (hi - lo)/np.where(interpolate, span, 1), even)
+    self.base = np.where(finite[:, self.blocks], lo - self.weights*np.where(finite, lo_sum, 0)[:, self.blocks], 0)
+    # Where flow is spread evenly every free fine cell must be within its bounds.
+    free = sizes[..., None] > 0
+    even = np.where(free, np.stack((
+      np.maximum.reduceat(np.where(pinned, -np.inf, lo), self.starts, axis=1),
+      np.minimum.reduceat(np.where(pinned, np.inf, hi), self.starts, axis=1),
+    ), axis=-1), 0)*sizes[..., None]
+    self.coarse_bounds = np.where(finite[..., None], np.stack((lo_sum, hi_sum), axis=-1), even).reshape(-1, 2)
+
+  def __len__(self):
+    return len(self.starts)
+
+  @property
+  def id(self):
+    return self.device.id
+
+  @property
+  def shape(self):
+    return (self.device.shape[0], len(self.starts))
+
+  @property
+  def bounds(self):
+    return self.coarse_bounds
+
+  @property
+  def constraints(self):
+    ''' The device's constraints over the upsampled flow matrix, with Jacobians by the chain rule. '''
+    constraints = []
+    for constraint in self.device.constraints:
+      c = {
+        'type': constraint['type'],
+        'fun': lambda s, f=constraint['fun']: f(self.upsample(s).flatten()),
+      }
+      if 'jac' in constraint:
+        c['jac'] = lambda s, f=constraint['jac']: self.chain(f(self.upsample(s).flatten()))
+      constraints += [c]
+    return constraints
+
+  def u(self, s, p):
+    return utility(self.device, self.upsample(s), self.upsample_price(p))
+
+  def cost(self, s, p):
+    return cost(self.device, self.upsample(s), self.upsample_price(p))
+
+  def deriv(self, s, p):
+    jac = np.asarray(self.device.deriv(self.upsample(s), self.upsample_price(p))).flatten()
+    return self.chain(jac).reshape(self.shape)
+
+  def hess(self, s, p=0):
+    ''' W'HW, H being the device's Hessian over the upsampled flows and W the upsampling weights. '''
+    hess = np.asarray(self.device.hess(self.upsample(s), self.upsample_price(p)), dtype=float)
+    return self.chain(self.chain(hess).transpose())
+
+  def project(self, s):
+    return self.downsample(self.device.project(self.upsample(s)))
+
+  def upsample(self, s):
+    ''' Coarse flows to the device's fine flow matrix. '''
+    return self.base + self.weights*np.asarray(s, dtype=float).reshape(self.shape)[:, self.blocks]
+
+  def upsample_price(self, p):
+    return np.asarray(p)[self.blocks] if np.ndim(p) else p
+
+  def downsample(self, s):
+    ''' Fine flows, or anything summed over blocks, to coarse. '''
+    s = np.asarray(s, dtype=float).reshape(self.device.shape)
+    return np.add.reduceat(s, self.starts, axis=1)
+
+  def downsample_price(self, p):
+    return np.add.reduceat(np.asarray(p, dtype=float), self.starts)/np.bincount(self.blocks) if np.ndim(p) else p
+
+  def chain(self, jac):
+    ''' Jacobian with respect to the fine flow matrix - (..., rows*fine slots) - to the coarse one. '''
+    jac = np.asarray(jac, dtype=float)
+    lead = jac.shape[0:-1]
+    jac = jac.reshape(lead + tuple(self.device.shape))*self.weights
+    return np.add.reduceat(jac, self.starts, axis=-1).reshape(lead + (-1,))
+
+
+class CoarseDeviceSet():
+  ''' A deviceset with each top level device replaced by its CoarseDevice. Has the parts of the
+  DeviceSet interface Network uses.
+
+  Idle slots - fine slots no device can take any flow into - only clear at zero flow, so flows there
+  are pinned to zero and the coarse market of a partly idle block is that of its busy slots. Prices
+  are upsampled by repeating the coarse price over its block, except in idle slots where it's left at
+  the cold start price of zero. Otherwise the busy slots' price is carried into idle slots, far from
+  the fine equilibrium, and only decays by the supply response each step.
+  '''
+  deviceset = None
+  factor = 1
+  devices = []
+  idle = None         # Whether each fine slot is idle.
+  busy = None         # Number of fine slots that aren't idle in each coarse slot.
+
+  def __init__(self, deviceset, factor):
+    self.deviceset = deviceset
+    self.factor = factor
+    hi = np.array(deviceset.bounds, dtype=float).reshape(tuple(deviceset.shape) + (2,))[..., 1]
+    self.idle = (hi <= 0).all(axis=0)
+    self.busy = np.add.reduceat((~self.idle).astype(int), coarse_blocks(len(deviceset), factor)[1])
+    self.devices = [CoarseDevice(device, factor, self.idle) for device in deviceset.devices]
+    self.slices = [(coarse, _slice) for (coarse, (device, _slice)) in zip(self.devices, deviceset.slices)]
+    self.ids = [_id for (_id, _) in deviceset.map(np.zeros(deviceset.shape))]
+    (self.blocks, self.starts) = coarse_blocks(len(deviceset), factor)
+
+  def __len__(self):
+    return len(self.starts)
+
+  @property
+  def id(self):
+    return self.deviceset.id
+
+  @property
+  def shape(self):
+    return (self.deviceset.shape[0], len(self))
+
+  def u(self, s, p):
+    s = np.asarray(s).reshape(self.shape)
+    return sum(device.u(s[slice(*_slice),:], p) for (device, _slice) in self.slices)
+
+  def cost(self, s, p):
+    s = np.asarray(s).reshape(self.shape)
+    return sum(device.cost(s[slice(*_slice),:], p) for (device, _slice) in self.slices)
+
+  def deriv(self, s, p):
+    s = np.asarray(s).reshape(self.shape)
+    return np.vstack([device.deriv(s[slice(*_slice),:], p) for (device, _slice) in self.slices])
+
+  def hess(self, s, p=0):
+    ''' Block diagonal of the devices' Hessians. '''
+    s = np.asarray(s).reshape(self.shape)
+    return linalg.block_diag(*[device.hess(s[slice(*_slice),:], p) for (device, _slice) in self.slices])
+
+  def map(self, s):
+    return zip(self.ids, np.asarray(s).reshape(self.shape))
+
+  def upsample(self, s):
+    s = np.asarray(s).reshape(self.shape)
+    return np.vstack([device.upsample(s[slice(*_slice),:]) for (device, _slice) in self.slices])
+
+  def upsample_price(self, p):
+    return np.where(self.idle, 0, np.asarray(p)[self.blocks])
+
+  def downsample(self, s):
+    s = np.asarray(s).reshape(self.deviceset.shape)
+    return np.add.reduceat(s, self.starts, axis=1)
+
+  def downsample_price(self, p):
+    ''' Mean fine price over the busy slots of each block, zero for blocks with none. '''
+    busy = ~self.idle
+    total = np.add.reduceat(np.where(busy, np.asarray(p, dtype=float), 0), self.starts)
+    count = np.add.reduceat(busy.astype(float), self.starts)
+    return np.where(count > 0, total/np.maximum(count, 1), 0)
+
+
+class MultiResolution():
+  ''' Clear `network` coarse to fine. `factors` are the coarsening factors of the levels run before
+  the full resolution network, coarsest first, e.g. (12, 3). Coarse levels copy the network's
+  settings, but since a coarse slot's excess is the sum of its busy fine slots' excesses (@see
+  CoarseDeviceSet), tol is scaled up by the factor and each coarse slot's gradient stepsize down by
+  its number of busy slots, so every slot converges at about the fine rate. `maxsteps`, if given,
+  limits coarse levels' steps instead of the network's maxsteps.
+  '''
+  network = None
+  factors = ()
+  maxsteps = None
+  results = []      # Per level dict of stats.
+
+  def __init__(self, network, factors, maxsteps=None):
+    if any(factor < 2 for factor in factors):
+      raise ValueError('Coarsening factors must be at least 2, got %s' % (factors,))
+    self.network = network
+    self.factors = sorted(factors, reverse=True)
+    self.maxsteps = maxsteps
+    self.results = []
+
+  def make_level(self, factor):
+    ''' Network over the deviceset coarsened by `factor`, with the network's settings. '''
+    network = self.network
+    deviceset = CoarseDeviceSet(network.deviceset, factor)
+    coarse = network.__class__(
+      deviceset, tol=network.tol*factor, stepsize=network.stepsize,
+      maxsteps=self.maxsteps if self.maxsteps else network.maxsteps, agent_workers=network.agent_workers,
+      agent_timeout=network.agent_timeout, sparse=network.sparse, backend=network.backend,
+      schedule=network.schedule, price_update=network.price_update, dtype=network.dtype, rho=network.rho_init,
+      compression=network.compression, prox=network.prox
+    )
+    coarse.agent_strategy = network.agent_strategy
+    coarse.stepsize_scale = network.stepsize_scale/np.maximum(deviceset.busy, 1)
+    (coarse.response_cache, coarse.profiles) = (network.response_cache, network.profiles)
+    return coarse
+
+  def run(self, listeners=(), pool=None):
+    ''' Clear each coarse level, warm starting each from the last, then run the full resolution
+    network from the upsampled result with `listeners`. Returns whether the full resolution run
+    converged.
+    '''
+    network = self.network
+    (price, s) = (None, None)
+    with (contextlib.nullcontext(pool) if pool else network.make_pool()) as pool:
+      for factor in self.factors:
+        level = self.make_level(factor)
+        if price is not None:
+          level.set_price(level.deviceset.downsample_price(price))
+          level.set_s(level.deviceset.downsample(s))
+        converged = self._run(level, factor, [], pool, warm_start=price is not None)
+        (price, s) = (level.deviceset.upsample_price(level.price), level.deviceset.upsample(level.s))
+      if price is not None:
+        network.set_price(price)
+        network.set_s(s, copy=True)
+      converged = self._run(network, 1, listeners, pool, warm_start=price is not None)
+    return converged
+
+  def _run(self, network, factor, listeners, pool, warm_start):
+    t = time.perf_counter()
+    converged = network.run(listeners, warm_start=warm_start, pool=pool)
+    result = {
+      'factor': factor,
+      'slots': len(network),
+      'steps': network.steps,
+      'converged': converged,
+      'excess_max': float(np.abs(network.excess).max()),
+      'elapsed': time.perf_counter() - t,
+    }
+    self.results.append(result)
+    logger.info('Level x%d (%d slots): %d steps, converged=%s, %.3fs', factor, result['slots'], result['steps'], converged, result['elapsed'])
+    return converged
+
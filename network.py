@@ -1,44 +1,252 @@
 import sys
+import time
+import cProfile
+import contextlib
 import logging
 import numpy as np
 import pandas as pd
 from scipy import linalg
-from multiprocessing import Pool
 from device_kit import DeviceSet, OptimizationException, solve, step
-from device_kit.sample_scenarios.lcl.lcl_scenario import make_deviceset
+from device_kit_market_simulations.backends import make_backend
+from device_kit_market_simulations.windows import WindowedDevice
+from device_kit_market_simulations.compression import BidCodec
+from device_kit_market_simulations.compat import utility
+from device_kit_market_simulations.events import EventBus
+from device_kit_market_simulations.batch import batch_u, batch_deriv
 
 
 logging.basicConfig()
 
 
+solver_options = {  # Default options to 'solver' - scipy.optimize.minimize - where it's used.
+  'ftol': 1e-06,
+  'maxiter': 500,
+  'disp': False,
+}
+relaxed_solver_options = {  # Options for one retry after an agent's solve fails with solver_options.
+  'ftol': 1e-04,
+  'maxiter': 2000,
+  'disp': False,
+}
+sensitivity_step = 1e-2   # Relative price perturbation used to estimate demand sensitivities.
+active_tol = 1e-5         # Bounds and inequality constraints within this (relative) of binding are active.
+
+
+class AgentFailureException(Exception):
+  ''' Every agent failed to bid on a step, so there is no market left to clear. '''
+  pass
+
+
+class AgentTimeoutException(Exception):
+  ''' An agent's solve ran past its time limit. '''
+  pass
+
+
+class _Deadline():
+  ''' solve() callback that aborts the solve once `timeout` seconds have passed. '''
+
+  def __init__(self, timeout):
+    self.deadline = time.time() + timeout
+
+  def __call__(self, *args):
+    if time.time() > self.deadline:
+      raise AgentTimeoutException('Solve exceeded time limit')
+
+
+def agent_update(x):
+  ''' Pool worker entry point. Runs the agent strategy x[0] on the rest of x - (device, p, s0, prox,
+  timeout) - and returns (s, error). If the strategy fails for any reason, error is a message and s is
+  the agent's previous bid s0, so one bad agent degrades the market rather than killing the run. s is
+  returned in the dtype of s0, so reduced precision networks get reduced precision bids back.
+  '''
+  (strategy, task) = (x[0], x[1:])
+  dtype = np.asarray(task[2]).dtype
+  try:
+    s = strategy(task)
+    if isinstance(s, tuple):
+      return ((np.asarray(s[0], dtype=dtype),) + s[1:], None)
+    return (np.asarray(s, dtype=dtype), None)
+  except Exception as e:
+    (device, p, s0) = task[0:3]
+    return (np.array(s0).reshape(device.shape), '%s: %s' % (e.__class__.__name__, e))
+
+
+def agent_update_profiled(x):
+  ''' agent_update() under cProfile. Returns (result, stats), stats being the raw profile stats
+  dict. Only used on backends that don't run solves inline on the coordinator's thread (@see
+  Network.map_agents()): starting a profiler there would replace the coordinator's. stats is None if
+  the interpreter only allows one active profiler and the coordinator's is it - with the thread
+  backend on Python 3.12+, say - in which case the coordinator profile includes the solve.
+  '''
+  profiler = cProfile.Profile()
+  try:
+    profiler.enable()
+  except ValueError:
+    return (agent_update(x), None)
+  try:
+    result = agent_update(x)
+  finally:
+    profiler.disable()
+  profiler.create_stats()
+  return (result, profiler.stats)
+
+
+class CompressedAgentUpdate():
+  ''' Pool entry point like agent_update(), or agent_update_profiled() if `profiled`, that sends the
+  bid back compressed by `codec` relative to the start point (@see compression.py). Sensitivities of
+  function bids are sent as is.
+  '''
+
+  def __init__(self, codec, profiled=False):
+    self.codec = codec
+    self.profiled = profiled
+
+  def __eq__(self, other):
+    return isinstance(other, CompressedAgentUpdate) and (self.codec, self.profiled) == (other.codec, other.profiled)
+
+  def __hash__(self):
+    return hash((self.codec, self.profiled))
+
+  def __call__(self, x):
+    if self.profiled:
+      (r, stats) = agent_update_profiled(x)
+      return (self.encode(r, x[3]), stats)
+    return self.encode(agent_update(x), x[3])
+
+  def encode(self, r, s0):
+    (s, error) = r
+    if isinstance(s, tuple):
+      return ((self.codec.encode(s[0], s0),) + s[1:], error)
+    return (self.codec.encode(s, s0), error)
+
+
+def bid_nbytes(s):
+  ''' Bytes of an agent's bid as sent back: the (maybe compressed) flows and any sensitivities. '''
+  if isinstance(s, tuple):
+    return bid_nbytes(s[0]) + sum(np.asarray(v).nbytes for v in s[1:])
+  return s.nbytes
+
+
 def agent_point_bid_update(x):
-  solver_options = {  # Default options to 'solver' - scipy.optimize.minimize - where it's used.
-    'ftol': 1e-06,
-    'maxiter': 500,
-    'disp': False,
-  }
-  (device, p, s0, prox) = x
+  (device, p, s0, prox, timeout) = x
+  cb = _Deadline(timeout) if timeout else None
   try:
-    result = solve(device, p, s0, solver_options=solver_options, prox=prox)
+    result = solve(device, p, s0, solver_options=solver_options, prox=prox, cb=cb)
   except OptimizationException as e:
-    logging.warn('OptimizationException on %s agent :\n%s', device.id, e)
+    logging.warning('OptimizationException on %s agent. Retrying with relaxed options:\n%s', device.id, e)
+    result = solve(device, p, s0, solver_options=relaxed_solver_options, prox=prox, cb=cb)
   return result[0].reshape(device.shape)
 
 
+def agent_function_bid_update(x):
+  ''' Function based bid. Returns the agent's optimal bid at p along with the diagonal of its demand
+  function's price Jacobian - d(net flow at t)/d(p at t) for each t. The Jacobian comes from the
+  device's Hessian (@see demand_sensitivity()), or for devices without one is estimated by finite
+  differences, one warm started re-solve per time slot. The Newton price update uses these
+  (@see Network.update_price()). prox isn't applied: the price update does the damping here.
+  '''
+  (device, p, s0, prox, timeout) = x
+  p = np.array(p, dtype=float)*np.ones(device.shape[1])
+  s = agent_point_bid_update((device, p, s0, None, timeout))
+  try:
+    sensitivity = demand_sensitivity(device, s, p)
+  except (AttributeError, NotImplementedError, ValueError, np.linalg.LinAlgError) as e:
+    logging.debug('No analytic sensitivity for %s agent, using finite differences [%s]', device.id, e)
+    sensitivity = finite_difference_sensitivity(device, s, p, _Deadline(timeout) if timeout else None)
+  return (s, np.minimum(sensitivity, 0))
+
+
+def demand_sensitivity(device, s, p):
+  ''' Diagonal of the price Jacobian of `device`'s optimal flows `s` at price `p`, from its Hessian.
+  Cells at a bound stay there for small price changes. The rest satisfy H ds = -dp on the tangent
+  space of the active constraints, so with Z a basis of that space ds/dp = -Z (Z'HZ)^-1 Z', which is
+  summed over rows per time slot.
+  '''
+  s = np.asarray(s, dtype=float).reshape(device.shape)
+  (rows, cols) = device.shape
+  x = s.flatten()
+  hess = np.asarray(device.hess(s, p), dtype=float)
+  if hess.shape != (len(x), len(x)):
+    raise ValueError('Hessian shape %s for %d flows' % (hess.shape, len(x)))
+  bounds = np.array(device.bounds, dtype=float)
+  near = active_tol*np.maximum(np.abs(bounds), 1)
+  free = (np.abs(x - bounds[:, 0]) > near[:, 0]) & (np.abs(x - bounds[:, 1]) > near[:, 1])
+  z = np.eye(len(x))[:, free]
+  active = [
+    _constraint_jac(c, x) for c in device.constraints
+    if c['type'] == 'eq' or c['fun'](x) <= active_tol*max(np.abs(x).sum(), 1)
+  ]
+  if active:
+    z = z @ linalg.null_space(np.vstack(active)[:, free])
+  if not z.shape[1]:
+    return np.zeros(cols)
+  e = z.T @ np.tile(np.eye(cols), (rows, 1))  # Tangent space to per time slot sums.
+  return -(e*(linalg.pinvh(z.T @ hess @ z) @ e)).sum(axis=0)
+
+
+def finite_difference_sensitivity(device, s, p, cb=None):
+  ''' demand_sensitivity() estimated by forward differences, one warm started re-solve per slot. '''
+  h = sensitivity_step*max(np.abs(p).max(), 1)
+  sensitivity = np.zeros(len(p))
+  for t in range(0, len(p)):
+    _p = p.copy()
+    _p[t] += h
+    _s = solve(device, _p, s, solver_options=solver_options, cb=cb)[0].reshape(device.shape)
+    sensitivity[t] = (_s[:, t] - s[:, t]).sum()/h
+  return sensitivity
+
+
+def _constraint_jac(constraint, x, h=1e-7):
+  ''' Jacobian row(s) of a scipy style constraint at x, by forward differences if it has no jac. '''
+  if 'jac' in constraint:
+    return np.atleast_2d(constraint['jac'](x))
+  f = np.atleast_1d(constraint['fun'](x))
+  return np.array([(np.atleast_1d(constraint['fun'](x + h*e)) - f)/h for e in np.eye(len(x))]).T
+
+
+def agent_admm_update(x):
+  ''' ADMM local step for the exchange (market clearing) problem. Agent i solves the augmented
+  Lagrangian problem min f_i(s) + rho/2*||s - s_k + x_k + u||^2, where s_k is its last bid, x_k the
+  mean flow per row (excess/rows) and u the scaled dual (price/rho). Expanding the square leaves
+  rho/2*||s - s_k||^2 + rho*(u + x_k).s plus a constant, so that is just a proximal point bid about
+  s_k, prox 1/rho, at price rho*(u + x_k). The network supplies both (@see Network.bid_price()).
+  '''
+  (device, p, s0, prox, timeout) = x
+  if not prox:
+    raise ValueError('ADMM agent update needs prox (1/rho)')
+  return agent_point_bid_update(x)
+
+
 def agent_limited_minimization_update(x):
-  solver_options = {  # Default options to 'solver' - scipy.optimize.minimize - where it's used.
-    'ftol': 1e-06,
-    'maxiter': 500,
-    'disp': False,
-  }
-  (device, p, s0, prox) = x # TODO: Ignoring pro
+  (device, p, s0, prox, timeout) = x # TODO: Ignoring prox and timeout.
   try:
     result = step(device, p, s0, solver_options=solver_options)
   except OptimizationException as e:
-    logging.warn('OptimizationException on %s agent :\n%s', device.id, e)
+    logging.warning('OptimizationException on %s agent. Retrying with relaxed options:\n%s', device.id, e)
+    result = step(device, p, s0, solver_options=relaxed_solver_options)
   return result[0].reshape(device.shape)
 
 
+def compact_rows(s):
+  ''' Block form of flow matrix `s` that leaves out rows that are all zero: a dict of the shape, dtype,
+  indices of the non zero rows, and those rows. Most devices in big scenarios are idle most of the
+  time, so this is usually much smaller. @see expand_rows().
+  '''
+  rows = np.flatnonzero(np.asarray(s).any(axis=1))
+  return {'shape': list(s.shape), 'dtype': str(s.dtype), 'rows': rows.tolist(), 'data': s[rows].tolist()}
+
+
+def expand_rows(d, dtype=None):
+  ''' Inverse of compact_rows(). '''
+  s = np.zeros(d['shape'], dtype=dtype if dtype else d['dtype'])
+  if d['rows']:
+    s[d['rows']] = d['data']
+  return s
+
+
+s0_independent_strategies = (agent_point_bid_update, agent_function_bid_update)  # Without prox.
+
+
 class Network:
   ''' Simulates a price adjustment process. Each top level device of a device_kit DeviceSet is
   considered owned by some agent. run() method passes each agent a price vector, asks for bid back,
@@ -48,27 +256,73 @@ class Network:
   tol = None            # Used for stability condition. Units of watts. @see stable().
   maxsteps = None       # Max iterations condition.
   stepsize = None       # Step size passed to agents. Not used directly here.
+  stepsize_scale = 1    # Factor, scalar or per slot, on the stepsize. @see get_stepsize().
   prox = None
   steps = 0          # Step counter. @see step(), solve().
-  demand = price = 0    # Demand and price a vectors with same length as deviceset.
+  _price = 0            # Price vector with same length as deviceset. @see price.
   last_demand = last_price = 0   # Internally track changes as converge to equilibrium price.
-  s = 0                 # The entire flow matrix for the deviceset.
+  _s = 0                # The entire flow matrix for the deviceset. @see s.
+  version = 0           # Incremented whenever price or s is set. In place changes must increment it too.
   deviceset = None
   agent_strategy = agent_point_bid_update
+  backend = 'process'   # Execution backend name. @see backends.py.
+  schedule = None       # How the backend packs agents onto workers. 'lpt' or None. @see scheduler.py.
+  agent_workers = None  # Addresses of remote agent workers. @see transport.py. Overrides backend.
+  agent_timeout = None  # Seconds an agent gets to bid before its previous bid is used. No limit if None.
+  failures = None       # Count of failed bids by agent id over the run.
+  step_failures = []    # List of (agent id, error) for failed bids in the last step.
+  sparse = False        # Only exchange and solve each agent's active window. @see windows.py.
+  agents = []           # List of (device, slice) solved each step. @see init().
+  price_update = 'gradient'  # 'gradient' or 'newton'. @see update_price().
+  sensitivity = None    # Aggregate d(excess)/d(price) per time slot from function bids, if any.
+  min_sensitivity = 1e-6  # Below this (magnitude) a slot is treated as unresponsive by newton updates.
+  damping = None        # Per slot fraction of the newton step taken. @see update_price().
+  min_damping = 1/64    # Slots damped below this take the linear step instead.
+  last_excess = None    # Excess at the last newton update.
+  dtype = np.dtype('float64')  # dtype of s, price and the arrays exchanged with agents.
+  compact_storage = False  # Serialize s leaving out all zero rows. @see compact_rows().
+  rho = 1.0             # ADMM penalty. Adapted by residual balancing. @see update_rho().
+  rho_init = 1.0        # rho at the start of a (not warm started) run.
+  rho_mu = 10           # Rebalance rho when primal and dual residuals differ by more than this factor.
+  rho_tau = 2           # Factor rho is changed by when rebalancing.
+  last_s = None         # s before the last set_bids().
+  residuals = (0, 0)    # ADMM (primal, dual) residuals of the last step.
+  response_cache = None  # Optional memo.ResponseCache of agent responses. @see map_agents().
+  profiles = None       # profiling.AgentProfiles to profile agent solves into, if profiling.
+  compression = None    # Optional compression.BidCodec agents send bids back with. @see map_agents().
+  traffic = None        # Bytes sent to and received from agents in the last step. @see map_agents().
+  traffic_total = None  # The same summed over the run.
 
   def __init__(self,
-    deviceset: DeviceSet, tol=1e-3, maxsteps=100, stepsize=1e-3, agent_strategy=None, s=None, price=None,  **kwargs
+    deviceset: DeviceSet, tol=1e-3, maxsteps=100, stepsize=1e-3, agent_strategy=None, s=None, price=None,
+    agent_workers=None, agent_timeout=None, sparse=False, backend='process', schedule=None,
+    price_update='gradient', dtype='float64', compact_storage=False, rho=1.0, response_cache=None, compression=None,
+    **kwargs
   ):
     ''' Init things. kwargs hack to support deserialization mainly. '''
     self.deviceset = deviceset
+    self.dtype = np.dtype(dtype)
+    self.compact_storage = compact_storage
     self.tol = tol
     self.maxsteps = maxsteps
     self.stepsize = stepsize
     self.set_price(price)
     self.set_s(s)
     self.set_agent_strategy(agent_strategy)
-    self.last_demand = np.zeros(len(self))
-    self.last_price = np.zeros(len(self))
+    self.agent_workers = agent_workers
+    self.backend = backend
+    self.schedule = schedule
+    self.agent_timeout = agent_timeout
+    self.sparse = sparse
+    if price_update not in ['gradient', 'newton', 'admm']:
+      raise Exception('Unknown price update "%s"' % (price_update,))
+    self.price_update = 'admm' if self.agent_strategy is agent_admm_update else price_update
+    self.rho = self.rho_init = rho
+    self.response_cache = response_cache
+    self.compression = BidCodec(**compression) if isinstance(compression, dict) else compression
+    self.failures = {device.id: 0 for device in self.deviceset.devices}
+    self.last_demand = np.zeros(len(self), dtype=self.dtype)
+    self.last_price = np.zeros(len(self), dtype=self.dtype)
     self.logger = logging.getLogger('network')
     self.logger.setLevel(logging.INFO)
     for k, v in kwargs.items():
@@ -83,36 +337,217 @@ class Network:
   def __len__(self):
     return len(self.deviceset)
 
-  def init(self, solve=True):
+  def init(self, solve=True, warm_start=False):
+    ''' Reset for a run. If `warm_start` the current price and s are kept as the starting point. '''
     self.steps = 0
-    self.price = np.zeros(len(self))
-    self.s = np.zeros(self.deviceset.shape)
-    self.last_demand = np.zeros(len(self))
-    self.last_price = np.zeros(len(self))
-
-  def run(self, listeners=[]):
-    ''' Solve for optimal by stepping until stability. Use callbacks to instrumentate. Note,
+    if not warm_start:
+      self.price = np.zeros(len(self), dtype=self.dtype)
+      self.s = np.zeros(self.deviceset.shape, dtype=self.dtype)
+      self.rho = self.rho_init
+    self.last_s = None
+    self.last_demand = np.zeros(len(self), dtype=self.dtype)
+    self.last_price = np.zeros(len(self), dtype=self.dtype)
+    self.failures = {device.id: 0 for device in self.deviceset.devices}
+    self.step_failures = []
+    self.sensitivity = None
+    (self.damping, self.last_excess) = (np.ones(len(self)), None)
+    self.traffic = self._traffic()
+    self.traffic_total = self._traffic()
+    self.agents = self.make_agents()
+
+  def make_agents(self):
+    ''' Get the list of (device, slice) to solve each step. If sparse each device is replaced by a
+    WindowedDevice over its active window, the fixed part of its flows is written into `s`, and devices
+    with no free cells at all are left out since there is nothing to solve.
+    '''
+    if not self.sparse:
+      return list(self.deviceset.slices)
+    agents = []
+    for (device, _slice) in self.deviceset.slices:
+      windowed = WindowedDevice(device)
+      self.s[slice(*_slice),:] = windowed.fixed
+      if len(windowed.rows):
+        agents.append((windowed, _slice))
+    self.version += 1
+    return agents
+
+  def run(self, listeners=(), warm_start=False, pool=None):
+    ''' Solve for optimal by stepping until stability. Use callbacks to instrumentate - `listeners` is
+    an events.EventBus, or a list of callbacks that get every event. Note,
     only at equillibrium (if one exists) is demand actually that demanded at the current price and vice versa.
     At any other given time one or the other is always out of step. Supposing a point bid strategy (the default),
     demand is demand at last_price or price is price at last_demand. At "after-step" demand is rel last_price and
     price is rel current demand.
+
+    If `warm_start` the run starts from the current price and s instead of zero (@see init()). A
+    `pool` to reuse can be given, otherwise one is made for the run (@see make_pool()).
+
+    Agents that fail to bid keep their previous bid for the step. Failures are counted in `failures`
+    and an 'agent-failure' event is sent before 'after-step' on any step with failures. A step with
+    failures is never stable (@see stable), so the run can't converge on stale bids. If every agent
+    fails on a step an AgentFailureException is raised, after the 'agent-failure' event.
     '''
-    listeners.append(lambda n, e, logger=self.logger: logger.debug('%s-12 %s: %s' % (e, n.steps, str(n.excess))))
-    with Pool(processes=len(self.deviceset.devices)) as pool:
-      self.init()
-      [cb(self, 'before-start') for cb in listeners]
+    bus = EventBus.of(listeners)
+    debug = self.logger.isEnabledFor(logging.DEBUG)
+    with (contextlib.nullcontext(pool) if pool else self.make_pool()) as pool:
+      self.init(warm_start=warm_start)
+      bus.emit(self, 'before-start')
       while self.steps == 0 or not self.stable and self.steps < self.maxsteps:
         (self.last_demand, self.last_price) = (self.demand, self.price)  # Stash for stability calculation.
         prox = None if self.steps == 0 else self.get_prox() # Ensure prox is 0 so demand goes to 0 price optimal on first step.
-        _map = [(device, self.price, self.s[slice(*_slice),:], prox) for device, _slice in self.deviceset.slices]
-        _s = pool.map(self.agent_strategy, _map)
-        self.s = np.array(np.concatenate(_s)).reshape(self.deviceset.shape)
+        prox = 1/self.rho if self.price_update == 'admm' else prox
+        price = self.bid_price()
+        _map = [
+          (self.agent_strategy, device, self.agent_price(device, price), self.agent_s(device, _slice), prox, self.agent_timeout)
+          for device, _slice in self.agents
+        ]
+        results = self.map_agents(pool, _map)
+        self.set_bids(results)
+        self.step_failures = [(device.id, r[1]) for ((device, _slice), r) in zip(self.agents, results) if r[1]]
+        for (agent_id, error) in self.step_failures:
+          self.failures[agent_id] += 1
+          self.logger.warning('Agent %s failed to bid on step %d (%d failures) [%s]', agent_id, self.steps, self.failures[agent_id], error)
+        if self.agents and len(self.step_failures) == len(self.agents):
+          bus.emit(self, 'agent-failure', True)
+          raise AgentFailureException('All %d agents failed to bid on step %d' % (len(self.agents), self.steps))
         self.update_price()
         self.steps += 1
-        [cb(self, 'after-step') for cb in listeners]
-      [cb(self, 'after-done') for cb in listeners]
+        last = self.stable or self.steps >= self.maxsteps
+        if self.step_failures:
+          bus.emit(self, 'agent-failure', last)
+        bus.emit(self, 'after-step', last)
+        if debug:
+          self.logger.debug('%-12s %s: %s' % ('after-step', self.steps, str(self.excess)))
+      bus.emit(self, 'after-done')
+    if self.response_cache:
+      self.logger.info('Agent response cache: %s', ' '.join('%s=%s' % kv for kv in self.response_cache.stats().items()))
+    if self.compression:
+      total = self.traffic_total
+      self.logger.info(
+        'Agent traffic: to agents=%d (uncompressed), from agents=%d (%d uncompressed, ratio %.3f), both ways ratio %.3f',
+        total['sent'], total['received'], total['received_dense'], total['received']/max(total['received_dense'], 1),
+        (total['sent'] + total['received'])/max(total['sent'] + total['received_dense'], 1)
+      )
     return self.steps < self.maxsteps
 
+  def shift(self, n=1, deviceset=None):
+    ''' Roll the horizon forward `n` slots. price and s are shifted left and the `n` new slots at the
+    end take the values of the previous last slot, so a following run(warm_start=True) starts from the
+    last equilibrium. `deviceset`, if given, replaces the current one. It must have the same shape.
+    '''
+    if deviceset is not None:
+      if tuple(deviceset.shape) != tuple(self.deviceset.shape):
+        raise ValueError('Shifted deviceset shape %s != %s' % (deviceset.shape, self.deviceset.shape))
+      self.deviceset = deviceset
+    n = min(n, len(self))
+    self.price = np.concatenate((self.price[n:], np.repeat(self.price[-1:], n)))
+    self.s = np.concatenate((self.s[:, n:], np.repeat(self.s[:, -1:], n, axis=1)), axis=1)
+
+  def make_pool(self):
+    ''' Execution backend to map the agent strategy over agents with. @see backends.py. '''
+    return make_backend(self.backend, len(self.deviceset.devices), self.agent_workers, self.schedule)
+
+  def bid_price(self):
+    ''' Price agents bid against this step. For ADMM that's the price plus the consensus correction,
+    rho times the mean flow per row (@see agent_admm_update()).
+    '''
+    if self.price_update == 'admm':
+      return np.asarray(self.price + self.rho*self.excess/len(self.s), dtype=self.dtype)
+    return self.price
+
+  def agent_price(self, device, price=None):
+    price = self.price if price is None else price
+    return device.compact_price(price) if isinstance(device, WindowedDevice) else price
+
+  def agent_s(self, device, _slice):
+    s = self.s[slice(*_slice),:]
+    return device.compact(s) if isinstance(device, WindowedDevice) else s
+
+  def set_bids(self, results):
+    ''' Set `s` from the agent results - list of (s, error) - of a step, in self.agents order. A
+    function bid's s is a tuple (s, sensitivity) and sensitivities are summed into `sensitivity`.
+    Agents that failed contribute no sensitivity.
+    '''
+    s = np.array(self.s)
+    sensitivity = None
+    for ((device, _slice), (_s, error)) in zip(self.agents, results):
+      if isinstance(_s, tuple):
+        (_s, _sensitivity) = _s
+        sensitivity = np.zeros(len(self)) if sensitivity is None else sensitivity
+        sensitivity += device.embed_price(_sensitivity) if isinstance(device, WindowedDevice) else _sensitivity
+      s[slice(*_slice),:] = device.embed(_s) if isinstance(device, WindowedDevice) else _s
+    (self.last_s, self.s) = (self.s, s)
+    self.sensitivity = sensitivity
+
+  def map_agents(self, pool, tasks):
+    ''' Map agent_update() over tasks. With an agent_timeout agents that don't return within twice
+    the timeout - a solve that hangs inside a single function evaluation never sees its own deadline -
+    are given up on and keep their previous bid. Note a hung worker stays busy in the backend.
+
+    With a response_cache, tasks with a cached response aren't sent to the pool at all, and successful
+    responses are cached, with one write to its file per step. (A scheduled backend then sees a varying subset of tasks, so its per task
+    costs are less accurate.)
+
+    With `profiles` set solves on workers - any backend that doesn't run tasks inline - are run
+    under agent_update_profiled() and their stats merged into it. Inline solves are left to the
+    coordinator's profile.
+
+    With a `compression` codec agents send back their bids compressed relative to their start point,
+    and they're decoded here, so only ever the decoded bid - what the network actually has - is used,
+    cached, and sent back as the next start point. Only bids are compressed: the price and start point
+    still go out in full (@see compression.py). Bytes sent and received are counted in `traffic`:
+    price and start point out, bid and sensitivities back. Cache hits cost nothing.
+    '''
+    timeout = 2*self.agent_timeout if self.agent_timeout else None
+    cache = self.response_cache
+    codec = self.compression
+    keys = [
+      cache.key(task, uses_s0=bool(task[4]) or task[0] not in s0_independent_strategies) if cache else None
+      for task in tasks
+    ]
+    results = [cache.get(key) if key else None for key in keys]
+    todo = [i for (i, r) in enumerate(results) if r is None]
+    profiled = self.profiles is not None and not getattr(pool, 'inline', False)
+    if codec:
+      fn = CompressedAgentUpdate(codec, profiled)
+    else:
+      fn = agent_update_profiled if profiled else agent_update
+    traffic = self._traffic()
+    for (i, r) in zip(todo, pool.map(fn, [tasks[i] for i in todo], timeout=timeout)):
+      if profiled and not isinstance(r, TimeoutError):
+        (r, stats) = r
+        if stats:
+          self.profiles.add(tasks[i][1].id, stats)
+      traffic['sent'] += np.asarray(tasks[i][2]).nbytes + np.asarray(tasks[i][3]).nbytes
+      if isinstance(r, TimeoutError):
+        r = (tasks[i][3], 'Agent timed out after %.1fs' % (timeout,))
+      else:
+        r = self.decode_result(r, tasks[i][3], traffic)
+        if keys[i] and not r[1]:
+          cache.put(keys[i], r)
+      results[i] = r
+    if cache:
+      cache.flush()
+    self.traffic = traffic
+    for (k, v) in traffic.items():
+      self.traffic_total[k] += v
+    return results
+
+  def decode_result(self, r, s0, traffic):
+    ''' Decode the bid in agent result `r` if it's compressed, counting its bytes into `traffic`. '''
+    (s, error) = r
+    traffic['received'] += bid_nbytes(s)
+    if isinstance(s, tuple):
+      s = (self.compression.decode(s[0], s0),) + s[1:] if self.compression else s
+    else:
+      s = self.compression.decode(s, s0) if self.compression else s
+    traffic['received_dense'] += bid_nbytes(s)
+    return (s, error)
+
+  @staticmethod
+  def _traffic():
+    return {'sent': 0, 'received': 0, 'received_dense': 0}
+
   def update_price(self):
     ''' Update global network price. Many variations to price adjustment methods have been proposed.
     Generally the can be categorized as synchronous vs asynchronous and point base vs function based.
@@ -122,14 +557,55 @@ class Network:
       - a * r                               // Standard point based linear.
       - a * normal(r)                       // Effectively just a different step size.
       - a * r * randint(0,2,size=len(self)) // Simulate asynchronous bid/offer.
+
+    With price_update 'newton' and function bids - agents also report the sensitivity of their demand
+    to price (@see agent_function_bid_update()) - each slot's price instead takes a diagonal Newton
+    step to where the aggregate linearized excess is 0, r / -sum(ds/dp). The step is damped per slot:
+    `damping` halves on a slot whenever its excess grew in magnitude since the last update - the
+    linearization overshot, say where a bound starts binding - and doubles back up to 1 otherwise.
+    Slots where the aggregate sensitivity is ~0 (nothing responds to price there), or that are damped
+    below min_damping, fall back to the linear step.
+    '''
+    r = self.excess
+    if self.price_update == 'admm':
+      price = self.price + self.rho*r/len(self.s)
+      self.update_rho()
+    elif self.price_update == 'newton' and self.sensitivity is not None:
+      damping = np.ones(len(self)) if self.damping is None else self.damping
+      if self.last_excess is not None:
+        damping = np.where(np.abs(r) > np.abs(self.last_excess), damping/2, np.minimum(damping*2, 1))
+      responsive = (np.abs(self.sensitivity) > self.min_sensitivity) & (damping >= self.min_damping)
+      newton = -r/np.where(responsive, self.sensitivity, -1)
+      price = self.price + np.where(responsive, damping*newton, self.get_stepsize() * r)
+      (self.damping, self.last_excess) = (damping, r)
+    else:
+      price = self.price + self.get_stepsize() * r
+    self.price = np.asarray(price, dtype=self.dtype)
+
+  def update_rho(self):
+    ''' ADMM residual balancing (Boyd et al. 2011, 3.4.1). The primal residual is the mean flow per
+    row, the dual residual the change in each row's flow net of that. rho is increased when the primal
+    residual dominates, decreased when the dual does. The price - rho times the scaled dual - is kept,
+    so only the scaled dual is rescaled.
     '''
-    self.price = self.price + self.get_stepsize() * self.excess
+    (rows, r) = (len(self.s), self.excess/len(self.s))
+    primal = np.sqrt(rows)*np.linalg.norm(r)
+    last = self.last_s if self.last_s is not None else np.zeros(self.s.shape)
+    last_r = last.sum(axis=0)/rows
+    dual = self.rho*np.linalg.norm((self.s - r) - (last - last_r))
+    self.residuals = (primal, dual)
+    if primal > self.rho_mu*dual:
+      self.rho *= self.rho_tau
+    elif dual > self.rho_mu*primal:
+      self.rho /= self.rho_tau
 
   def get_stepsize(self):
-    ''' If a str interpret it as dynamic stepsize expression. First step value will be 0. '''
+    ''' If a str interpret it as dynamic stepsize expression. First step value will be 0. Scaled by
+    stepsize_scale.
+    '''
     if isinstance(self.stepsize, str):
-      return eval(self.stepsize, {'steps': self.steps})
-    return self.stepsize
+      return eval(self.stepsize, {'steps': self.steps})*self.stepsize_scale
+    return self.stepsize*self.stepsize_scale
 
   def get_prox(self):
     if isinstance(self.prox, str):
@@ -137,20 +613,35 @@ class Network:
     return self.prox
 
   def u(self):
-    return self.deviceset.u(self.s, self.price)
+    return utility(self.deviceset, self.s, self.price)
 
   def derive(self):
     return self.deviceset.deriv(self.s, self.price)
 
+  def u_batch(self, s, price, pool=None):
+    ''' Per agent utilities, (k, agents), of stacked flows s (k, rows, T) and prices (k, T), evaluated
+    in parallel over `pool` if given. @see batch.py.
+    '''
+    return batch_u(self.deviceset, s, price, pool)
+
+  def derive_batch(self, s, price, pool=None):
+    ''' Utility derivatives - the gradient of u_batch()'s utilities, @see batch_deriv() - of stacked
+    flows s (k, rows, T) and prices (k, T). Returns (k, rows, T).
+    '''
+    return batch_deriv(self.deviceset, s, price, pool)
+
   def set_price(self, p):
-    self.price = (np.ones(len(self))*p).reshape(len(self)) if p else np.zeros(len(self))
+    p = 0 if p is None or np.size(p) == 0 else np.asarray(p)
+    self.price = (np.ones(len(self))*p).reshape(len(self)).astype(self.dtype)
 
   def set_s(self, s, copy=False):
-    if not s:
-      self.s = np.zeros(self.deviceset.shape)
+    ''' Set s from a flow matrix, nested lists, or the block form from compact_rows(). '''
+    if isinstance(s, dict):
+      s = expand_rows(s, self.dtype)
+    if s is None or not len(s):
+      self.s = np.zeros(self.deviceset.shape, dtype=self.dtype)
     else:
-      if not isinstance(s, np.ndarray) or copy:
-        s = np.array(s, copy=copy)
+      s = np.array(s, dtype=self.dtype) if copy else np.asarray(s, dtype=self.dtype)
       self.s = s.reshape(self.deviceset.shape)
 
   def set_agent_strategy(self, name):
@@ -158,6 +649,10 @@ class Network:
       self.agent_strategy = agent_point_bid_update
     elif name == 'limited_minimization':
       self.agent_strategy = agent_limited_minimization_update
+    elif name == 'function_bid':
+      self.agent_strategy = agent_function_bid_update
+    elif name == 'admm':
+      self.agent_strategy = agent_admm_update
     else:
       raise Exception('Unkown agent update strategy "%s"' % (name,))
 
@@ -167,6 +662,24 @@ class Network:
   def df(self):
     return pd.DataFrame(dict(self.map())).transpose()
 
+  @property
+  def price(self):
+    return self._price
+
+  @price.setter
+  def price(self, price):
+    self._price = price
+    self.version += 1
+
+  @property
+  def s(self):
+    return self._s
+
+  @s.setter
+  def s(self, s):
+    self._s = s
+    self.version += 1
+
   @property
   def excess(self):
     ''' Can be +ve or -ve to depending on excess demand (+ve) or supply (-ve) at last price. '''
@@ -193,7 +706,8 @@ class Network:
 
   @property
   def stable(self):
-    return (np.abs(self.excess) <= self.tol).all()
+    ''' Whether excess is within tol, on a step where every agent bid. '''
+    return not self.step_failures and (np.abs(self.excess) <= self.tol).all()
 
   @property
   def lf(self):
@@ -209,13 +723,21 @@ class Network:
     return {
       'deviceset': self.deviceset,
       'price': self.price.tolist(),
-      's': self.s.tolist(),
+      's': compact_rows(self.s) if self.compact_storage else self.s.tolist(),
       'tol': self.tol,
       'maxsteps': self.maxsteps,
       'stepsize': self.stepsize,
       'steps': self.steps,
       'last_demand': self.last_demand,
       'last_price': self.last_price,
+      'agent_timeout': self.agent_timeout,
+      'failures': self.failures,
+      'sparse': self.sparse,
+      'price_update': self.price_update,
+      'dtype': str(self.dtype),
+      'compact_storage': self.compact_storage,
+      'rho': self.rho,
+      'compression': self.compression.to_dict() if self.compression else None,
     }
 
   @classmethod
@@ -224,6 +746,7 @@ class Network:
 
 
 if __name__ == '__main__':
+  from device_kit.sample_scenarios.lcl.lcl_scenario import make_deviceset  # Only in some device_kit versions.
   deviceset = make_deviceset()
   m = Network(deviceset)
   m.run()
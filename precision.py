@@ -0,0 +1,41 @@
+''' Validate reduced precision runs. A Network with dtype float32 halves the memory of the market
+state and the bytes exchanged with agents, but the price adjustment accumulates rounding error. To use
+it with confidence, validate_precision() re-runs the same network in float64 and reports how far the
+reduced precision equilibrium is from the float64 one.
+'''
+import copy
+import numpy as np
+from device_kit_market_simulations.reporting.summary import summarize
+
+
+def _rel(a, b):
+  ''' Relative error of a from reference b (2-norm). '''
+  norm = np.linalg.norm(b)
+  return float(np.linalg.norm(a - b)/norm) if norm else float(np.linalg.norm(a - b))
+
+
+def validate_precision(network, rtol=1e-3, pool=None):
+  ''' Re-run `network`, which has just been run at its dtype, from scratch in float64 and compare the
+  final states. Returns a dict of drift statistics. `ok` is whether relative price, flow and utility
+  drift are all within `rtol`.
+  '''
+  reference = copy.copy(network)
+  reference.dtype = np.dtype('float64')
+  reference.run([], pool=pool)
+  (price, s) = (network.price.astype('float64'), network.s.astype('float64'))
+  (utility, reference_utility) = (summarize(network).utility, summarize(reference).utility)
+  report = {
+    'dtype': str(network.dtype),
+    'steps': network.steps,
+    'reference_steps': reference.steps,
+    'stable': bool(network.stable),
+    'reference_stable': bool(reference.stable),
+    'price_max_abs_error': float(np.abs(price - reference.price).max()),
+    'price_rel_error': _rel(price, reference.price),
+    's_max_abs_error': float(np.abs(s - reference.s).max()),
+    's_rel_error': _rel(s, reference.s),
+    'excess_max': float(np.abs(s.sum(axis=0)).max()),
+    'utility_rel_error': float(abs(utility - reference_utility)/abs(reference_utility)) if reference_utility else float(abs(utility)),
+  }
+  report['ok'] = all(report[k] <= rtol for k in ('price_rel_error', 's_rel_error', 'utility_rel_error'))
+  return report
@@ -0,0 +1,81 @@
+''' Per agent profiles of agent solves. With profiling on (run.py --profile) every agent solve runs
+under cProfile in whichever worker it lands on (@see network.agent_update_profiled()), the raw stats
+come back with the result, and AgentProfiles merges them per agent over the run. Solves run inline by
+the serial backend are only in the coordinator's profile. The profiles are
+written as pstats files - one per agent and one merged over all agents - which utils/ppstats.py reads.
+'''
+import os
+import pstats
+import pandas as pd
+
+
+class _RawStats():
+  ''' Wraps a raw profile stats dict so pstats.Stats will take it. '''
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+def top_function(stats):
+  ''' (name, tottime) of the function with the most own time in a pstats.Stats. '''
+  if not stats.stats:
+    return ('', 0)
+  ((filename, line, name), (cc, nc, tt, ct, callers)) = max(stats.stats.items(), key=lambda kv: kv[1][2])
+  return ('%s:%d(%s)' % (os.path.basename(filename), line, name), tt)
+
+
+class AgentProfiles():
+  ''' cProfile stats of agent solves merged per agent. '''
+  profiles = {}       # Agent id to pstats.Stats.
+  solves = {}         # Agent id to number of profiled solves.
+
+  def __init__(self):
+    self.profiles = {}
+    self.solves = {}
+
+  def __len__(self):
+    return len(self.profiles)
+
+  def add(self, agent_id, stats):
+    ''' Merge the raw stats dict of one solve of agent_id. '''
+    if agent_id in self.profiles:
+      self.profiles[agent_id].add(_RawStats(stats))
+    else:
+      self.profiles[agent_id] = pstats.Stats(_RawStats(stats))
+    self.solves[agent_id] = self.solves.get(agent_id, 0) + 1
+
+  def merged(self):
+    ''' pstats.Stats of all agents together. '''
+    stats = None
+    for profile in self.profiles.values():
+      stats = pstats.Stats(_RawStats(dict(profile.stats))) if stats is None else stats.add(profile)
+    return stats
+
+  def table(self):
+    ''' DataFrame with a row per agent: solves, total time and calls, and its most expensive function. '''
+    rows = []
+    for (agent_id, profile) in self.profiles.items():
+      (function, tt) = top_function(profile)
+      rows.append({
+        'agent': agent_id,
+        'solves': self.solves[agent_id],
+        'total_time': profile.total_tt,
+        'time_per_solve': profile.total_tt/self.solves[agent_id],
+        'calls': profile.total_calls,
+        'top_function': function,
+        'top_function_time': tt,
+      })
+    return pd.DataFrame(rows).sort_values('total_time', ascending=False) if rows else pd.DataFrame()
+
+  def dump(self, output_dir):
+    ''' Write agent-<id>.prof for each agent, agents.prof merged over agents, and agents.csv. '''
+    if not os.path.isdir(output_dir):
+      os.makedirs(output_dir)
+    for (agent_id, profile) in self.profiles.items():
+      profile.dump_stats(os.path.join(output_dir, 'agent-%s.prof' % (agent_id,)))
+    if self.profiles:
+      self.merged().dump_stats(os.path.join(output_dir, 'agents.prof'))
+    self.table().to_csv(os.path.join(output_dir, 'agents.csv'), index=False)
@@ -5,6 +5,7 @@ import os
 import re
 import argparse
 import logging
+from multiprocessing import Pool
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -46,6 +47,9 @@ def main():
   parser.add_argument('--each', '-e', dest='each', default=10, type=int,
     help='how many steps between each frame of movie'
   )
+  parser.add_argument('-j', dest='processes', default=None, type=int,
+    help='number of processes to render per agent plots and evaluate utilities on. Defaults to number of CPUs'
+  )
 
   args = parser.parse_args()
   output_dir = args.data_dir.rstrip('/') + '-report'
@@ -86,10 +90,10 @@ def main():
 
   # Generate std set of still images.
   if args.std_plots:
-    report_plots(reader, output_dir)
+    report_plots(reader, output_dir, args.processes)
   # Generate std set of additional still images.
   if args.more_plots:
-    report_plots_market_trends(reader, output_dir)
+    report_plots_market_trends(reader, output_dir, args.processes)
 
 
 def get_ylim(first, last):
@@ -98,8 +102,10 @@ def get_ylim(first, last):
   return ymin, ymax
 
 
-def report_plots(reader, output_dir):
-  ''' Print some standard summary plots with matplotlib. '''
+def report_plots(reader, output_dir, processes=None):
+  ''' Print some standard summary plots with matplotlib. Per agent plots are rendered on a Pool of
+  `processes` with a headless backend.
+  '''
   init = reader.first()
   final = reader.last()
   # Total demand
@@ -110,34 +116,64 @@ def report_plots(reader, output_dir):
   plt.savefig(output_dir + '/total-demand.png')
   plt.clf()
   # For each agent for each sub-device (if any) initial base-case demands c/w total.
-  report_plots_agents(plt, init, 'Total demand initial (KWH)', 'demand-init-agent', output_dir)
-  report_plots_agents(plt, final, 'Total demand final (KWH)', 'demand-final-agent', output_dir)
+  with Pool(processes, initializer=_headless) as pool:
+    report_plots_agents(init, 'Total demand initial (KWH)', 'demand-init-agent', output_dir, pool)
+    report_plots_agents(final, 'Total demand final (KWH)', 'demand-final-agent', output_dir, pool)
+
+
+def agent_rows(df):
+  ''' Index of agent label to the labels of its rows in `df` (network.df()), grouped the same way as
+  the per agent sums.
+  '''
+  index = {}
+  for label in df.index:
+    index.setdefault(label.split('.')[1], []).append(label)
+  return index
 
 
-def report_plots_agents(plt, network, title, filename, output_dir):
+def report_plots_agents(network, title, filename, output_dir, pool=None):
+  ''' Plot each agent's total demand and that of each of its devices, one PNG per agent. Mapped over
+  `pool` if given.
+  '''
   df = network.df()
   df_sums = df.groupby(lambda l: l.split('.')[1]).sum()
-  for i, agent_label in enumerate(df_sums.index):
-    plt.bar(range(0, len(network)), df_sums.loc[agent_label], label='total', width=1, edgecolor='black', fill=False, linewidth=2)
-    df_agent = df.filter(like=agent_label, axis=0)
-    for (i, (device_label, r)) in enumerate(df_agent.iterrows()):
-      plt.bar(range(0, len(network)), r, label=device_label, width=1, edgecolor=colors[(i+1)%len(colors)], fill=False, linewidth=2)
-    plt.xlim(0, len(network)+10)
-    plt.legend()
-    plt.title('%s; Agent %s' % (title, str(agent_label)))
-    plt.savefig(output_dir + '/%s-%s.png' % (filename, str(agent_label)))
-    plt.clf()
-
-
-def report_plots_market_trends(reader, output_dir):
-  # Welfare Trend lines.
-  init = reader.first()
-  final = reader.last()
-  welfare_base = reader.get(1).u()
-  welfares = [n.u() - welfare_base for n in list(reader)[1:]]
-  lf_base = reader.first().lf
-  lf = [(n.lf - lf_base) for n in reader]
-  excess = [n.excess.sum() for n in reader]
+  index = agent_rows(df)
+  tasks = [
+    (
+      len(network),
+      '%s; Agent %s' % (title, str(agent_label)),
+      df_sums.loc[agent_label].values,
+      [(device_label, df.loc[device_label].values) for device_label in index[agent_label]],
+      output_dir + '/%s-%s.png' % (filename, str(agent_label))
+    )
+    for agent_label in df_sums.index
+  ]
+  list((pool.map if pool else map)(_plot_agent, tasks))
+
+
+def _headless():
+  plt.switch_backend('Agg')
+
+
+def _plot_agent(task):
+  (T, title, total, devices, filename) = task
+  plt.bar(range(0, T), total, label='total', width=1, edgecolor='black', fill=False, linewidth=2)
+  for (i, (device_label, r)) in enumerate(devices):
+    plt.bar(range(0, T), r, label=device_label, width=1, edgecolor=colors((i+1)%colors.N), fill=False, linewidth=2)
+  plt.xlim(0, T+10)
+  plt.legend()
+  plt.title(title)
+  plt.savefig(filename)
+  plt.clf()
+
+
+def report_plots_market_trends(reader, output_dir, processes=None):
+  # Welfare Trend lines. From the per step summary so networks don't need to be loaded, or if there
+  # isn't one, from all steps' utilities evaluated in a batch.
+  summary = reader.summary(processes)
+  welfares = summary['utility'].values[1:] - summary['utility'].values[1]
+  lf = summary['load_factor'].values - summary['load_factor'].values[0]
+  excess = summary['excess_tot'].values
   # Plot welfare trend.
   plt.plot(welfares, label='welfare')
   plt.title('Change in welfare and with steps of market')
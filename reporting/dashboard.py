@@ -0,0 +1,206 @@
+''' Live dashboard of a running Network. Unlike MatPlotNetworkWriter, which clears and redraws the
+whole axes in the simulation's own process, the dashboard renders in a separate process: update()
+only queues a small snapshot of the step (dropping any the renderer hasn't got to yet) so watching a
+run never slows it down. The snapshot is just vectors the network already has; total utility, which
+needs every agent evaluated, is only added at most `fps` times a second. The renderer keeps
+persistent artists and blits just them, and draws at most `fps` frames a second however fast steps
+arrive.
+'''
+import os
+import time
+import queue
+import logging
+import multiprocessing
+import numpy as np
+from device_kit_market_simulations.reporting.summary import summarize
+
+
+logger = logging.getLogger(__name__)
+
+
+class LiveDashboardWriter():
+  ''' Writer that shows a live dashboard: price, excess, demand and supply over the horizon for the
+  latest step, max |excess| over steps, and the latest utility. `cb` is a scenario's
+  matplot_network_writer_hook; it's called in the renderer process as cb('after-init', plt,
+  dashboard) and cb('after-update', fig, dashboard). If matplotlib has no interactive backend,
+  frames are instead saved to `output_dir`/live.png (at the same capped rate).
+  '''
+  network = None
+  events = ['after-init', 'after-step']  # Events update() handles. @see events.py.
+  fps = 10
+  queue = None
+  process = None
+  utility_time = 0    # time.time() utility was last sent.
+
+  def __init__(self, network, title=None, fps=10, cb=None, output_dir=None):
+    self.network = network
+    self.fps = fps
+    self.queue = multiprocessing.Queue(maxsize=1)
+    self.process = multiprocessing.Process(
+      target=_render,
+      args=(self.queue, title if title else network.deviceset.id, len(network), fps, cb, output_dir),
+    )
+    self.process.start()
+
+  def update(self, network, event):
+    if event not in ['after-init', 'after-step']:
+      return
+    now = time.time()
+    utility = None
+    if now - self.utility_time >= (1/self.fps if self.fps else 0):
+      (utility, self.utility_time) = (summarize(network).utility, now)
+    self._put(self.snapshot(network, utility))
+
+  @staticmethod
+  def snapshot(network, utility=None):
+    return (network.steps, np.asarray(network.price), network.excess, network.demand, network.supply, utility)
+
+  def close(self):
+    ''' Tell the renderer the run is done. An interactive dashboard shows the final frame until its
+    window is closed, and the process exits then. The final frame always has the utility.
+    '''
+    self._put(self.snapshot(self.network, summarize(self.network).utility))
+    try:
+      self.queue.put(None, timeout=5)
+    except queue.Full:
+      self.process.terminate()
+    self.process.join(timeout=1)
+
+  def _put(self, item):
+    ''' Replace whatever is queued with item, without blocking. '''
+    try:
+      self.queue.get_nowait()
+    except queue.Empty:
+      pass
+    try:
+      self.queue.put_nowait(item)
+    except queue.Full:
+      pass
+
+
+class _Dashboard():
+  ''' Renderer side. Owns the figure and its persistent artists. '''
+  fig = ax = history_ax = None
+  lines = {}
+  history = None
+  text = None
+  background = None
+  utility = None      # Latest utility received.
+
+  def __init__(self, plt, title, T, cb=None, blit=True):
+    self.plt = plt
+    self.cb = cb
+    self.blit = blit
+    (self.fig, (self.ax, self.history_ax)) = plt.subplots(2, 1, figsize=(10, 8), gridspec_kw={'height_ratios': [2, 1]})
+    self.ax.set_title(title)
+    self.ax.set_xlim(-1, T)
+    self.ax.set_xlabel('time slot')
+    self.price_ax = self.ax.twinx()
+    self.price_ax.set_ylabel('price')
+    x = np.arange(0, T)
+    self.lines = {
+      'demand': self.ax.plot(x, np.zeros(T), color='orange', label='demand', animated=blit)[0],
+      'supply': self.ax.plot(x, np.zeros(T), color='green', label='supply', animated=blit)[0],
+      'excess': self.ax.plot(x, np.zeros(T), color='r', label='excess', animated=blit)[0],
+      'price': self.price_ax.plot(x, np.zeros(T), color='b', label='price', animated=blit)[0],
+    }
+    self.ax.legend(handles=list(self.lines.values()), loc='upper right', framealpha=0.6)
+    self.history_ax.set_xlabel('step')
+    self.history_ax.set_ylabel('max |excess|')
+    self.history_ax.set_yscale('log')
+    self.history_ax.set_xlim(0, 10)
+    self.history_ax.set_ylim(1e-3, 1)
+    self.history = self.history_ax.plot([], [], color='r', animated=blit)[0]
+    self.text = self.ax.text(0.01, 0.95, '', transform=self.ax.transAxes, animated=blit)
+    self.steps = []
+    self.residuals = []
+    self.cb('after-init', plt, self) if self.cb else False
+    self.redraw()
+
+  def redraw(self):
+    ''' Full draw of the static parts, and grab the background to blit onto. '''
+    if not self.blit:
+      return
+    self.fig.canvas.draw()
+    self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+  def update(self, snapshot):
+    (steps, price, excess, demand, supply, utility) = snapshot
+    self.utility = utility if utility is not None else self.utility
+    residual = max(np.abs(excess).max(), 1e-12)
+    self.steps.append(steps)
+    self.residuals.append(residual)
+    for (name, y) in (('demand', demand), ('supply', supply), ('excess', excess), ('price', price)):
+      self.lines[name].set_ydata(y)
+    self.history.set_data(self.steps, self.residuals)
+    self.text.set_text('step %d' % (steps,) + ('  utility %.4g' % (self.utility,) if self.utility is not None else ''))
+    changed = self._rescale(price, np.concatenate((demand, supply, excess)), steps, residual)
+    if not self.blit:
+      self.cb('after-update', self.fig, self) if self.cb else False
+      return
+    if changed:
+      self.redraw()
+    self.fig.canvas.restore_region(self.background)
+    for line in self.lines.values():
+      line.axes.draw_artist(line)
+    self.history_ax.draw_artist(self.history)
+    self.ax.draw_artist(self.text)
+    self.cb('after-update', self.fig, self) if self.cb else False
+    self.fig.canvas.blit(self.fig.bbox)
+    self.fig.canvas.flush_events()
+
+  def _rescale(self, price, flows, steps, residual):
+    ''' Grow axes limits to fit the data. Returns whether any changed, which needs a full
+    redraw.
+    '''
+    changed = False
+    for (ax, lo, hi) in ((self.ax, flows.min(), flows.max()), (self.price_ax, price.min(), price.max())):
+      (_lo, _hi) = ax.get_ylim()
+      if lo < _lo or hi > _hi:
+        pad = 0.1*max(hi - lo, 1e-6)
+        ax.set_ylim(min(lo - pad, _lo), max(hi + pad, _hi))
+        changed = True
+    (_lo, _hi) = self.history_ax.get_ylim()
+    if steps > self.history_ax.get_xlim()[1]:
+      self.history_ax.set_xlim(0, 2*steps)
+      changed = True
+    if residual < _lo or residual > _hi:
+      self.history_ax.set_ylim(min(residual/10, _lo), max(residual*10, _hi))
+      changed = True
+    return changed
+
+
+def _render(q, title, T, fps, cb=None, output_dir=None):
+  ''' Renderer process main loop. Waits for snapshots and draws the latest at most `fps` times a
+  second until it gets None.
+  '''
+  import matplotlib
+  import matplotlib.pyplot as plt
+  interactive = matplotlib.get_backend().lower() not in ('agg', 'pdf', 'ps', 'svg', 'cairo', 'template')
+  if interactive:
+    plt.ion()
+  dashboard = _Dashboard(plt, title, T, cb, blit=interactive)
+  interval = 1/fps if fps else 0
+  (last, latest, done) = (0, None, False)
+  while not done:
+    try:
+      item = q.get(timeout=max(interval - (time.time() - last), 0.01) if latest is not None else 0.1)
+      if item is None:
+        done = True
+      else:
+        latest = item
+    except queue.Empty:
+      pass
+    if interactive:
+      dashboard.fig.canvas.flush_events()
+    if latest is not None and (done or time.time() - last >= interval):
+      dashboard.update(latest)
+      (last, latest) = (time.time(), None)
+      if not interactive and output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        filename = os.path.join(output_dir, 'live.png')
+        dashboard.fig.savefig(filename + '.tmp.png')
+        os.replace(filename + '.tmp.png', filename)
+  if interactive:
+    plt.ioff()
+    plt.show()
@@ -0,0 +1,98 @@
+import copy
+import logging
+import numpy as np
+from device_kit_market_simulations.reporting.writer import NetworkWriter
+from device_kit_market_simulations.reporting.summary import summarize_steps
+
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRecorder():
+  ''' In memory alternative to NetworkWriter. Keeps price and s of the last `size` steps in a ring
+  buffer plus every `every`-th step in a decimated long term trace. Both are preallocated, so memory
+  use is fixed and known up front (@see nbytes). If the trace fills up - the run went on longer than
+  expected - every other entry is dropped and `every` doubled. Nothing touches disk until spill(), or
+  close() if an output_dir was given.
+  '''
+  network = None
+  events = ['after-init', 'after-step']  # Events update() handles. @see events.py.
+  output_dir = None
+  meta = None
+  size = 10
+  every = 10
+  count = 0           # Number of steps recorded into the ring buffer.
+  trace_count = 0     # Number of entries in the trace.
+
+  def __init__(self, network, size=10, every=10, output_dir=None, meta=None):
+    self.network = network
+    self.size = size
+    self.every = every
+    self.output_dir = output_dir
+    self.meta = meta
+    shape = tuple(network.deviceset.shape)
+    trace_size = max(network.maxsteps//every + 1, 2)
+    self.s = np.empty((size,) + shape, dtype=network.dtype)
+    self.price = np.empty((size, len(network)), dtype=network.dtype)
+    self.steps = np.full(size, -1)
+    self.trace_s = np.empty((trace_size,) + shape, dtype=network.dtype)
+    self.trace_price = np.empty((trace_size, len(network)), dtype=network.dtype)
+    self.trace_steps = np.full(trace_size, -1)
+    self.count = 0
+    self.trace_count = 0
+
+  @property
+  def nbytes(self):
+    return sum(a.nbytes for a in (self.s, self.price, self.steps, self.trace_s, self.trace_price, self.trace_steps))
+
+  def update(self, network, event):
+    if event not in ['after-init', 'after-step']:
+      return
+    i = self.count % self.size
+    (self.s[i], self.price[i], self.steps[i]) = (network.s, network.price, network.steps)
+    self.count += 1
+    if network.steps % self.every == 0:
+      if self.trace_count == len(self.trace_steps):
+        self._decimate()
+      if network.steps % self.every == 0:  # Still on the (possibly coarser) grid.
+        j = self.trace_count
+        (self.trace_s[j], self.trace_price[j], self.trace_steps[j]) = (network.s, network.price, network.steps)
+        self.trace_count += 1
+
+  def _decimate(self):
+    ''' Halve the trace resolution to make room. '''
+    self.every *= 2
+    keep = np.flatnonzero(self.trace_steps[0:self.trace_count] % self.every == 0)
+    n = len(keep)
+    (self.trace_s[0:n], self.trace_price[0:n], self.trace_steps[0:n]) = (self.trace_s[keep], self.trace_price[keep], self.trace_steps[keep])
+    self.trace_steps[n:] = -1
+    self.trace_count = n
+    logger.info('History trace full. Decimated to every %d steps', self.every)
+
+  def history(self):
+    ''' Get (steps, price, s) stacked over all recorded steps - trace and ring buffer - in step order. '''
+    ring = np.flatnonzero(self.steps >= 0)
+    steps = np.concatenate((self.trace_steps[0:self.trace_count], self.steps[ring]))
+    (steps, index) = np.unique(steps, return_index=True)
+    price = np.concatenate((self.trace_price[0:self.trace_count], self.price[ring]))[index]
+    s = np.concatenate((self.trace_s[0:self.trace_count], self.s[ring]))[index]
+    return (steps, price, s)
+
+  def spill(self, output_dir=None):
+    ''' Write the recorded steps to `output_dir` in NetworkWriter's format, so NetworkReader and
+    report.py can read them. Summary rows of all the steps are computed in one batch.
+    '''
+    output_dir = output_dir if output_dir else self.output_dir
+    network = copy.copy(self.network)
+    writer = NetworkWriter(network, output_dir, self.meta)
+    history = self.history()
+    rows = summarize_steps(network, *history).to_dict('records')
+    for (step, price, s, row) in zip(*history, rows):
+      (network.steps, network.price, network.s) = (int(step), price, s)
+      writer.write(row)
+    writer.close()
+
+  def close(self):
+    if self.output_dir:
+      logger.info('Spilling %d steps of history to %s' % (len(self.history()[0]), self.output_dir))
+      self.spill()
@@ -9,6 +9,7 @@ import logging
 from logging import *
 from copy import deepcopy
 from ..network import Network
+from .summary import summarize
 
 
 class MatPlotNetworkWriter():
@@ -63,8 +64,9 @@ class MatPlotNetworkWriter():
     self.ax.clear()
 
     if self.plot_globals:
-      self.ax.plot(range(0, len(network)), network.price, color='b', label='price')
-      self.ax.plot(range(0, len(network)), network.excess, color='r', label='excess')
+      summary = summarize(network)
+      self.ax.plot(range(0, len(network)), summary.price, color='b', label='price')
+      self.ax.plot(range(0, len(network)), summary.excess, color='r', label='excess')
 
     # Plot possibly filtered list of items of network as stacked bars.
     df = network.df()
@@ -0,0 +1,114 @@
+''' Per step summary statistics of a Network. Everything the printer, writers and reports show about
+a step is computed here in one pass and cached on the network, so the per agent utility evaluations -
+the expensive part - are done once per step no matter how many consumers there are. For many steps
+at once - a whole recorded run - summarize_steps() evaluates utilities in batches instead.
+'''
+import numpy as np
+import pandas as pd
+from device_kit_market_simulations.batch import batch_u
+
+
+class NetworkSummary():
+  ''' Summary statistics of a network at one step. Vectors are over time slots except utilities*,
+  which are per agent in deviceset order.
+  '''
+  steps = 0
+  maxsteps = None
+  stepsize = None
+  tol = None
+  stable = False
+  num_agents = 0
+  price = excess = demand = supply = None
+  cost = None             # demand*price.
+  supply_cost = None      # supply*price.
+  utilities = None        # Per agent utility at the current price.
+  utilities_zero = None   # Per agent utility at zero price.
+  utility = utility_zero = 0
+  load_factor = 1
+  peak = 0
+  bytes_sent = bytes_received = 0   # Traffic to and from agents this step. @see Network.map_agents().
+
+  def __init__(self, network):
+    s = network.s
+    price = network.price
+    zeros = np.zeros(len(network))
+    self.steps = network.steps
+    self.maxsteps = network.maxsteps
+    self.stepsize = network.get_stepsize()
+    self.tol = network.tol
+    self.num_agents = len(network.deviceset.devices)
+    self.price = price
+    self.demand = np.maximum(s, 0).sum(axis=0)
+    self.supply = np.minimum(s, 0).sum(axis=0)
+    self.excess = self.demand + self.supply
+    self.stable = bool(network.stable)
+    self.cost = self.demand*price
+    self.supply_cost = self.supply*price
+    self.peak = self.demand.max()
+    self.load_factor = np.average(self.demand)/self.peak if self.peak else 1
+    if getattr(network, 'traffic', None):
+      (self.bytes_sent, self.bytes_received) = (network.traffic['sent'], network.traffic['received'])
+    (self.utilities, self.utilities_zero) = batch_u(network.deviceset, np.stack((s, s)), np.stack((price, zeros)))
+    self.utility = self.utilities.sum()
+    self.utility_zero = self.utilities_zero.sum()
+
+  def to_row(self):
+    ''' Scalar statistics as a flat dict. @see NetworkWriter. '''
+    return {
+      'steps': self.steps,
+      'utility': self.utility,
+      'utility_zero': self.utility_zero,
+      'load_factor': self.load_factor,
+      'peak': self.peak,
+      'price_avg': np.average(self.price),
+      'excess_tot': self.excess.sum(),
+      'excess_max': np.abs(self.excess).max(),
+      'demand_tot': self.demand.sum(),
+      'supply_tot': self.supply.sum(),
+      'cost_tot': self.supply_cost.sum(),
+      'stable': self.stable,
+      'bytes_sent': self.bytes_sent,
+      'bytes_received': self.bytes_received,
+    }
+
+
+def summarize_steps(network, steps, price, s, pool=None):
+  ''' Summary rows, as NetworkSummary.to_row(), of many steps of `network`'s market at once. `steps`
+  (k,), `price` (k, T) and `s` (k, rows, T) are stacked over steps. Utilities at the price and at zero
+  price are evaluated in one batch_u() call, over `pool` if given. Returns a DataFrame. Traffic isn't
+  recorded with steps, so there are no bytes_* columns.
+  '''
+  (price, s) = (np.asarray(price, dtype=float), np.asarray(s, dtype=float))
+  k = len(steps)
+  utilities = batch_u(network.deviceset, np.concatenate((s, s)), np.concatenate((price, np.zeros(price.shape))), pool)
+  demand = np.maximum(s, 0).sum(axis=1)
+  supply = np.minimum(s, 0).sum(axis=1)
+  excess = demand + supply
+  peak = demand.max(axis=1)
+  return pd.DataFrame({
+    'steps': steps,
+    'utility': utilities[0:k].sum(axis=1),
+    'utility_zero': utilities[k:].sum(axis=1),
+    'load_factor': np.where(peak > 0, demand.mean(axis=1)/np.where(peak > 0, peak, 1), 1),
+    'peak': peak,
+    'price_avg': price.mean(axis=1),
+    'excess_tot': excess.sum(axis=1),
+    'excess_max': np.abs(excess).max(axis=1),
+    'demand_tot': demand.sum(axis=1),
+    'supply_tot': supply.sum(axis=1),
+    'cost_tot': (supply*price).sum(axis=1),
+    'stable': (np.abs(excess) <= network.tol).all(axis=1),
+  })
+
+
+def summarize(network):
+  ''' Get the NetworkSummary of `network` at its current step. The summary is cached on the network
+  and only recomputed once the step, s or price change (@see Network.version).
+  '''
+  key = (network.steps, network.version)
+  cached = getattr(network, '_summary', None)
+  if cached is not None and cached[0] == key:
+    return cached[1]
+  summary = NetworkSummary(network)
+  network._summary = (key, summary)
+  return summary
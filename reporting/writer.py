@@ -1,12 +1,17 @@
 import sys
 import os
 import re
+import csv
 import time
 import json
 import importlib
 from glob import glob
 import logging
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
 from device_kit_market_simulations.utils._make_iterencode import _make_iterencode
+from device_kit_market_simulations.reporting.summary import summarize, summarize_steps
 
 
 logger = logging.getLogger(__name__)
@@ -56,11 +61,15 @@ def JSONDecoderObjectHook(o):
 class NetworkWriter():
   ''' Serialize the network and save consumption matrix at every call to update. Given the network
   (which includes all it's agents) only the consumption matrix is needed to replay the scenario completely.
+  Also writes a row of summary stats (@see summary.py) per step to summary.csv.
   '''
   output_dir = None
   network = None
   meta = None
   indent = 2
+  events = ['after-init', 'after-step']  # Events update() handles. @see events.py.
+  summary_file = None
+  summary_writer = None
 
   def __init__(self, network, output_dir=None, meta=None):
     ''' Init network writer.
@@ -78,18 +87,30 @@ class NetworkWriter():
         json.dump(meta, f)
 
   def update(self, network, event):
-    filename_tmpl = '{dir}/network-{step}.json'
     if event in ['after-init', 'after-step']:
-      filename = filename_tmpl.format(
-        dir=self.output_dir,
-        step=self.network.steps
-      )
-      logger.info('Writing %s', filename)
-      with open(filename, 'w') as f:
-        json.dump(self.network, f, indent=self.indent, cls=JSONEncoder)
+      self.write()
+
+  def write(self, row=None):
+    ''' Write the network at its current step, and its summary row - computed unless given. '''
+    filename = '{dir}/network-{step}.json'.format(dir=self.output_dir, step=self.network.steps)
+    logger.info('Writing %s', filename)
+    with open(filename, 'w') as f:
+      json.dump(self.network, f, indent=self.indent, cls=JSONEncoder)
+    self._write_summary(row if row is not None else summarize(self.network).to_row())
 
   def close(self):
     logger.info('Writer storing simulation raw data to %s' % (self.output_dir,))
+    if self.summary_file:
+      self.summary_file.close()
+      (self.summary_file, self.summary_writer) = (None, None)
+
+  def _write_summary(self, row):
+    if not self.summary_writer:
+      self.summary_file = open(self.output_dir + '/summary.csv', 'w', newline='')
+      self.summary_writer = csv.DictWriter(self.summary_file, fieldnames=list(row.keys()))
+      self.summary_writer.writeheader()
+    self.summary_writer.writerow(row)
+    self.summary_file.flush()
 
   @classmethod
   def _get_indent(cls):
@@ -125,6 +146,22 @@ class NetworkReader():
       with open(filename, 'r') as f:
         yield json.load(f, object_hook=JSONDecoderObjectHook)
 
+  def summary(self, processes=None):
+    ''' Get a pandas DataFrame with a row of summary stats per step, read from the summary.csv written
+    by NetworkWriter if there is one, else computed from all steps at once with utilities evaluated
+    on a Pool of `processes` (@see summarize_steps()).
+    '''
+    filename = self.output_dir + '/summary.csv'
+    if os.path.isfile(filename):
+      return pd.read_csv(filename)
+    if not len(self):
+      return pd.DataFrame()
+    (steps, price, s) = ([], [], [])
+    for network in self:
+      (steps, price, s) = (steps + [network.steps], price + [network.price], s + [network.s])
+    with Pool(processes) as pool:
+      return summarize_steps(network, np.array(steps), np.array(price), np.array(s), pool)
+
   def get(self, i):
     with open(self.files[i], 'r') as f:
       return json.load(f, object_hook=JSONDecoderObjectHook)
@@ -0,0 +1,79 @@
+''' Rolling (receding) horizon market clearing. Rather than clear one fixed day-ahead horizon, the
+market is re-cleared every interval as the horizon rolls forward. Each interval starts from the
+previous interval's equilibrium shifted forward, which is usually close, so most intervals only need
+a few steps. Scenarios supply the horizon for each interval with a function like:
+
+    def make_rolling_deviceset(offset):
+      """ Deviceset for the horizon starting `offset` slots after the first one. """
+'''
+import time
+import logging
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class RollingHorizon():
+  ''' Clear `network` repeatedly over a rolling horizon. make_deviceset(offset) gives the deviceset
+  for the horizon `offset` slots on from the first; it must keep the same shape. The horizon is
+  moved forward `shift` slots per interval. The latency of each interval's clear is measured and
+  checked against `budget`.
+  '''
+  network = None
+  make_deviceset = None
+  shift = 1
+  budget = None     # Seconds allowed to clear an interval. Intervals over budget are logged.
+  interval = 0      # Next interval to clear.
+  results = []      # Per interval dict of stats.
+
+  def __init__(self, network, make_deviceset, shift=1, budget=None):
+    self.network = network
+    self.make_deviceset = make_deviceset
+    self.shift = shift
+    self.budget = budget
+    self.interval = 0
+    self.results = []
+
+  def run(self, intervals, listeners=()):
+    ''' Clear `intervals` intervals, reusing one agent pool for all of them. '''
+    with self.network.make_pool() as pool:
+      for i in range(0, intervals):
+        self.step(listeners, pool)
+    return self.results
+
+  def step(self, listeners=(), pool=None):
+    ''' Clear the next interval. The first interval is a cold start. '''
+    network = self.network
+    if self.interval > 0:
+      network.shift(self.shift, self.make_deviceset(self.interval*self.shift))
+    t = time.perf_counter()
+    converged = network.run(listeners, warm_start=self.interval > 0, pool=pool)
+    latency = time.perf_counter() - t
+    result = {
+      'interval': self.interval,
+      'steps': network.steps,
+      'converged': converged,
+      'latency': latency,
+      'over_budget': bool(self.budget and latency > self.budget),
+      'price': network.price[0],
+      'excess': np.abs(network.excess).sum(),
+    }
+    self.results.append(result)
+    if result['over_budget']:
+      logger.warning('Interval %d took %.3fs; over budget of %.3fs', self.interval, latency, self.budget)
+    self.interval += 1
+    return result
+
+  def stats(self):
+    ''' Latency summary over the intervals cleared so far. '''
+    latencies = np.array([r['latency'] for r in self.results])
+    return {
+      'intervals': len(latencies),
+      'latency_mean': latencies.mean(),
+      'latency_p50': np.percentile(latencies, 50),
+      'latency_p95': np.percentile(latencies, 95),
+      'latency_max': latencies.max(),
+      'over_budget': sum(r['over_budget'] for r in self.results),
+      'steps_mean': np.mean([r['steps'] for r in self.results]),
+    }
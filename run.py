@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 ''' This script loads a Network configuration, initializes it, hooks up the in and outs then runs it. '''
+import os
 import sys
 import re
+import csv
 import argparse
 import importlib
+import hashlib
+import cProfile
 import time
 import json
 import logging
 from os.path import *
-from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.network import Network, AgentFailureException
+from device_kit_market_simulations.rolling import RollingHorizon
+from device_kit_market_simulations.multires import MultiResolution
+from device_kit_market_simulations.events import EventBus
 from device_kit_market_simulations.reporting.templates import network_to_str
 from device_kit_market_simulations.reporting.writer import NetworkWriter, JSONDecoderObjectHook
+from device_kit_market_simulations.reporting.history import HistoryRecorder
+from device_kit_market_simulations.reporting.dashboard import LiveDashboardWriter
+from device_kit_market_simulations.scenario_cache import ScenarioCache, scenario_hash
+from device_kit_market_simulations.catalog import RunCatalog, run_key, code_hash
+from device_kit_market_simulations.memo import ResponseCache
+from device_kit_market_simulations.profiling import AgentProfiles
+from device_kit_market_simulations.reporting.summary import summarize
+from device_kit_market_simulations.precision import validate_precision
 
 
 logging.basicConfig()
@@ -23,6 +38,32 @@ def main():
   parser.add_argument('scenario', action='store',
     help='name of a python module containing device_kit scenario to run.'
   )
+  parser.add_argument('--scenario-arg', '-a',
+    dest='scenario_args', action='append', default=[],
+    help='KEY=VALUE argument to the scenario\'s make_deviceset(). VALUE is parsed as JSON if it can be. Repeatable'
+  )
+  parser.add_argument('--scenario-cache',
+    dest='scenario_cache', default=None, nargs='?', const=True, metavar='DIR',
+    help='load the built scenario from a cache, in DIR or the default cache dir. Off by default since data '
+      'files the scenario reads aren\'t part of the cache key. @see scenario_cache.py'
+  )
+  parser.add_argument('--refresh-scenario-cache',
+    dest='refresh_scenario_cache', action='store_true',
+    help='rebuild the scenario and replace any cached copy. Implies --scenario-cache'
+  )
+  parser.add_argument('--catalog',
+    dest='catalog', default=None, type=str,
+    help='SQLite run catalog to record runs in and look identical runs up in. @see catalog.py'
+  )
+  parser.add_argument('--no-catalog',
+    dest='no_catalog', action='store_true',
+    help='don\'t record the run in the catalog'
+  )
+  parser.add_argument('--reuse',
+    dest='reuse', action='store_true',
+    help='if an identical run of the same code is in the catalog, link the output dir to its results '
+      'instead of running. Data files the scenario reads aren\'t checked'
+  )
 
   group = parser.add_argument_group('Network')
   group.add_argument('--network', '-n',
@@ -46,7 +87,96 @@ def main():
   )
   group.add_argument('--agent-strategy', '-x',
     dest='agent_strategy',
-    help='agent bid strategy'
+    help='agent bid strategy: point bid (default), limited_minimization, function_bid or admm'
+  )
+  group.add_argument('--rho',
+    dest='rho', type=float,
+    help='initial ADMM penalty for the admm agent strategy. Adapted during the run'
+  )
+  group.add_argument('--price-update',
+    dest='price_update', choices=['gradient', 'newton'],
+    help='price adjustment method. newton needs the function_bid agent strategy'
+  )
+  group.add_argument('--agent-workers', '-w',
+    dest='agent_workers', type=lambda v: v.split(','),
+    help='comma separated addresses of agent workers to solve agents on. @see transport.py'
+  )
+  group.add_argument('--agent-timeout',
+    dest='agent_timeout', type=float,
+    help='seconds an agent has to bid before its previous bid is used'
+  )
+  group.add_argument('--backend', '-b',
+    dest='backend', choices=['serial', 'thread', 'process', 'auto'],
+    help='execution backend to solve agents on. "auto" benchmarks the first steps and picks one'
+  )
+  group.add_argument('--schedule',
+    dest='schedule', choices=['lpt'],
+    help='pack agents onto process workers longest-processing-time first by measured solve time'
+  )
+  group.add_argument('--sparse',
+    dest='sparse', action='store_true', default=None,
+    help='only send and solve each agent\'s active time window'
+  )
+  group.add_argument('--memo',
+    dest='memo', nargs='?', const=True, default=None,
+    help='cache agent responses by price. If a file is given the cache is kept in it and shared between runs. @see memo.py'
+  )
+  group.add_argument('--memo-size',
+    dest='memo_size', type=int, default=None,
+    help='max responses cached in memory per agent'
+  )
+  group.add_argument('--memo-quantum',
+    dest='memo_quantum', type=float, default=None,
+    help='prices within MEMO_QUANTUM of each other are treated as the same for the response cache'
+  )
+  group.add_argument('--compress',
+    dest='compress', action='store_true', default=None,
+    help='agents send back only the changes to their bids. @see compression.py'
+  )
+  group.add_argument('--compress-threshold',
+    dest='compress_threshold', type=float, default=None,
+    help='bid changes no bigger than this aren\'t sent (until they add up). Implies --compress'
+  )
+  group.add_argument('--compress-topk',
+    dest='compress_topk', type=float, default=None,
+    help='send only this fraction of each bid\'s cells, the biggest changes. Implies --compress'
+  )
+  group.add_argument('--compress-bits',
+    dest='compress_bits', type=int, choices=[8, 16, 32], default=None,
+    help='quantize bid changes to integers of this many bits. Implies --compress'
+  )
+  group.add_argument('--dtype',
+    dest='dtype', choices=['float64', 'float32'],
+    help='precision of the market state and the arrays exchanged with agents'
+  )
+  group.add_argument('--compact-storage',
+    dest='compact_storage', action='store_true', default=None,
+    help='leave all zero rows of the flow matrix out of written networks'
+  )
+  group.add_argument('--validate-precision',
+    dest='validate_precision', action='store_true',
+    help='after the run, re-run in float64 and report how far the equilibrium drifted. Written to precision.json'
+  )
+  group.add_argument('--multires',
+    dest='multires', type=lambda v: [int(k) for k in v.split(',')], default=None,
+    help='comma separated factors to coarsen the horizon by, coarsest first. The market is cleared at each coarse resolution first to warm start the next. @see multires.py'
+  )
+  group.add_argument('--multires-maxsteps',
+    dest='multires_maxsteps', type=int, default=None,
+    help='maximum number of iterations at each coarse resolution. Defaults to --maxsteps'
+  )
+  group = parser.add_argument_group('Rolling horizon')
+  group.add_argument('--rolling', '-r',
+    dest='rolling', type=int, default=None,
+    help='clear this many intervals of a rolling horizon. Scenario must define make_rolling_deviceset(offset)'
+  )
+  group.add_argument('--rolling-shift',
+    dest='rolling_shift', type=int, default=1,
+    help='slots the horizon moves forward each interval'
+  )
+  group.add_argument('--rolling-budget',
+    dest='rolling_budget', type=float, default=None,
+    help='seconds allowed to clear an interval. Intervals over budget are reported'
   )
   group = parser.add_argument_group('Output')
   group.add_argument('-d',
@@ -56,33 +186,134 @@ def main():
   group.add_argument('-v', dest='verbose', default=0, type=int,
     help='verbosity'
   )
+  group.add_argument('--write-every',
+    dest='write_every', type=int, default=1,
+    help='only print and write every WRITE_EVERY-th step, plus the first and last'
+  )
+  group.add_argument('--live',
+    dest='live', nargs='?', const=10, default=None, type=float,
+    help='show a live dashboard of the run, redrawn at most LIVE (default 10) times a second. Saved to live.png if there is no display'
+  )
+  group.add_argument('--profile',
+    dest='profile', action='store_true',
+    help='profile the run and each agent\'s solves in the workers. Written to profile/ in the output dir. @see utils/ppstats.py'
+  )
+  group.add_argument('--history',
+    dest='history', default=None, type=int,
+    help='keep the last HISTORY steps in memory and only write them out at the end, instead of writing every step'
+  )
+  group.add_argument('--history-every',
+    dest='history_every', default=10, type=int,
+    help='with --history also keep every HISTORY_EVERY-th step'
+  )
 
   args = parser.parse_args()
+  catalog = None if args.no_catalog or args.rolling else RunCatalog(args.catalog)
+  if catalog:
+    (_hash, params) = (hash_scenario(args.scenario, parse_scenario_args(args.scenario_args)), result_params(args))
+    key = run_key(_hash, params, code_hash())
+    found = catalog.lookup(key) if args.reuse else None
+    if found:
+      print('Identical run already in catalog, not re-running. Results in %s' % (found['output_dir'],))
+      print(' '.join('%s=%s' % (k, found[k]) for k in ('steps', 'stable', 'utility', 'excess_max', 'price_avg', 'elapsed')))
+      link_output(found['output_dir'], args.output_dir)
+      catalog.close()
+      return
   (network, meta, matplotlib_cb) = load_network(**vars(args))
   output_dir = args.output_dir if args.output_dir else '{filename}-{time}-network'.format(
     filename=basename(args.scenario),
     time=time.strftime('%Y%m%d-%H%M%S%z'),
   )
 
+  if args.rolling:
+    run_rolling(network, meta, output_dir, args)
+    return
+
   # Init writers, run, close writers.
   # NetworkWriter just dumps JSON file encoding complete network with every call to update().
   writers = load_writers(network, meta, output_dir, args, matplotlib_cb)
-  listeners = [
-    lambda network, event, verbose=args.verbose: print_listener(network, event, verbose),
-    lambda network, event, w=writers: [writer.update(network, event) for writer in w]
-  ]
-  network.run(listeners)
+  listeners = make_listeners(writers, args)
+  if args.memo:
+    network.response_cache = ResponseCache(args.memo_size, args.memo_quantum, None if args.memo is True else args.memo)
+  profiler = None
+  if args.profile:
+    if args.agent_workers:
+      logger.warning('Agent solves on remote agent workers aren\'t profiled')
+    else:
+      network.profiles = AgentProfiles()
+    profiler = cProfile.Profile()
+    profiler.enable()
+  started = time.time()
+  try:
+    if args.multires:
+      MultiResolution(network, args.multires, args.multires_maxsteps).run(listeners)
+    else:
+      network.run(listeners)
+  except AgentFailureException as e:
+    [writer.close() for writer in writers]
+    logger.error('Run aborted [%s]' % (e,))
+    sys.exit(1)
+  if profiler:
+    profiler.disable()
+    dump_profiles(network, profiler, output_dir + '/profile')
   [writer.close() for writer in writers]
+  if catalog:
+    catalog.record(key, args.scenario, _hash, params, output_dir, summarize(network), started, time.time() - started)
+    catalog.close()
+  if args.validate_precision:
+    report = validate_precision(network)
+    print('=== precision drift vs float64: %s' % (' '.join('%s=%s' % (k, v) for (k, v) in report.items()),))
+    with open(output_dir + '/precision.json', 'w') as f:
+      json.dump(report, f, indent=2)
+
+
+def run_rolling(network, meta, output_dir, args):
+  ''' Clear a rolling horizon. Each interval is written to its own sub directory of output_dir and a
+  row of stats per interval is written to rolling.csv.
+  '''
+  make_deviceset = load_rolling_scenario(args.scenario)
+  network.deviceset = make_deviceset(0)
+  rolling = RollingHorizon(network, make_deviceset, shift=args.rolling_shift, budget=args.rolling_budget)
+  if not isdir(output_dir):
+    os.makedirs(output_dir)
+  with network.make_pool() as pool:
+    for i in range(0, args.rolling):
+      writers = [NetworkWriter(network, '%s/interval-%04d' % (output_dir, i), meta)]
+      listeners = make_listeners(writers, args)
+      result = rolling.step(listeners, pool)
+      [writer.close() for writer in writers]
+      print('=== interval %d: steps=%d converged=%s latency=%.3fs' % (i, result['steps'], result['converged'], result['latency']))
+  with open(output_dir + '/rolling.csv', 'w') as f:
+    writer = csv.DictWriter(f, fieldnames=list(rolling.results[0].keys()))
+    writer.writeheader()
+    writer.writerows(rolling.results)
+  for (k, v) in rolling.stats().items():
+    print('%-16s %s' % (k, v))
 
 
 def load_writers(network, meta, output_dir, args, matplotlib_cb):
-  ''' Load default writers. '''
-  writers = [
-    NetworkWriter(network, output_dir, meta)
-  ]
+  ''' Load default writers, plus a live dashboard using the scenario's matplotlib hook if asked for. '''
+  if args.history:
+    writers = [HistoryRecorder(network, args.history, args.history_every, output_dir, meta)]
+  else:
+    writers = [NetworkWriter(network, output_dir, meta)]
+  if args.live:
+    title = meta.get('title') if isinstance(meta, dict) else None
+    writers.append(LiveDashboardWriter(network, title, args.live, matplotlib_cb, output_dir))
   return writers
 
 
+def make_listeners(writers, args):
+  ''' EventBus of the step printer and `writers`. The printer and NetworkWriters only get every
+  --write-every-th step, and the first and last. Other writers decimate themselves if at all.
+  '''
+  bus = EventBus()
+  bus.subscribe(lambda network, event, verbose=args.verbose: print_listener(network, event, verbose), ['after-init', 'after-step'], args.write_every)
+  for writer in writers:
+    bus.subscribe(writer.update, writer.events, args.write_every if isinstance(writer, NetworkWriter) else 1)
+  return bus
+
+
 def load_network(scenario, network_class=None, **kwargs):
   ''' Load scenario which either a couple JSON files or a conforming python module.
   Python module:
@@ -101,14 +332,20 @@ def load_network(scenario, network_class=None, **kwargs):
   print('Loading %s' % (scenario))
   if re.match('.*\.py$', scenario):
     try:
-      (scenario, meta, cb) = load_scenario(scenario)
+      cache_dir = kwargs.get('scenario_cache')
+      cache = None
+      if cache_dir or kwargs.get('refresh_scenario_cache'):
+        cache = ScenarioCache(cache_dir if isinstance(cache_dir, str) else None, kwargs.get('refresh_scenario_cache'))
+      (scenario, meta, cb) = load_scenario(scenario, parse_scenario_args(kwargs.get('scenario_args')), cache)
     except Exception as e:
       logger.error('Could not load scenario "%s" [%s]' % (scenario, e))
       sys.exit(1)
     print('Loaded scenario module %s.' % (scenario,))
     print('Loading network')
-    known_network_args = ['maxiter', 'tol', 'stepsize', 'prox', 'agent_strategy']
+    known_network_args = ['maxiter', 'tol', 'stepsize', 'prox', 'agent_strategy', 'agent_workers', 'agent_timeout', 'sparse', 'backend', 'schedule', 'price_update', 'dtype', 'compact_storage', 'rho']
     network_params = {k: v for k, v in kwargs.items() if k in known_network_args and v is not None}
+    if compression_params(kwargs):
+      network_params['compression'] = compression_params(kwargs)
     if network_class is None:
       network = Network
     else:
@@ -141,11 +378,105 @@ def load_network(scenario, network_class=None, **kwargs):
   return (network, meta, cb)
 
 
-def load_scenario(scenario):
+def dump_profiles(network, profiler, output_dir):
+  ''' Write the coordinator profile and per agent profiles, and print the agents' time table. '''
+  if network.profiles is not None:
+    network.profiles.dump(output_dir)
+    table = network.profiles.table()
+    if len(table):
+      print('=== agent solve profile (%s)' % (output_dir,))
+      print(table.head(20).to_string(index=False))
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  profiler.dump_stats(output_dir + '/coordinator.prof')
+
+
+def link_output(found, output_dir):
+  ''' Make `output_dir`, if given, a symlink to the output dir of a reused run. '''
+  if not output_dir or realpath(output_dir) == realpath(found):
+    return
+  if exists(output_dir) or islink(output_dir):
+    logger.warning('Not linking %s to the reused run, it already exists', output_dir)
+    return
+  os.makedirs(dirname(abspath(output_dir)), exist_ok=True)
+  os.symlink(abspath(found), output_dir)
+  print('Linked %s to it' % (output_dir,))
+
+
+def hash_scenario(scenario, args=None):
+  ''' scenario_hash() of a scenario module, or a hash of the file for JSON networks. '''
+  if re.match(r'.*\.py$', scenario):
+    return scenario_hash(importlib.import_module(make_module_path(scenario)), args)
+  with open(scenario, 'rb') as f:
+    return hashlib.sha256(f.read()).hexdigest()[0:16]
+
+
+result_args = [  # Args that can change a run's result. @see result_params().
+  'network_class', 'tol', 'stepsize', 'maxsteps', 'prox', 'agent_strategy', 'rho', 'price_update',
+  'agent_timeout', 'sparse', 'dtype', 'memo', 'memo_size', 'memo_quantum', 'multires', 'multires_maxsteps',
+]
+non_result_args = [  # Args that only change where and how a run is executed, cached or written.
+  'scenario', 'scenario_args', 'scenario_cache', 'refresh_scenario_cache', 'catalog', 'no_catalog', 'reuse',
+  'agent_workers', 'backend', 'schedule', 'compact_storage', 'validate_precision', 'rolling', 'rolling_shift',
+  'rolling_budget', 'output_dir', 'verbose', 'write_every', 'live', 'profile', 'history', 'history_every',
+]  # The scenario and its args are keyed by hash_scenario(), and compress* args by compression_params().
+
+
+def result_params(args):
+  ''' The args that determine a run's result, for the catalog: result_args that are set, and the
+  compression params. Memo options only matter with --memo and multires ones with --multires, so
+  they are left out otherwise.
+  '''
+  params = {k: getattr(args, k) for k in result_args if getattr(args, k, None) is not None}
+  if not params.get('memo'):
+    [params.pop(k, None) for k in ('memo_size', 'memo_quantum')]
+  if not params.get('multires'):
+    params.pop('multires_maxsteps', None)
+  if compression_params(vars(args)):
+    params['compression'] = compression_params(vars(args))
+  return params
+
+
+def compression_params(kwargs):
+  ''' BidCodec params from the --compress* args, or None if bids aren't compressed. '''
+  params = {k: kwargs.get('compress_' + k) for k in ('threshold', 'topk', 'bits')}
+  if not kwargs.get('compress') and all(v is None for v in params.values()):
+    return None
+  return params
+
+
+def load_scenario(scenario, args=None, cache=None):
+  ''' Import scenario module and build its deviceset with make_deviceset(**args). The deviceset comes
+  from `cache` - a ScenarioCache, True for the default one, or None for no cache - when possible.
+  Caching is opt in, since data files a scenario reads aren't part of the cache key.
+  '''
   scenario = importlib.import_module(make_module_path(scenario))
   meta = scenario.meta if hasattr(scenario, 'meta') else None
   cb = scenario.matplot_network_writer_hook if hasattr(scenario, 'matplot_network_writer_hook') else None
-  return (scenario.make_deviceset(), meta, cb)
+  cache = ScenarioCache() if cache is True else cache
+  deviceset = cache.load(scenario, args) if cache else scenario.make_deviceset(**(args or {}))
+  return (deviceset, meta, cb)
+
+
+def parse_scenario_args(args):
+  ''' Parse a list of KEY=VALUE strings to a dict. '''
+  parsed = {}
+  for arg in args or []:
+    (k, v) = arg.split('=', 1)
+    try:
+      parsed[k] = json.loads(v)
+    except ValueError:
+      parsed[k] = v
+  return parsed
+
+
+def load_rolling_scenario(scenario):
+  ''' Get the make_rolling_deviceset(offset) function of a scenario module. '''
+  scenario = importlib.import_module(make_module_path(scenario))
+  if not hasattr(scenario, 'make_rolling_deviceset'):
+    logger.error('Scenario "%s" does not define make_rolling_deviceset()' % (scenario.__name__,))
+    sys.exit(1)
+  return scenario.make_rolling_deviceset
 
 
 def make_module_path(s):
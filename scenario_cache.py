@@ -0,0 +1,95 @@
+''' Cache of built scenario devicesets. Building a large generated scenario - or one that reads
+profile data - can take much longer than the simulation itself, and run.py and solve.py rebuild it on
+every invocation. ScenarioCache pickles the deviceset make_deviceset() returns, keyed on a hash of the
+scenario module's source and the arguments it was built with, and loads that on later runs. Editing
+the module changes the key, so stale entries are never used (and are cleaned up on the next store).
+Data files a scenario reads are not part of the key; clear the cache, or pass `refresh`, if they change.
+That is why caching is opt in (@see run.load_scenario()).
+'''
+import os
+import glob
+import pickle
+import hashlib
+import logging
+import inspect
+import device_kit
+
+
+logger = logging.getLogger(__name__)
+
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'device_kit_market_simulations', 'scenarios')
+
+
+def scenario_hash(module, args=None):
+  ''' Hash of a scenario module's source, the args to its make_deviceset(), and the device_kit version
+  (which determines the class layout of what's built).
+  '''
+  h = hashlib.sha256()
+  with open(inspect.getsourcefile(module), 'rb') as f:
+    h.update(f.read())
+  h.update(repr(sorted((args or {}).items())).encode())
+  h.update(repr(getattr(device_kit, '__version__', device_kit.__file__)).encode())
+  return h.hexdigest()[0:16]
+
+
+class ScenarioCache():
+  ''' Pickle file per (scenario module, source hash, args) under `cache_dir`. '''
+  cache_dir = None
+  refresh = False     # Ignore existing entries, always build and store.
+  hits = misses = 0
+
+  def __init__(self, cache_dir=None, refresh=False):
+    self.cache_dir = cache_dir if cache_dir else default_cache_dir
+    self.refresh = refresh
+    self.hits = self.misses = 0
+
+  def key(self, module, args=None):
+    return scenario_hash(module, args)
+
+  def path(self, module, key):
+    return os.path.join(self.cache_dir, '%s-%s.pickle' % (module.__name__, key))
+
+  def load(self, module, args=None):
+    ''' Get deviceset built by module.make_deviceset(**args), from the cache if possible. '''
+    args = args or {}
+    key = self.key(module, args)
+    path = self.path(module, key)
+    if not self.refresh and os.path.exists(path):
+      try:
+        with open(path, 'rb') as f:
+          deviceset = pickle.load(f)
+        self.hits += 1
+        logger.info('Loaded scenario %s from cache %s' % (module.__name__, path))
+        return deviceset
+      except Exception as e:
+        logger.warning('Could not load cached scenario %s [%s]. Rebuilding' % (path, e))
+    self.misses += 1
+    deviceset = module.make_deviceset(**args)
+    self.store(module, key, deviceset)
+    return deviceset
+
+  def store(self, module, key, deviceset):
+    ''' Write deviceset to the cache, replacing any entries for module built from other sources. Written
+    to a temp file then moved into place, so concurrent runs never see a partial entry. Devicesets that
+    can't be pickled just aren't cached.
+    '''
+    path = self.path(module, key)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+      os.makedirs(self.cache_dir, exist_ok=True)
+      with open(tmp, 'wb') as f:
+        pickle.dump(deviceset, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp, path)
+    except Exception as e:
+      logger.warning('Could not cache scenario %s [%s]' % (module.__name__, e))
+      if os.path.exists(tmp):
+        os.remove(tmp)
+      return
+    for stale in glob.glob(os.path.join(self.cache_dir, '%s-*.pickle' % (module.__name__,))):
+      if stale != path and self._is_stale(module, stale):
+        os.remove(stale)
+
+  def _is_stale(self, module, path):
+    ''' An entry for module is stale if it was stored before the module source last changed. '''
+    return os.path.getmtime(path) < os.path.getmtime(inspect.getsourcefile(module))
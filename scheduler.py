@@ -0,0 +1,42 @@
+''' Cost aware packing of agent solves onto workers. Agents vary a lot in solve cost, and with plain
+chunking over agents in deviceset order one slow agent can hold up a whole step while other workers
+idle. LPTScheduler packs agents with the longest-processing-time-first rule using each agent's
+measured solve time, and keeps updating those costs so packing follows them as they change (solves
+tend to get cheaper near convergence as warm starts get better).
+'''
+import heapq
+import numpy as np
+
+
+class LPTScheduler():
+  ''' Longest processing time first packing. Tasks are identified by position, which for Network is
+  the agent. The cost of a task is an exponentially weighted moving average of its measured times;
+  tasks with no measurement yet get the mean cost of the others.
+  '''
+  alpha = 0.5         # Weight of the newest measurement in the moving average.
+  costs = {}          # Task index to cost estimate (seconds).
+  makespan = 0        # Estimated time of the most loaded worker in the last schedule.
+  imbalance = 1       # makespan / mean worker load in the last schedule.
+
+  def __init__(self, alpha=None):
+    self.alpha = alpha if alpha is not None else self.alpha
+    self.costs = {}
+
+  def schedule(self, n, workers):
+    ''' Pack tasks 0..n-1 onto at most `workers` bins. Returns a list of lists of task indices. '''
+    default = np.mean(list(self.costs.values())) if self.costs else 1.0
+    costs = [self.costs.get(i, default) for i in range(0, n)]
+    heap = [(0.0, k, []) for k in range(0, max(min(workers, n), 1))]
+    for i in sorted(range(0, n), key=lambda i: -costs[i]):
+      (load, k, _bin) = heapq.heappop(heap)
+      _bin.append(i)
+      heapq.heappush(heap, (load + costs[i], k, _bin))
+    loads = [load for (load, k, _bin) in heap]
+    self.makespan = max(loads)
+    self.imbalance = self.makespan/np.mean(loads) if np.mean(loads) else 1
+    return [_bin for (load, k, _bin) in sorted(heap, key=lambda v: v[1]) if _bin]
+
+  def update(self, times):
+    ''' Update costs from a dict of task index to measured seconds. '''
+    for (i, t) in times.items():
+      self.costs[i] = t if i not in self.costs else self.alpha*t + (1 - self.alpha)*self.costs[i]
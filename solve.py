@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
 ''' Convenience script to just solve for outright cost minimized balanced flow - no market sim crap.
+
+Also usable as a module. CentralSolver sets up the balanced problem for a deviceset once and can then
+solve it repeatedly, at different prices and from different (warm) start points. solve_batch() fans
+a list of variants out over a process pool, and optimality_gap() compares a market run against the
+central optimum.
 '''
 from os.path import basename
 import logging
@@ -7,12 +12,16 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
-from scipy.optimize import minimize
+from multiprocessing import Pool
 import device_kit
+from device_kit import OptimizationException
 from device_kit_market_simulations.run import load_scenario
+from device_kit_market_simulations.compat import utility
+from device_kit_market_simulations.reporting.writer import NetworkReader
 
 logging.basicConfig()
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
 np_printoptions = {
   'linewidth': 1e6,
   'threshold': 1e6,
@@ -22,35 +31,187 @@ np_printoptions = {
   },
 }
 np.set_printoptions(**np_printoptions)
+_solvers = {}  # Per process cache of CentralSolver by scenario. @see solve_variant().
+
+
+class _Problem():
+  ''' Device like view of a deviceset with bounds and constraints evaluated once. device_kit.solve()
+  reads both on every call, and for a DeviceSet they are rebuilt from all sub devices each time.
+  Everything else is delegated to the deviceset.
+  '''
+
+  def __init__(self, deviceset):
+    self.deviceset = deviceset
+    self.shape = deviceset.shape
+    self.bounds = deviceset.bounds
+    self.constraints = deviceset.constraints
+
+  def __len__(self):
+    return len(self.deviceset)
+
+  def __getattr__(self, name):
+    return getattr(self.deviceset, name)
+
+
+class CentralSolver():
+  ''' Solve for the optimal balanced flow of a deviceset. The problem structure is set up once in
+  __init__() and shared by all calls to solve(). The last solution found is kept and used as the warm
+  start for the next solve() if no other start point is given.
+  '''
+  deviceset = None
+  problem = None
+  solver_options = {}   # Passed through to device_kit.solve().
+  x = None              # Last solution.
+  meta = None           # Last solver meta (scipy OptimizeResult).
+
+  def __init__(self, deviceset, sbounds=(0, 0), solver_options=None):
+    if sbounds is not None:
+      deviceset.sbounds = sbounds
+    self.deviceset = deviceset
+    self.problem = _Problem(deviceset)
+    self.solver_options = solver_options if solver_options else {}
+
+  def solve(self, p=0, s0=None, starts=0, seed=None):
+    ''' Solve at price `p`. `s0` is the start point - possibly the final `s` of a market run - and
+    defaults to the last solution. If `starts` > 0 that many extra random start points within bounds
+    are tried too and the best solution is kept. Returns (x, meta).
+    '''
+    s0 = self.x if s0 is None else np.array(s0).reshape(self.problem.shape)
+    candidates = [s0]
+    if starts:
+      rng = np.random.default_rng(seed)
+      (lb, ub) = self._finite_bounds()
+      candidates += [rng.uniform(lb, ub).reshape(self.problem.shape) for i in range(0, starts)]
+    best = None
+    for _s0 in candidates:
+      try:
+        (x, meta) = device_kit.solve(self.problem, p, _s0, solver_options=self.solver_options)
+      except OptimizationException as e:
+        logger.warning('OptimizationException on central solve of %s:\n%s', self.deviceset.id, e)
+        continue
+      u = utility(self.deviceset, x, p)
+      if best is None or u > best[2]:
+        best = (x, meta, u)
+    if best is None:
+      raise OptimizationException('No start point converged [%s]' % (self.deviceset.id,))
+    (self.x, self.meta) = (best[0].reshape(self.problem.shape), best[1])
+    return (self.x, self.meta)
+
+  def u(self, x=None, p=0):
+    return utility(self.deviceset, self.x if x is None else x, p)
+
+  def _finite_bounds(self):
+    ''' Bounds as a pair of flat vectors with any infinite bound pulled in to 0. '''
+    bounds = np.array(self.problem.bounds, dtype=float)
+    bounds[~np.isfinite(bounds)] = 0
+    return (bounds[:, 0], np.maximum(bounds[:, 0], bounds[:, 1]))
+
+
+def solve_variant(variant):
+  ''' Solve a single variant dict - {scenario, p, s0, starts, seed} - and return a summary dict. Only
+  `scenario` is required. Intended for a Pool worker: solvers are cached per process by scenario so the
+  problem setup is done once per worker however many variants of the scenario it is given.
+  '''
+  scenario = variant['scenario']
+  if scenario not in _solvers:
+    (deviceset, meta, _void) = load_scenario(scenario)
+    _solvers[scenario] = CentralSolver(deviceset)
+  solver = _solvers[scenario]
+  p = variant.get('p', 0)
+  try:
+    (x, meta) = solver.solve(p, variant.get('s0'), variant.get('starts', 0), variant.get('seed'))
+  except OptimizationException as e:
+    return {'scenario': scenario, 'p': p, 'success': False, 'message': str(e), 'x': None, 'u': np.nan}
+  return {'scenario': scenario, 'p': p, 'success': meta.success, 'message': meta.message, 'x': x, 'u': solver.u(x, p)}
+
+
+def solve_batch(variants, processes=None):
+  ''' Solve a list of variants (@see solve_variant()) in parallel. Results are in variant order. '''
+  if processes == 1 or len(variants) == 1:
+    return [solve_variant(v) for v in variants]
+  with Pool(processes=processes) as pool:
+    return pool.map(solve_variant, variants)
+
+
+def optimality_gap(solver, network, x=None):
+  ''' Compare a market run's `network` against the central optimum `x` (default solver.x). Welfare
+  is compared at zero price since at balance the price term nets out.
+  '''
+  x = solver.x if x is None else x
+  u_opt = solver.u(x, 0)
+  u_market = utility(solver.deviceset, network.s, 0)
+  return {
+    'u_optimal': u_opt,
+    'u_market': u_market,
+    'gap': u_opt - u_market,
+    'gap_rel': (u_opt - u_market)/abs(u_opt) if u_opt else np.nan,
+    'flow_distance': np.linalg.norm(network.s - x),
+    'excess': np.abs(network.excess).sum(),
+    'steps': network.steps,
+  }
 
 
 def main():
   parser = argparse.ArgumentParser(description='Run a power market simulation.')
-  parser.add_argument('scenario', action='store',
-    help='name of a python module containing scenario to run'
+  parser.add_argument('scenario', action='store', nargs='+',
+    help='name of a python module containing scenario to run. Multiple scenarios are solved as a batch'
+  )
+  parser.add_argument('--price', '-p',
+    dest='prices', type=float, action='append',
+    help='price to solve at. Can be given multiple times to solve a batch of variants'
+  )
+  parser.add_argument('--starts', '-s',
+    dest='starts', type=int, default=0,
+    help='number of additional random start points to try'
+  )
+  parser.add_argument('--seed',
+    dest='seed', type=int, default=None,
+    help='seed for random start points'
+  )
+  parser.add_argument('--warm-start', '-w',
+    dest='warm_start', type=str, default=None,
+    help='directory of a market run (@see run.py) to take the start point from'
+  )
+  parser.add_argument('--gap', '-g',
+    dest='gap', type=str, default=None,
+    help='directory of a market run (@see run.py) to report the optimality gap of'
+  )
+  parser.add_argument('-j',
+    dest='processes', type=int, default=None,
+    help='number of processes for batch solves'
   )
-  # parser.add_argument('--ftol',
-  #   dest='ftol', type=float, default=1e-4,
-  #   help='function tolerance for convergence of solution')
-  # parser.add_argument('-d',
-  #   dest='output_dir', default=None, type=str,
-  #   help='where to dump simulation data. If not provided dumped to tmp file'
-  # )
   args = parser.parse_args()
 
-  (scenario, meta, _void) = load_scenario(**vars(args))
-  scenario.sbounds = (0,0)
-  (x, solve_meta) = device_kit.solve(scenario, p=0) # Convenience convex solver.
+  s0 = NetworkReader(args.warm_start).last().s if args.warm_start else None
+  variants = [
+    {'scenario': scenario, 'p': p, 's0': s0, 'starts': args.starts, 'seed': args.seed}
+    for scenario in args.scenario for p in (args.prices or [0])
+  ]
+  if len(variants) > 1:
+    results = solve_batch(variants, args.processes)
+    df = pd.DataFrame([{k: r[k] for k in ('scenario', 'p', 'success', 'u', 'message')} for r in results])
+    print(df.to_string())
+    return
+
+  (scenario, meta, _void) = load_scenario(args.scenario[0])
+  solver = CentralSolver(scenario)
+  (x, solve_meta) = solver.solve(p=variants[0]['p'], s0=s0, starts=args.starts, seed=args.seed)
   print(solve_meta.message)
   df = pd.DataFrame.from_dict(dict(scenario.map(x)), orient='index')
   df.loc['total'] = df.sum()
   pd.set_option('display.float_format', lambda v: '%+0.3f' % (v,),)
   print(df.sort_index())
-  print('Utility: ', scenario.u(x, p=0))
+  print('Utility: ', utility(scenario, x, 0))
+  if args.gap:
+    gap = optimality_gap(solver, NetworkReader(args.gap).last())
+    print('Optimality gap [%s]:' % (args.gap,))
+    for (k, v) in gap.items():
+      print('  %-16s %s' % (k, v))
   df.transpose().plot(drawstyle='steps', grid=True)
   plt.ylabel('Power (kWh)')
   plt.xlabel('Time (H)')
   plt.savefig('solve.png');
 
 
-main()
+if __name__ == '__main__':
+  main()
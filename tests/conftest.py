@@ -0,0 +1,19 @@
+''' Test setup. The repo dir is the device_kit_market_simulations package (@see dev.sh), so it's made
+importable under that name however the repo is checked out. HOME is pointed at a temp dir so the
+default scenario cache and run catalog never touch the real ones.
+'''
+import os
+import sys
+import types
+import tempfile
+
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='dkms-test-home-')
+os.environ.setdefault('MPLBACKEND', 'Agg')
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+try:
+  import device_kit_market_simulations
+except ImportError:
+  package = types.ModuleType('device_kit_market_simulations')
+  package.__path__ = [root]
+  sys.modules['device_kit_market_simulations'] = package
@@ -0,0 +1,73 @@
+''' Small picklable scenarios for the tests, in scenario module form (@see run.load_scenario()).
+Devices follow device_kit's cost convention.
+'''
+import numpy as np
+from device_kit import Device, DeviceSet, GDevice
+
+
+class QuadraticDevice(Device):
+  ''' Wants to run at its upper bounds: cost p.s + a*||s - hbounds||^2. '''
+  a = 1.0
+
+  def cost(self, s, p):
+    s = np.asarray(s).reshape(self.shape)
+    return float((s*p).sum() + self.a*((s - self.hbounds.reshape(self.shape))**2).sum())
+
+  def deriv(self, s, p):
+    s = np.asarray(s).reshape(self.shape)
+    return (p + 2*self.a*(s - self.hbounds.reshape(self.shape))).reshape(self.shape)
+
+  def hess(self, s, p=0):
+    return np.eye(len(self))*2*self.a
+
+
+class FailingDevice(QuadraticDevice):
+  ''' Can't be solved: evaluating it raises. '''
+
+  def cost(self, s, p):
+    raise ValueError('Device %s always fails' % (self.id,))
+
+  def deriv(self, s, p):
+    raise ValueError('Device %s always fails' % (self.id,))
+
+
+class UnpicklableDevice(QuadraticDevice):
+  ''' Holds a local lambda, so it can't be sent to worker processes. '''
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.scale = lambda s: s
+
+
+meta = {'title': 'test'}
+
+
+def make_deviceset(n=3, T=8, window=3, supply_cost=0.5, device_cls=QuadraticDevice, seed=0):
+  ''' n devices each wanting 2 units over a random `window` slots, and a quadratic cost supply. '''
+  rng = np.random.RandomState(seed)
+  devices = []
+  for i in range(0, n):
+    hbounds = np.zeros(T)
+    start = rng.randint(0, T - window + 1)
+    hbounds[start:start+window] = 2
+    devices.append(device_cls('q%02d' % (i,), T, np.stack((np.zeros(T), hbounds), axis=1), (0, 2*window - 1)))
+  devices.append(GDevice('supply', T, (-100, 0), cost_coeffs=[supply_cost, 0, 0]))
+  return DeviceSet('site', devices)
+
+
+def make_rolling_deviceset(offset):
+  deviceset = make_deviceset()
+  for device in deviceset.devices[0:-1]:
+    device.bounds = np.roll(device.bounds, -offset, axis=0)
+  return deviceset
+
+
+def perturb(deviceset, rng):
+  for device in deviceset.devices[0:-1]:
+    device.bounds = device.bounds*rng.uniform(0.5, 1.5)
+  return deviceset
+
+
+def fail(deviceset, rng):
+  ''' Perturbation leaving only devices that always fail. '''
+  return DeviceSet('site', make_deviceset(device_cls=FailingDevice).devices[0:-1])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from device_kit_market_simulations.network import Network, agent_admm_update
+import scenarios
+
+
+def dual_ascent():
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial')
+  assert network.run()
+  return network
+
+
+@pytest.mark.parametrize('rho', [0.1, 1.0, 10.0])
+def test_admm_converges_to_dual_ascent_prices(rho):
+  reference = dual_ascent()
+  network = Network(scenarios.make_deviceset(), agent_strategy='admm', rho=rho, tol=1e-3, maxsteps=300, backend='serial')
+  assert network.price_update == 'admm'
+  assert network.run()
+  assert np.allclose(network.price, reference.price, atol=1e-2)
+
+
+def test_rho_balancing():
+  network = Network(scenarios.make_deviceset(), agent_strategy='admm', rho=1.0, backend='serial')
+  network.init()
+  network.s = np.ones(network.deviceset.shape)
+  network.last_s = np.ones(network.deviceset.shape)
+  network.update_rho()
+  assert network.rho == 2.0
+  network.s = np.zeros(network.deviceset.shape)
+  network.s[0] = 10
+  network.s[-1] = -10
+  network.update_rho()
+  assert network.residuals[0] == 0
+  assert network.rho == 1.0
+
+
+def test_admm_update_needs_prox():
+  device = scenarios.make_deviceset().devices[0]
+  with pytest.raises(ValueError):
+    agent_admm_update((device, np.zeros(8), np.zeros(device.shape), None, None))
+
+
+def test_rho_reset_on_cold_start():
+  network = Network(scenarios.make_deviceset(), agent_strategy='admm', rho=0.5, maxsteps=300, backend='serial')
+  network.run()
+  network.rho = 123
+  network.init()
+  assert network.rho == 0.5
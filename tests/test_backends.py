@@ -0,0 +1,63 @@
+import time
+import numpy as np
+import pytest
+from device_kit_market_simulations.backends import make_backend, AutoBackend, ProcessBackend, SerialBackend, ThreadBackend
+from device_kit_market_simulations.network import Network, agent_update, agent_point_bid_update
+import scenarios
+
+
+def square(x):
+  return x*x
+
+
+def sleepy(x):
+  time.sleep(x)
+  return x
+
+
+@pytest.mark.parametrize('name', ['serial', 'thread', 'process', 'auto'])
+def test_map_in_task_order(name):
+  with make_backend(name, 2) as backend:
+    for i in range(0, 3):
+      assert backend.map(square, list(range(0, 10))) == [x*x for x in range(0, 10)]
+
+
+@pytest.mark.parametrize('name', ['thread', 'process'])
+def test_map_timeout(name):
+  with make_backend(name, 2) as backend:
+    results = backend.map(sleepy, [0, 2], timeout=0.5)
+  assert results[0] == 0
+  assert isinstance(results[1], TimeoutError)
+
+
+def test_lpt_schedule():
+  with ProcessBackend(2, schedule='lpt') as backend:
+    for i in range(0, 2):
+      assert backend.map(square, list(range(0, 7))) == [x*x for x in range(0, 7)]
+    assert backend.scheduler.makespan >= 0
+
+
+def test_unknown_backend():
+  with pytest.raises(Exception):
+    make_backend('nope')
+
+
+def test_auto_backend_chooses():
+  with AutoBackend(2) as backend:
+    for i in range(0, 3):
+      assert backend.map(square, list(range(0, 8))) == [x*x for x in range(0, 8)]
+    assert backend.backend is not None
+    assert set(backend.timings) == {'serial', 'thread', 'process'}
+
+
+def test_auto_backend_falls_back_on_unpicklable_devices():
+  deviceset = scenarios.make_deviceset(device_cls=scenarios.UnpicklableDevice)
+  network = Network(deviceset, stepsize=0.3, maxsteps=200, backend='auto')
+  assert network.run()
+  assert not any(network.failures.values())
+  with network.make_pool() as pool:
+    tasks = [(agent_point_bid_update, device, network.price, network.s[slice(*_slice)], None, None) for (device, _slice) in deviceset.slices]
+    for i in range(0, 3):
+      assert all(error is None for (s, error) in pool.map(agent_update, tasks))
+    assert isinstance(pool.backend, (SerialBackend, ThreadBackend)) and not isinstance(pool.backend, ProcessBackend)
+    assert 'process' not in pool.timings
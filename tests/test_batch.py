@@ -0,0 +1,60 @@
+import numpy as np
+from device_kit_market_simulations.batch import batch_u, batch_deriv, chunk_size
+from device_kit_market_simulations.backends import ThreadBackend
+from scipy.optimize import approx_fprime
+from device_kit_market_simulations.compat import utility
+import scenarios
+
+
+def stacked(deviceset, k=5, seed=0):
+  rng = np.random.default_rng(seed)
+  return (rng.uniform(0, 1, (k,) + tuple(deviceset.shape)), rng.uniform(0, 1, (k, len(deviceset))))
+
+
+def test_batch_u_matches_per_device():
+  deviceset = scenarios.make_deviceset()
+  (s, price) = stacked(deviceset)
+  u = batch_u(deviceset, s, price)
+  assert u.shape == (len(s), len(deviceset.devices))
+  for k in range(0, len(s)):
+    for (j, (device, _slice)) in enumerate(deviceset.slices):
+      assert np.isclose(u[k, j], utility(device, s[k, slice(*_slice), :], price[k]))
+    assert np.isclose(u[k].sum(), utility(deviceset, s[k], price[k]))
+
+
+def test_batch_over_pool_matches_in_process():
+  deviceset = scenarios.make_deviceset()
+  (s, price) = stacked(deviceset, k=17)
+  with ThreadBackend(4) as pool:
+    assert np.allclose(batch_u(deviceset, s, price, pool), batch_u(deviceset, s, price))
+    assert np.allclose(batch_deriv(deviceset, s, price, pool), batch_deriv(deviceset, s, price))
+
+
+def test_batch_deriv():
+  deviceset = scenarios.make_deviceset()
+  (s, price) = stacked(deviceset, k=3)
+  d = batch_deriv(deviceset, s, price)
+  assert d.shape == s.shape
+  assert np.allclose(d[1], -deviceset.deriv(s[1], price[1]).reshape(deviceset.shape))
+
+
+def test_batch_deriv_is_the_gradient_of_batch_u():
+  deviceset = scenarios.make_deviceset()
+  (s, price) = stacked(deviceset, k=2)
+  d = batch_deriv(deviceset, s, price)
+  for k in range(0, len(s)):
+    total = lambda x: batch_u(deviceset, x.reshape(deviceset.shape), price[k]).sum()
+    assert np.allclose(d[k].flatten(), approx_fprime(s[k].flatten(), total, 1e-6), atol=1e-4)
+
+
+def test_single_and_empty_stacks():
+  deviceset = scenarios.make_deviceset()
+  s = np.ones(deviceset.shape)
+  assert batch_u(deviceset, s, 0.5).shape == (1, len(deviceset.devices))
+  assert batch_u(deviceset, np.zeros((0,) + tuple(deviceset.shape)), np.zeros((0, len(deviceset)))).shape == (0, len(deviceset.devices))
+
+
+def test_chunk_size():
+  assert chunk_size(10, 4) == 10
+  assert chunk_size(0, 4) == 1
+  assert 1 <= chunk_size(1000, 4, pool=object()) <= 1000
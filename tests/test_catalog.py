@@ -0,0 +1,94 @@
+import re
+import os
+import sys
+import argparse
+from device_kit_market_simulations import run
+from device_kit_market_simulations.run import result_params, result_args, non_result_args
+from device_kit_market_simulations.catalog import RunCatalog, run_key, code_hash
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting.summary import summarize
+import scenarios
+
+
+def namespace(**kwargs):
+  args = {k: None for k in result_args + non_result_args}
+  args.update({'compress': None, 'compress_threshold': None, 'compress_topk': None, 'compress_bits': None})
+  args.update(kwargs)
+  return argparse.Namespace(**args)
+
+
+def key(**kwargs):
+  return run_key('scenario', result_params(namespace(**kwargs)))
+
+
+def test_every_arg_is_classified():
+  with open(run.__file__) as f:
+    dests = set(re.findall(r"dest='(\w+)'", f.read())) | {'scenario'}
+  classified = set(result_args) | set(non_result_args) | {'compress', 'compress_threshold', 'compress_topk', 'compress_bits'}
+  assert dests == classified
+  assert not set(result_args) & set(non_result_args)
+
+
+def test_memo_options_are_in_the_key():
+  assert key(memo=True, memo_quantum=1e-3) != key(memo=True, memo_quantum=1e-2)
+  assert key(memo=True, memo_size=10) != key(memo=True, memo_size=20)
+  assert key(memo=True) != key()
+  assert key(memo_quantum=1e-3) == key(memo_quantum=1e-2)
+
+
+def test_multires_and_compression_in_the_key():
+  assert key(multires=[4, 2], multires_maxsteps=10) != key(multires=[4, 2], multires_maxsteps=20)
+  assert key(multires_maxsteps=10) == key()
+  assert key(compress_bits=8) != key(compress_bits=16)
+
+
+def test_execution_args_arent_in_the_key():
+  assert key(backend='serial', output_dir='a', write_every=5) == key(backend='process', output_dir='b')
+
+
+def test_record_and_lookup(tmp_path):
+  catalog = RunCatalog(str(tmp_path/'catalog.sqlite'))
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial')
+  network.run()
+  k = key(stepsize=0.3)
+  assert catalog.lookup(k) is None
+  catalog.record(k, 'scenarios', 'hash', {'stepsize': 0.3}, str(tmp_path), summarize(network), 0, 1.0)
+  found = catalog.lookup(k)
+  assert found['steps'] == network.steps and found['output_dir'] == str(tmp_path)
+  catalog.close()
+
+
+def test_code_is_in_the_key(tmp_path):
+  (tmp_path/'network.py').write_text('a = 1')
+  before = code_hash(str(tmp_path))
+  assert code_hash(str(tmp_path)) == before
+  (tmp_path/'network.py').write_text('a = 2')
+  assert code_hash(str(tmp_path)) != before
+  assert run_key('scenario', {}, 'code1') != run_key('scenario', {}, 'code2')
+
+
+def run_main(monkeypatch, *argv):
+  monkeypatch.chdir(os.path.dirname(scenarios.__file__))
+  monkeypatch.setattr(sys, 'argv', ['run.py', 'scenarios.py', '-l', '0.3', '-b', 'serial'] + list(argv))
+  run.main()
+
+
+def test_reuse_is_opt_in_and_links_output(tmp_path, monkeypatch):
+  catalog = str(tmp_path/'catalog.sqlite')
+  run_main(monkeypatch, '--catalog', catalog, '-d', str(tmp_path/'r1'))
+  run_main(monkeypatch, '--catalog', catalog, '-d', str(tmp_path/'r2'))
+  assert os.path.isdir(str(tmp_path/'r2')) and not os.path.islink(str(tmp_path/'r2'))
+  assert len(RunCatalog(catalog).find()) == 2
+  run_main(monkeypatch, '--catalog', catalog, '-d', str(tmp_path/'r3'), '--reuse')
+  assert os.path.islink(str(tmp_path/'r3'))
+  assert os.path.realpath(str(tmp_path/'r3')) == str(tmp_path/'r2')
+  assert os.listdir(str(tmp_path/'r3')) == os.listdir(str(tmp_path/'r2'))
+  assert len(RunCatalog(catalog).find()) == 2
+
+
+def test_reuse_doesnt_replace_existing_output(tmp_path, monkeypatch):
+  catalog = str(tmp_path/'catalog.sqlite')
+  run_main(monkeypatch, '--catalog', catalog, '-d', str(tmp_path/'r1'))
+  os.makedirs(str(tmp_path/'r2'))
+  run_main(monkeypatch, '--catalog', catalog, '-d', str(tmp_path/'r2'), '--reuse')
+  assert not os.path.islink(str(tmp_path/'r2')) and os.listdir(str(tmp_path/'r2')) == []
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.events import EventBus
+from device_kit_market_simulations.reporting.writer import NetworkWriter
+from device_kit_market_simulations.compare import RunComparison
+import scenarios
+
+
+def record(run_dir, every=1, stepsize=0.3):
+  network = Network(scenarios.make_deviceset(), stepsize=stepsize, maxsteps=200, backend='serial')
+  writer = NetworkWriter(network, run_dir)
+  excess = {}
+  bus = EventBus()
+  bus.subscribe(writer.update, events=writer.events, every=every)
+  bus.subscribe(lambda network, event: excess.setdefault(network.steps, np.abs(network.excess).max()), events=['after-step'])
+  network.run(bus)
+  writer.close()
+  return (network, excess)
+
+
+def first_step(excess, tol, steps=None):
+  return min(step for (step, e) in excess.items() if e <= tol and (steps is None or step in steps))
+
+
+@pytest.mark.parametrize('summary', [True, False])
+def test_steps_to_is_a_step_number(tmp_path, summary):
+  (a, b) = (str(tmp_path/'a'), str(tmp_path/'b'))
+  (network_a, excess_a) = record(a)
+  (network_b, excess_b) = record(b, every=5, stepsize=0.2)
+  if not summary:
+    [os.remove(run_dir + '/summary.csv') for run_dir in (a, b)]
+  comparison = RunComparison([a, b])
+  tol = 0.05
+  recorded_b = set(comparison.curve_steps[1][comparison.curve_steps[1] >= 0])
+  assert recorded_b == set(range(5, network_b.steps + 1, 5)) | {1, network_b.steps}
+  assert list(comparison.steps_to(tol)) == [first_step(excess_a, tol), first_step(excess_b, tol, recorded_b)]
+  assert list(comparison.steps_to(0)) == [-1, -1]
+  assert list(comparison.steps) == [network_a.steps, network_b.steps]
+
+
+def test_write(tmp_path):
+  (a, b) = (str(tmp_path/'a'), str(tmp_path/'b'))
+  record(a)
+  (network_b, excess_b) = record(b, every=5)
+  RunComparison([a, b]).write(str(tmp_path/'out'), tol=0.05)
+  convergence = pd.read_csv(str(tmp_path/'out'/'convergence.csv'), index_col='step')
+  assert np.isclose(convergence.loc[5, 'b'], excess_b[5])
+  assert np.isnan(convergence.loc[2, 'b'])
+  summary = pd.read_csv(str(tmp_path/'out'/'summary.csv'), index_col=0)
+  assert summary.loc['a', 'flow_delta'] == 0
@@ -0,0 +1,98 @@
+import pickle
+import numpy as np
+import pytest
+from device_kit_market_simulations.compression import BidCodec, CompressedBid
+from device_kit_market_simulations.network import Network
+import scenarios
+
+
+s0 = np.zeros((2, 8))
+
+
+def changed(cells):
+  s = s0.copy()
+  for (i, v) in cells.items():
+    s.flat[i] = v
+  return s
+
+
+def test_lossless_roundtrip():
+  s = np.random.default_rng(0).normal(size=s0.shape)
+  for s_ in (s, changed({3: 1.5})):
+    bid = BidCodec().encode(s_, s0)
+    assert (BidCodec().decode(bid, s0) == s_).all()
+
+
+def test_sparse_when_smaller():
+  bid = BidCodec().encode(changed({3: 1.5, 9: -2}), s0)
+  assert bid.indices.tolist() == [3, 9] and bid.values.tolist() == [1.5, -2]
+  assert bid.nbytes < s0.nbytes
+  dense = BidCodec().encode(s0 + 1, s0)
+  assert dense.indices is None and dense.nbytes == s0.nbytes
+
+
+def test_threshold():
+  bid = BidCodec(threshold=0.1).encode(changed({1: 0.05, 2: 0.5}), s0)
+  assert bid.indices.tolist() == [2]
+
+
+def test_topk():
+  bid = BidCodec(topk=0.125).encode(changed({1: 0.1, 2: -3, 4: 2, 7: 0.5}), s0)
+  assert bid.indices.tolist() == [2, 4]
+
+
+def test_bits():
+  s = np.random.default_rng(0).normal(size=s0.shape)
+  for bits in (8, 16, 32):
+    bid = BidCodec(bits=bits).encode(s, s0)
+    assert bid.values.dtype == np.dtype('int%d' % (bits,))
+    assert np.abs(BidCodec(bits=bits).decode(bid, s0) - s).max() <= bid.scale/2 + 1e-12
+  assert (BidCodec(bits=8).decode(BidCodec(bits=8).encode(s0, s0), s0) == s0).all()
+
+
+@pytest.mark.parametrize('kwargs', [{'topk': 0}, {'topk': 1.5}, {'bits': 12}])
+def test_invalid_options(kwargs):
+  with pytest.raises(ValueError):
+    BidCodec(**kwargs)
+
+
+def test_decode_passes_uncompressed_bids_through():
+  assert BidCodec().decode(s0, s0 + 1) is s0
+
+
+def test_codec_equality_and_pickling():
+  assert BidCodec(topk=0.5) == BidCodec(topk=0.5) and BidCodec(topk=0.5) != BidCodec(bits=8)
+  assert len({BidCodec(topk=0.5), BidCodec(topk=0.5)}) == 1
+  bid = pickle.loads(pickle.dumps(BidCodec().encode(changed({3: 1.5}), s0)))
+  assert isinstance(bid, CompressedBid) and bid.indices.tolist() == [3]
+
+
+def run(compression=None, strategy=None):
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=400, backend='serial', compression=compression)
+  network.set_agent_strategy(strategy)
+  assert network.run()
+  return network
+
+
+@pytest.mark.parametrize('compression', [{'threshold': 1e-4}, {'topk': 0.25}, {'bits': 8}, {'threshold': 1e-4, 'topk': 0.5, 'bits': 16}])
+def test_error_feedback_converges_to_the_same_equilibrium(compression):
+  (dense, compressed) = (run(), run(compression))
+  assert np.allclose(dense.price, compressed.price, atol=1e-2)
+  assert np.allclose(dense.s, compressed.s, atol=1e-2)
+
+
+def test_function_bids():
+  (dense, compressed) = (run(strategy='function_bid'), run({'threshold': 0}, 'function_bid'))
+  assert np.allclose(dense.price, compressed.price, atol=1e-3)
+
+
+def test_traffic(caplog):
+  caplog.set_level('INFO')
+  network = run({'threshold': 1e-4})
+  total = network.traffic_total
+  agents = len(network.agents)
+  assert total['sent'] == network.steps*agents*(8*8 + 8*8)
+  assert 0 < total['received'] < total['received_dense'] == network.steps*agents*8*8
+  assert 'to agents=%d (uncompressed), from agents=%d' % (total['sent'], total['received']) in caplog.text
+  dense = run()
+  assert dense.traffic_total['received'] == dense.traffic_total['received_dense'] == dense.steps*agents*8*8
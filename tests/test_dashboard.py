@@ -0,0 +1,48 @@
+import os
+import queue
+import numpy as np
+import matplotlib
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting import dashboard
+from device_kit_market_simulations.reporting.dashboard import LiveDashboardWriter, _Dashboard
+import scenarios
+
+
+def make_network():
+  return Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial')
+
+
+def test_utility_only_at_refresh_rate(monkeypatch):
+  calls = []
+  monkeypatch.setattr(dashboard, 'summarize', lambda network: calls.append(network.steps) or type('S', (), {'utility': 1.0}))
+  network = make_network()
+  writer = LiveDashboardWriter.__new__(LiveDashboardWriter)
+  (writer.network, writer.fps, writer.queue) = (network, 0.001, queue.Queue(maxsize=1))
+  sent = []
+  writer._put = sent.append
+  network.run([writer.update])
+  assert len(sent) == network.steps
+  assert len(calls) == 1
+  assert sent[0][5] == 1.0 and all(snapshot[5] is None for snapshot in sent[1:])
+  (steps, price, excess, demand, supply, utility) = sent[-1]
+  assert steps == network.steps and np.allclose(excess, network.excess) and np.allclose(price, network.price)
+
+
+def test_renderer_keeps_last_utility():
+  import matplotlib.pyplot as plt
+  board = _Dashboard(plt, 'test', 8, blit=False)
+  board.update((1, np.ones(8), np.ones(8), np.ones(8), -np.ones(8), 2.5))
+  board.update((2, np.ones(8), np.zeros(8), np.ones(8), -np.ones(8), None))
+  assert board.utility == 2.5 and 'utility' in board.text.get_text()
+  assert board.steps == [1, 2]
+  plt.close(board.fig)
+
+
+def test_saves_frames_without_display(tmp_path):
+  assert matplotlib.get_backend().lower() == 'agg'
+  network = make_network()
+  writer = LiveDashboardWriter(network, fps=100, output_dir=str(tmp_path))
+  network.run([writer.update])
+  writer.close()
+  writer.process.join(timeout=10)
+  assert os.path.isfile(str(tmp_path/'live.png'))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from device_kit_market_simulations.ensemble import StreamingStats, Ensemble, resolve_perturb, run_member
+import scenarios
+
+
+network_params = {'stepsize': 0.3, 'maxsteps': 200}
+
+
+def test_streaming_stats_match_numpy():
+  xs = np.random.default_rng(0).normal(size=(50, 4))
+  stats = StreamingStats((4,), reservoir=100)
+  for x in xs:
+    stats.update(x)
+  assert stats.count == 50
+  assert np.allclose(stats.mean, xs.mean(axis=0))
+  assert np.allclose(stats.std, xs.std(axis=0, ddof=1))
+  assert (stats.min == xs.min(axis=0)).all() and (stats.max == xs.max(axis=0)).all()
+  assert np.allclose(stats.quantiles([0.1, 0.5]), np.quantile(xs, [0.1, 0.5], axis=0))
+
+
+def test_streaming_stats_reservoir_is_bounded():
+  stats = StreamingStats((), reservoir=8, seed=0)
+  for x in range(0, 100):
+    stats.update(x)
+  assert stats.reservoir.shape == (8,)
+  assert stats.quantiles([0, 1]).tolist() == [stats.reservoir.min(), stats.reservoir.max()]
+  assert StreamingStats(()).std == 0
+
+
+def test_resolve_perturb():
+  assert resolve_perturb('scenarios') is scenarios.perturb
+  assert resolve_perturb('scenarios', 'scenarios.make_deviceset') is scenarios.make_deviceset
+  with pytest.raises(ValueError):
+    resolve_perturb('conftest')
+
+
+def test_run_member_is_reproducible():
+  seed = np.random.SeedSequence(0, spawn_key=(1,))
+  (i, result, error) = run_member((1, seed, 'scenarios', {}, None, network_params))
+  assert (i, error) == (1, None)
+  assert result['stable'] and result['s'].shape == scenarios.make_deviceset().shape
+  (_, again, _) = run_member((1, seed, 'scenarios', {}, None, network_params))
+  assert np.allclose(result['price'], again['price'])
+
+
+def test_run_member_failure_is_returned():
+  (i, result, error) = run_member((0, 0, 'scenarios', {}, 'scenarios.fail', network_params))
+  assert result is None and error.startswith('AgentFailureException')
+
+
+def test_ensemble(tmp_path):
+  ensemble = Ensemble('scenarios', 4, seed=1, network_params=network_params, processes=2)
+  stats = ensemble.run()
+  assert not ensemble.failures
+  assert stats['price'].count == 4 and stats['s'].mean.shape == scenarios.make_deviceset().shape
+  summary = ensemble.summary()
+  assert summary.loc['stable', 'mean'] == 1 and summary.loc['steps', 'count'] == 4
+  ensemble.write(str(tmp_path))
+  assert (tmp_path/'summary.csv').exists()
+  assert np.load(str(tmp_path/'ensemble.npz'))['price_quantiles'].shape == (3, 8)
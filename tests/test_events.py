@@ -0,0 +1,115 @@
+import pytest
+from device_kit import DeviceSet
+from device_kit_market_simulations.events import EventBus, Listener
+from device_kit_market_simulations.network import Network
+import scenarios
+
+
+class Recorder():
+  ''' Callback recording (name, event, step) of the calls it gets. '''
+
+  def __init__(self, calls, name=None):
+    self.calls = calls
+    self.name = name
+
+  def __call__(self, network, event):
+    self.calls.append((self.name, event, network.steps))
+
+
+class Steps():
+  steps = 0
+
+  def __init__(self, steps):
+    self.steps = steps
+
+
+def run(bus, deviceset=None):
+  network = Network(deviceset or scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial')
+  network.run(bus)
+  return network
+
+
+def test_listener_wants():
+  listener = Listener(None, every=5)
+  assert [s for s in range(0, 12) if listener.wants('after-step', s)] == [0, 1, 5, 10]
+  assert listener.wants('after-step', 7, last=True)
+  assert listener.wants('before-start', 7) and listener.wants('after-done', 7)
+  with pytest.raises(ValueError):
+    Listener(None, every=0)
+
+
+def test_priority_then_subscription_order():
+  calls = []
+  bus = EventBus()
+  for (name, priority) in (('a', 0), ('b', 10), ('c', 0), ('d', -1), ('e', 10)):
+    bus.subscribe(Recorder(calls, name), priority=priority)
+  bus.emit(Steps(1), 'after-step')
+  assert [name for (name, _, _) in calls] == ['b', 'e', 'a', 'c', 'd']
+
+
+def test_event_filters():
+  calls = []
+  bus = EventBus()
+  bus.subscribe(Recorder(calls, 'steps'), events=['after-step'])
+  bus.subscribe(Recorder(calls, 'all'))
+  assert bus.wants('after-step') and bus.wants('before-start')
+  bus.emit(Steps(1), 'before-start')
+  bus.emit(Steps(1), 'after-step')
+  assert calls == [('all', 'before-start', 1), ('steps', 'after-step', 1), ('all', 'after-step', 1)]
+  only = EventBus()
+  only.subscribe(Recorder([]), events=['after-done'])
+  assert only.wants('after-done') and not only.wants('after-step')
+  assert not EventBus().wants('after-step')
+
+
+def test_unsubscribe():
+  calls = []
+  bus = EventBus()
+  (a, b) = (Recorder(calls, 'a'), Recorder(calls, 'b'))
+  listener = bus.subscribe(a, events=['after-step'])
+  bus.subscribe(b)
+  bus.subscribe(b, events=['after-done'])
+  bus.unsubscribe(listener)
+  bus.emit(Steps(1), 'after-step')
+  assert calls == [('b', 'after-step', 1)]
+  bus.unsubscribe(b)
+  assert len(bus) == 0 and not bus.wants('after-done')
+
+
+def test_of():
+  bus = EventBus()
+  assert EventBus.of(bus) is bus
+  calls = []
+  bus = EventBus.of([Recorder(calls, 'a'), Listener(Recorder(calls, 'b'), events=['after-done'])])
+  assert len(bus) == 2
+  bus.emit(Steps(1), 'after-done')
+  assert [name for (name, _, _) in calls] == ['a', 'b']
+
+
+def test_every_during_a_run():
+  calls = []
+  bus = EventBus()
+  bus.subscribe(Recorder(calls), events=['after-step'], every=4)
+  bus.subscribe(Recorder(calls), events=['before-start', 'after-done'], every=4)
+  network = run(bus)
+  steps = [step for (_, event, step) in calls if event == 'after-step']
+  assert network.steps > 4 and network.steps % 4
+  assert steps == [1] + list(range(4, network.steps, 4)) + [network.steps]
+  assert [event for (_, event, _) in calls if event != 'after-step'] == ['before-start', 'after-done']
+
+
+def test_plain_list_gets_every_step():
+  calls = []
+  network = run([Recorder(calls)])
+  assert [step for (_, event, step) in calls if event == 'after-step'] == list(range(1, network.steps + 1))
+
+
+def test_agent_failure_events():
+  calls = []
+  bus = EventBus()
+  bus.subscribe(Recorder(calls), events=['agent-failure'], every=1000)
+  deviceset = scenarios.make_deviceset()
+  devices = scenarios.make_deviceset(device_cls=scenarios.FailingDevice).devices[0:1] + deviceset.devices[1:]
+  network = run(bus, DeviceSet('site', devices))
+  assert not network.stable and network.steps == network.maxsteps
+  assert [step for (_, _, step) in calls] == [1, network.steps]
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from device_kit import DeviceSet
+from device_kit_market_simulations.network import Network, AgentFailureException
+import scenarios
+
+
+def make_network(deviceset, **kwargs):
+  return Network(deviceset, stepsize=0.3, maxsteps=30, backend='serial', **kwargs)
+
+
+def test_failing_agent_keeps_previous_bid_and_blocks_convergence():
+  deviceset = scenarios.make_deviceset()
+  failing = scenarios.FailingDevice('bad', len(deviceset), np.stack((np.zeros(len(deviceset)), np.ones(len(deviceset))), axis=1))
+  deviceset = DeviceSet('site', deviceset.devices + [failing])
+  network = make_network(deviceset)
+  events = []
+  assert not network.run([lambda network, event: events.append((network.steps, event))])
+  assert network.steps == network.maxsteps
+  assert network.failures['bad'] == network.maxsteps
+  assert network.step_failures[0][0] == 'bad'
+  assert (network.s[-1] == 0).all()
+  assert not network.stable
+  assert events.count((1, 'agent-failure')) == 1
+
+
+def test_every_agent_failing_aborts():
+  deviceset = scenarios.make_deviceset(device_cls=scenarios.FailingDevice)
+  deviceset = DeviceSet('site', deviceset.devices[0:-1])
+  network = make_network(deviceset)
+  events = []
+  with pytest.raises(AgentFailureException):
+    network.run([lambda network, event: events.append(event)])
+  assert network.steps == 0
+  assert events == ['before-start', 'agent-failure']
+  assert not network.stable
+
+
+def test_no_failures_converges():
+  network = make_network(scenarios.make_deviceset())
+  assert network.run()
+  assert network.step_failures == [] and not any(network.failures.values())
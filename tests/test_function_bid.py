@@ -0,0 +1,81 @@
+import time
+import threading
+import numpy as np
+import pytest
+from device_kit_market_simulations.network import (
+  Network, agent_update, agent_point_bid_update, agent_function_bid_update, demand_sensitivity,
+  finite_difference_sensitivity
+)
+from device_kit_market_simulations.transport import AgentWorker, SocketAgentPool
+import scenarios
+
+
+class NoHessDevice(scenarios.QuadraticDevice):
+
+  def hess(self, s, p=0):
+    raise NotImplementedError()
+
+
+@pytest.mark.parametrize('price', [0.2, 0.6, 1.5])
+def test_analytic_sensitivity_matches_finite_differences(price):
+  for device in scenarios.make_deviceset().devices:
+    p = np.linspace(price, 1.5*price, 8)
+    s = agent_point_bid_update((device, p, np.zeros(device.shape), None, None))
+    assert np.allclose(demand_sensitivity(device, s, p), finite_difference_sensitivity(device, s, p), atol=0.05)
+
+
+def test_sensitivity_fixed_by_bounds_is_zero():
+  device = scenarios.make_deviceset().devices[0]
+  p = np.zeros(8)
+  s = agent_point_bid_update((device, p, np.zeros(device.shape), None, None))
+  sensitivity = demand_sensitivity(device, s, p)
+  assert (sensitivity[device.hbounds.flatten() == 0] == 0).all()
+
+
+def test_function_bid_without_hessian():
+  device = scenarios.make_deviceset(device_cls=NoHessDevice).devices[0]
+  p = np.full(8, 0.5)
+  (s, sensitivity) = agent_function_bid_update((device, p, np.zeros(device.shape), None, None))
+  assert np.allclose(sensitivity, demand_sensitivity(scenarios.make_deviceset().devices[0], s, p), atol=0.05)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_newton_converges_quickly(sparse):
+  kwargs = {'agent_strategy': 'function_bid', 'price_update': 'newton', 'maxsteps': 50, 'backend': 'serial', 'sparse': sparse}
+  network = Network(scenarios.make_deviceset(n=6, T=24), **kwargs)
+  gradient = Network(scenarios.make_deviceset(n=6, T=24), stepsize=0.3, maxsteps=200, backend='serial')
+  assert network.run()
+  assert gradient.run()
+  assert network.steps < gradient.steps
+  assert np.allclose(network.price, gradient.price, atol=1e-2)
+
+
+def test_newton_step_is_damped_where_excess_grows():
+  network = Network(scenarios.make_deviceset(T=2, window=1), price_update='newton', stepsize=0.1, backend='serial')
+  network.init()
+  network.sensitivity = np.array([-1.0, -1.0])
+  network.s = np.array([[1.0, 1.0]] + [[0, 0]]*(len(network.s) - 1))
+  network.update_price()
+  assert list(network.price) == [1.0, 1.0]
+  network.s = np.array([[2.0, 0.5]] + [[0, 0]]*(len(network.s) - 1))
+  network.update_price()
+  assert list(network.damping) == [0.5, 1.0]
+  assert list(network.price) == [2.0, 1.5]
+  network.damping = np.array([network.min_damping/4, 1.0])
+  network.update_price()
+  assert network.price[0] == 2.0 + 0.1*2.0
+
+
+def test_sensitivity_over_transport(tmp_path):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  threading.Thread(target=AgentWorker(address).serve_forever, daemon=True).start()
+  time.sleep(0.2)
+  deviceset = scenarios.make_deviceset()
+  p = np.full(len(deviceset), 0.5)
+  tasks = [(agent_function_bid_update, device, p, np.zeros(device.shape), None, None) for device in deviceset.devices]
+  with SocketAgentPool([address]) as pool:
+    results = pool.map(agent_update, tasks)
+  for (task, ((s, sensitivity), error)) in zip(tasks, results):
+    assert error is None
+    ((_s, _sensitivity), _error) = agent_update(task)
+    assert np.allclose(s, _s) and np.allclose(sensitivity, _sensitivity)
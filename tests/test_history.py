@@ -0,0 +1,53 @@
+import numpy as np
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting.history import HistoryRecorder
+from device_kit_market_simulations.reporting.writer import NetworkReader
+import scenarios
+
+
+def run(size=4, every=5, maxsteps=200, stepsize=0.1):
+  network = Network(scenarios.make_deviceset(), stepsize=stepsize, maxsteps=maxsteps, backend='serial')
+  recorder = HistoryRecorder(network, size, every)
+  trace = []
+  network.run([recorder.update, lambda network, event: trace.append((network.steps, network.price.copy()))])
+  return (network, recorder, [t for t in trace if t[0] > 0])
+
+
+def test_ring_buffer_and_trace():
+  (network, recorder, trace) = run()
+  (steps, price, s) = recorder.history()
+  last = list(range(network.steps - 3, network.steps + 1))
+  assert list(steps[-4:]) == last
+  assert set(range(5, network.steps + 1, 5)) <= set(steps)
+  assert list(steps) == sorted(set(steps))
+  assert np.allclose(price[-1], network.price)
+  assert np.allclose(s[-1], network.s)
+  prices = dict((step, p) for (step, p) in trace)
+  assert all(np.allclose(price[i], prices[step]) for (i, step) in enumerate(steps))
+
+
+def test_trace_decimates_when_full():
+  network = Network(scenarios.make_deviceset(), stepsize=0.01, maxsteps=4, backend='serial')
+  recorder = HistoryRecorder(network, 2, 1)
+  network.maxsteps = 12   # Runs longer than the trace was sized for.
+  network.run([recorder.update])
+  assert network.steps == 12
+  assert recorder.every == 4
+  assert list(recorder.trace_steps[0:recorder.trace_count]) == [4, 8, 12]
+
+
+def test_fixed_memory():
+  network = Network(scenarios.make_deviceset(), maxsteps=100)
+  recorder = HistoryRecorder(network, 10, 10)
+  assert recorder.nbytes == HistoryRecorder(network, 10, 10).nbytes
+  assert recorder.trace_steps.shape == (11,)
+
+
+def test_spill_is_readable(tmp_path):
+  (network, recorder, trace) = run()
+  recorder.spill(str(tmp_path))
+  reader = NetworkReader(str(tmp_path))
+  assert len(reader) == len(recorder.history()[0])
+  summary = reader.summary()
+  assert list(summary['steps']) == list(recorder.history()[0])
+  assert np.allclose(reader.last().price, network.price)
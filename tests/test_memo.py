@@ -0,0 +1,89 @@
+import numpy as np
+from device_kit_market_simulations.memo import ResponseCache
+from device_kit_market_simulations.network import Network, agent_point_bid_update, agent_admm_update
+import scenarios
+
+
+def task(device, p=0.5, s0=0, prox=None, strategy=agent_point_bid_update):
+  return (strategy, device, np.full(8, p), np.full(device.shape, s0, dtype=float), prox, None)
+
+
+def test_key():
+  cache = ResponseCache(quantum=1e-3)
+  (a, b) = scenarios.make_deviceset().devices[0:2]
+  assert cache.key(task(a)) == cache.key(task(a, p=0.5 + 1e-5))
+  assert cache.key(task(a)) != cache.key(task(a, p=0.51))
+  assert cache.key(task(a)) != cache.key(task(b))
+  assert cache.key(task(a)) != cache.key(task(a, prox=1.0))
+  assert cache.key(task(a)) != cache.key(task(a, strategy=agent_admm_update))
+  assert cache.key(task(a)) != cache.key(task(a, s0=1))
+  assert cache.key(task(a), uses_s0=False) == cache.key(task(a, s0=1), uses_s0=False)
+
+
+def test_unpicklable_device_isnt_cached():
+  device = scenarios.make_deviceset(device_cls=scenarios.UnpicklableDevice).devices[0]
+  assert ResponseCache().key(task(device)) is None
+
+
+def test_lru_eviction():
+  cache = ResponseCache(maxsize=2)
+  for k in ('a', 'b', 'c'):
+    cache.put(k, k)
+  assert cache.get('a') is None and cache.get('c') == 'c'
+  assert cache.stats()['evictions'] == 1 and cache.stats()['size'] == 2
+
+
+def test_disk_backed(tmp_path):
+  path = str(tmp_path/'memo.sqlite')
+  cache = ResponseCache(path=path)
+  cache.put('k', (np.ones(3), None))
+  cache.close()
+  cache = ResponseCache(path=path)
+  (s, error) = cache.get('k')
+  assert (s == 1).all() and cache.disk_hits == 1
+  cache.close()
+
+
+def test_repeat_run_is_served_from_cache():
+  cache = ResponseCache()
+  networks = [Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial', response_cache=cache) for i in range(0, 2)]
+  assert networks[0].run()
+  misses = cache.misses
+  assert networks[1].run()
+  assert cache.misses == misses
+  assert cache.hits >= networks[1].steps*len(networks[1].agents)
+  assert np.allclose(networks[0].price, networks[1].price) and networks[0].steps == networks[1].steps
+
+
+def test_lru_is_per_agent():
+  cache = ResponseCache(maxsize=2)
+  (a, b) = scenarios.make_deviceset().devices[0:2]
+  cache.put(cache.key(task(b)), 'b')
+  for p in (0.1, 0.2, 0.3, 0.4):
+    cache.put(cache.key(task(a, p=p)), p)
+  assert cache.get(cache.key(task(b))) == 'b'
+  assert cache.get(cache.key(task(a, p=0.1))) is None and cache.get(cache.key(task(a, p=0.4))) == 0.4
+  assert cache.stats()['evictions'] == 2 and cache.stats()['size'] == 3 and cache.stats()['agents'] == 2
+
+
+def test_disk_writes_are_batched(tmp_path):
+  path = str(tmp_path/'memo.sqlite')
+  cache = ResponseCache(path=path)
+  for k in ('a', 'b'):
+    cache.put(k, k)
+  other = ResponseCache(path=path)
+  assert other.get('a') is None
+  cache.flush()
+  assert not cache.pending and other.get('a') == 'a' and other.get('b') == 'b'
+  cache.close()
+  other.close()
+
+
+def test_run_flushes_every_step(tmp_path):
+  cache = ResponseCache(path=str(tmp_path/'memo.sqlite'))
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial', response_cache=cache)
+  assert network.run()
+  assert not cache.pending
+  (rows,) = cache.conn.execute('select count(*) from responses').fetchone()
+  assert rows == cache.misses
+  cache.close()
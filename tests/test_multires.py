@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+from scipy.optimize import approx_fprime
+from device_kit_market_simulations.multires import CoarseDevice, CoarseDeviceSet, MultiResolution
+from device_kit_market_simulations.network import Network
+import scenarios
+
+
+def make_network(**kwargs):
+  params = dict(stepsize=0.3, maxsteps=200, backend='serial')
+  params.update(kwargs)
+  return Network(scenarios.make_deviceset(T=16, window=6), **params)
+
+
+def test_coarse_flows_are_feasible():
+  device = scenarios.make_deviceset(T=16, window=6).devices[0]
+  coarse = CoarseDevice(device, 4)
+  assert coarse.shape == (1, 4) and len(coarse) == 4
+  bounds = coarse.bounds
+  for s in (bounds[:, 0], bounds[:, 1], bounds.mean(axis=1)):
+    fine = coarse.upsample(s)
+    assert np.allclose(coarse.downsample(fine), s.reshape(coarse.shape))
+    assert (fine.flatten() >= device.lbounds - 1e-9).all() and (fine.flatten() <= device.hbounds + 1e-9).all()
+  p = np.arange(16.0)
+  assert np.allclose(coarse.upsample_price(coarse.downsample_price(p)), np.repeat(p.reshape(4, 4).mean(axis=1), 4))
+
+
+def test_coarse_device_derivatives():
+  device = scenarios.make_deviceset(T=16, window=6).devices[0]
+  coarse = CoarseDevice(device, 4)
+  (s, p) = (coarse.bounds.mean(axis=1), np.linspace(0.1, 1, 4))
+  assert coarse.cost(s, p) == device.cost(coarse.upsample(s), coarse.upsample_price(p))
+  assert coarse.u(s, p) == -coarse.cost(s, p)
+  assert coarse.deriv(s, p).shape == coarse.shape
+  assert np.allclose(coarse.deriv(s, p).flatten(), approx_fprime(s, lambda x: coarse.cost(x, p), 1e-6), atol=1e-4)
+  hess = coarse.hess(s, p)
+  assert hess.shape == (4, 4) and np.allclose(hess, hess.T)
+  assert np.allclose(hess[0], approx_fprime(s, lambda x: coarse.deriv(x, p).flatten()[0], 1e-6), atol=1e-4)
+
+
+def test_coarse_deviceset():
+  deviceset = scenarios.make_deviceset(T=16, window=6)
+  coarse = CoarseDeviceSet(deviceset, 4)
+  assert coarse.shape == (len(deviceset.devices), 4)
+  s = np.vstack([device.bounds.mean(axis=1).reshape(device.shape) for device in coarse.devices])
+  p = np.ones(4)
+  assert np.isclose(coarse.cost(s, p), sum(device.cost(s[i:i+1], p) for (i, device) in enumerate(coarse.devices)))
+  assert coarse.deriv(s, p).shape == coarse.shape
+  hess = coarse.hess(s, p)
+  assert hess.shape == (s.size, s.size) and (hess[0:4, 4:] == 0).all()
+  assert coarse.upsample(s).shape == deviceset.shape
+
+
+def test_idle_slots():
+  deviceset = scenarios.make_deviceset(T=16, window=6)
+  coarse = CoarseDeviceSet(deviceset, 4)
+  hi = np.array(deviceset.bounds).reshape(tuple(deviceset.shape) + (2,))[..., 1]
+  assert (coarse.idle == (hi <= 0).all(axis=0)).all() and coarse.idle.any() and not coarse.idle.all()
+  assert (coarse.busy == (~coarse.idle).reshape(4, 4).sum(axis=1)).all()
+  # Flows in idle slots are pinned to zero, so any coarse flow upsamples to zero there.
+  s = np.vstack([device.bounds.mean(axis=1).reshape(device.shape) for device in coarse.devices])
+  assert (coarse.upsample(s)[:, coarse.idle] == 0).all()
+  # Idle slots get the cold start price, and are left out of coarse prices.
+  p = np.arange(4.0) + 1
+  assert (coarse.upsample_price(p)[coarse.idle] == 0).all()
+  assert np.allclose(coarse.downsample_price(coarse.upsample_price(p)), np.where(coarse.busy > 0, p, 0))
+
+
+def test_make_level_scales_tol_and_stepsize():
+  multires = MultiResolution(make_network(tol=1e-3), (4,))
+  level = multires.make_level(4)
+  busy = level.deviceset.busy
+  assert level.tol == 4e-3 and level.stepsize == 0.3
+  assert np.allclose(level.get_stepsize(), 0.3/np.maximum(busy, 1))
+  multires = MultiResolution(make_network(stepsize='0.3/(steps+1)'), (4,))
+  level = multires.make_level(4)
+  level.steps = 1
+  assert np.allclose(level.get_stepsize(), 0.3/2/np.maximum(busy, 1))
+
+
+def test_invalid_factors():
+  with pytest.raises(ValueError):
+    MultiResolution(make_network(), (4, 1))
+
+
+@pytest.mark.parametrize('strategy', [None, 'function_bid'])
+def test_converges_to_the_full_resolution_equilibrium(strategy):
+  plain = make_network()
+  plain.set_agent_strategy(strategy)
+  assert plain.run()
+  network = make_network(maxsteps=60)
+  network.set_agent_strategy(strategy)
+  multires = MultiResolution(network, (2, 4))
+  assert multires.run()
+  assert [r['factor'] for r in multires.results] == [4, 2, 1]
+  assert [r['slots'] for r in multires.results] == [4, 8, 16]
+  assert all(r['converged'] for r in multires.results)
+  assert np.allclose(network.price, plain.price, atol=1e-2)
+  assert np.abs(network.excess).max() <= network.tol
+  assert network.steps < plain.steps
+
+
+@pytest.mark.parametrize('seed', range(0, 4))
+@pytest.mark.parametrize('factors', [(2,), (4,), (4, 2)])
+def test_fewer_fine_steps_than_a_cold_run(seed, factors):
+  plain = Network(scenarios.make_deviceset(seed=seed), stepsize=0.3, maxsteps=200, backend='serial')
+  assert plain.run()
+  network = Network(scenarios.make_deviceset(seed=seed), stepsize=0.3, maxsteps=200, backend='serial')
+  assert MultiResolution(network, factors).run()
+  assert network.steps < plain.steps
+  assert np.allclose(network.price, plain.price, atol=1e-3)
@@ -0,0 +1,44 @@
+import json
+import numpy as np
+from device_kit_market_simulations.network import Network, compact_rows, expand_rows, agent_update, agent_point_bid_update
+from device_kit_market_simulations.precision import validate_precision
+from device_kit_market_simulations.reporting.writer import JSONEncoder, JSONDecoderObjectHook
+import scenarios
+
+
+def make_network(**kwargs):
+  return Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial', **kwargs)
+
+
+def test_float32_run():
+  network = make_network(dtype='float32')
+  assert network.run()
+  assert network.s.dtype == np.float32 and network.price.dtype == np.float32
+  report = validate_precision(network, rtol=1e-2)
+  assert report['dtype'] == 'float32'
+  assert report['ok'] and report['reference_stable']
+
+
+def test_agent_update_returns_start_point_dtype():
+  device = scenarios.make_deviceset().devices[0]
+  (s, error) = agent_update((agent_point_bid_update, device, np.zeros(8, dtype='float32'), np.zeros(device.shape, dtype='float32'), None, None))
+  assert error is None and s.dtype == np.float32
+
+
+def test_compact_rows_roundtrip():
+  s = np.zeros((5, 4), dtype='float32')
+  s[1] = 1
+  s[3, 2] = -2
+  d = compact_rows(s)
+  assert d['rows'] == [1, 3]
+  assert (expand_rows(d) == s).all() and expand_rows(d).dtype == np.float32
+  assert (expand_rows(compact_rows(np.zeros((2, 3)))) == 0).all()
+
+
+def test_compact_storage_serialization():
+  network = make_network(compact_storage=True)
+  network.run()
+  d = json.loads(json.dumps(network, cls=JSONEncoder))
+  assert d['s']['rows']
+  loaded = json.loads(json.dumps(network, cls=JSONEncoder), object_hook=JSONDecoderObjectHook)
+  assert np.allclose(loaded.s, network.s)
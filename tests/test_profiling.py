@@ -0,0 +1,61 @@
+import os
+import cProfile
+import pstats
+import pytest
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.profiling import AgentProfiles
+from device_kit_market_simulations.run import dump_profiles
+import scenarios
+
+
+def profiled_run(backend, compression=None):
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend=backend, compression=compression)
+  network.profiles = AgentProfiles()
+  profiler = cProfile.Profile()
+  profiler.enable()
+  try:
+    assert network.run()
+  finally:
+    profiler.disable()
+  return (network, pstats.Stats(profiler))
+
+
+def functions(stats):
+  return {name for (filename, line, name) in stats.stats}
+
+
+@pytest.mark.parametrize('backend', ['serial', 'auto'])
+def test_inline_solves_are_in_the_coordinator_profile(backend):
+  (network, stats) = profiled_run(backend)
+  assert stats.total_calls > 0
+  assert {'run', 'agent_update', 'update_price'} <= functions(stats)
+  if backend == 'serial':
+    assert len(network.profiles) == 0
+
+
+@pytest.mark.parametrize('compression', [None, {'threshold': 0}])
+def test_worker_solves_are_profiled_per_agent(compression):
+  (network, stats) = profiled_run('process', compression)
+  assert stats.total_calls > 0 and 'run' in functions(stats)
+  assert sorted(network.profiles.profiles) == sorted(a.id for (a, _) in network.agents)
+  assert all(n == network.steps for n in network.profiles.solves.values())
+  assert all(profile.total_calls > 0 for profile in network.profiles.profiles.values())
+
+
+def test_dump_profiles(tmp_path):
+  (network, _) = profiled_run('process')
+  profiler = cProfile.Profile()
+  profiler.enable()
+  profiler.disable()
+  dump_profiles(network, profiler, str(tmp_path/'profile'))
+  names = os.listdir(str(tmp_path/'profile'))
+  assert {'coordinator.prof', 'agents.prof', 'agents.csv'} <= set(names)
+  assert len([n for n in names if n.startswith('agent-')]) == len(network.agents)
+  table = network.profiles.table()
+  assert len(table) == len(network.agents) and (table['total_time'] >= 0).all()
+  assert pstats.Stats(str(tmp_path/'profile'/'agents.prof')).total_calls == sum(p.total_calls for p in network.profiles.profiles.values())
+
+
+def test_empty_profiles():
+  profiles = AgentProfiles()
+  assert len(profiles) == 0 and profiles.merged() is None and not len(profiles.table())
@@ -0,0 +1,31 @@
+import os
+import numpy as np
+import pandas as pd
+from device_kit import DeviceSet
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting.history import HistoryRecorder
+from device_kit_market_simulations.reporting.writer import NetworkReader
+from device_kit_market_simulations.report import agent_rows, report_plots_agents, report_plots_market_trends
+import scenarios
+
+
+def test_agent_rows_dont_match_prefixes():
+  df = pd.DataFrame(np.zeros((4, 2)), index=['site.a1.x', 'site.a1.y', 'site.a10.x', 'site.a10'])
+  assert agent_rows(df) == {'a1': ['site.a1.x', 'site.a1.y'], 'a10': ['site.a10.x', 'site.a10']}
+
+
+def test_report_plots(tmp_path):
+  deviceset = scenarios.make_deviceset()
+  (a, b) = deviceset.devices[0:2]
+  deviceset = DeviceSet('site', [DeviceSet('a1', [a]), DeviceSet('a10', [b])] + deviceset.devices[2:])
+  network = Network(deviceset, stepsize=0.3, maxsteps=200, backend='serial')
+  recorder = HistoryRecorder(network, 5, 5)
+  network.run([recorder.update])
+  run_dir = str(tmp_path/'run')
+  recorder.spill(run_dir)
+  report_plots_agents(network, 'test', 'demand-final-agent', str(tmp_path))
+  for agent in ('a1', 'a10', 'q02', 'supply'):
+    assert os.path.isfile(str(tmp_path/('demand-final-agent-%s.png' % (agent,))))
+  report_plots_market_trends(NetworkReader(run_dir), str(tmp_path))
+  for name in ('welfares-trend', 'load-factor-trend', 'excess-demand-trend'):
+    assert os.path.isfile(str(tmp_path/('%s.png' % (name,))))
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.rolling import RollingHorizon
+import scenarios
+
+
+def make_network():
+  return Network(scenarios.make_rolling_deviceset(0), stepsize=0.3, maxsteps=200, backend='serial')
+
+
+def test_rolling_warm_starts_intervals():
+  rolling = RollingHorizon(make_network(), scenarios.make_rolling_deviceset, shift=1, budget=60)
+  results = rolling.run(4)
+  assert [r['interval'] for r in results] == [0, 1, 2, 3]
+  assert all(r['converged'] for r in results)
+  assert all(r['steps'] <= results[0]['steps'] for r in results[1:])
+  stats = rolling.stats()
+  assert stats['intervals'] == 4 and stats['over_budget'] == 0
+  assert stats['latency_max'] >= stats['latency_p50']
+
+
+def test_over_budget_is_flagged():
+  rolling = RollingHorizon(make_network(), scenarios.make_rolling_deviceset, budget=1e-9)
+  assert rolling.step()['over_budget']
+
+
+def test_shift():
+  network = make_network()
+  network.init()
+  network.set_price(np.arange(len(network)))
+  network.shift(2)
+  assert list(network.price) == [2, 3, 4, 5, 6, 7, 7, 7]
+  with pytest.raises(ValueError):
+    network.shift(1, scenarios.make_deviceset(T=4))
@@ -0,0 +1,44 @@
+import os
+from device_kit_market_simulations.run import load_scenario, make_module_path
+from device_kit_market_simulations.scenario_cache import ScenarioCache, scenario_hash
+import scenarios
+
+
+def test_not_cached_by_default(tmp_path, monkeypatch):
+  monkeypatch.setattr('device_kit_market_simulations.scenario_cache.default_cache_dir', str(tmp_path))
+  (deviceset, meta, cb) = load_scenario('scenarios')
+  assert meta == scenarios.meta
+  assert os.listdir(str(tmp_path)) == []
+
+
+def test_cache_hit_and_miss(tmp_path):
+  cache = ScenarioCache(str(tmp_path))
+  (deviceset, meta, cb) = load_scenario('scenarios', {'n': 2}, cache)
+  (cached, meta, cb) = load_scenario('scenarios', {'n': 2}, cache)
+  assert (cache.hits, cache.misses) == (1, 1)
+  assert [d.id for d in cached.devices] == [d.id for d in deviceset.devices]
+  load_scenario('scenarios', {'n': 3}, cache)
+  assert cache.misses == 2
+  assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_refresh_rebuilds(tmp_path):
+  load_scenario('scenarios', None, ScenarioCache(str(tmp_path)))
+  cache = ScenarioCache(str(tmp_path), refresh=True)
+  load_scenario('scenarios', None, cache)
+  assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_key_depends_on_args():
+  assert scenario_hash(scenarios, {'n': 2}) != scenario_hash(scenarios, {'n': 3})
+  assert scenario_hash(scenarios, {'n': 2}) == scenario_hash(scenarios, {'n': 2})
+
+
+def test_unpicklable_scenario_isnt_cached(tmp_path):
+  class Module():
+    __name__ = 'unpicklable'
+    make_deviceset = staticmethod(lambda: scenarios.make_deviceset(device_cls=scenarios.UnpicklableDevice))
+  cache = ScenarioCache(str(tmp_path))
+  cache.key = lambda module, args: 'key'
+  assert cache.load(Module()) is not None
+  assert os.listdir(str(tmp_path)) == []
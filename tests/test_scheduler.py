@@ -0,0 +1,31 @@
+from device_kit_market_simulations.scheduler import LPTScheduler
+
+
+def test_schedule_covers_every_task_once():
+  scheduler = LPTScheduler()
+  bins = scheduler.schedule(10, 3)
+  assert len(bins) == 3
+  assert sorted(i for _bin in bins for i in _bin) == list(range(0, 10))
+
+
+def test_no_more_bins_than_tasks():
+  assert len(LPTScheduler().schedule(2, 8)) == 2
+  assert LPTScheduler().schedule(0, 4) == []
+
+
+def test_lpt_packs_by_cost():
+  scheduler = LPTScheduler()
+  scheduler.update({0: 4.0, 1: 3.0, 2: 3.0, 3: 2.0, 4: 2.0, 5: 2.0})
+  bins = scheduler.schedule(6, 2)
+  assert scheduler.makespan == 8
+  assert scheduler.imbalance == 1
+  assert sorted(sorted(_bin) for _bin in bins) == [[0, 3, 4], [1, 2, 5]]
+
+
+def test_moving_average_and_default_cost():
+  scheduler = LPTScheduler(alpha=0.5)
+  scheduler.update({0: 2.0})
+  scheduler.update({0: 4.0, 1: 1.0})
+  assert scheduler.costs == {0: 3.0, 1: 1.0}
+  scheduler.schedule(3, 3)
+  assert scheduler.makespan == 3.0
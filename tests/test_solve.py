@@ -0,0 +1,45 @@
+import numpy as np
+from device_kit_market_simulations.solve import CentralSolver, solve_batch, optimality_gap
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.compat import utility, cost
+import scenarios
+
+
+def test_central_solver_balances():
+  solver = CentralSolver(scenarios.make_deviceset())
+  (x, meta) = solver.solve()
+  assert meta.success
+  assert np.abs(x.sum(axis=0)).max() < 1e-4
+  assert solver.u() == utility(solver.deviceset, x, 0)
+
+
+def test_central_solver_warm_start_from_last_solution():
+  solver = CentralSolver(scenarios.make_deviceset())
+  (x, _meta) = solver.solve()
+  (x2, meta) = solver.solve()
+  assert meta.success
+  assert np.allclose(x, x2, atol=1e-3)
+
+
+def test_utility_is_negative_cost():
+  deviceset = scenarios.make_deviceset()
+  s = np.ones(deviceset.shape)
+  assert utility(deviceset, s, 0.5) == -cost(deviceset, s, 0.5)
+
+
+def test_solve_batch_in_variant_order():
+  variants = [{'scenario': 'scenarios', 'p': p} for p in (0, 1)]
+  results = solve_batch(variants, processes=1)
+  assert [r['p'] for r in results] == [0, 1]
+  assert all(r['success'] for r in results)
+
+
+def test_optimality_gap():
+  solver = CentralSolver(scenarios.make_deviceset())
+  solver.solve()
+  network = Network(scenarios.make_deviceset(), maxsteps=200, stepsize=0.3)
+  assert network.run()
+  gap = optimality_gap(solver, network)
+  assert set(gap) >= {'u_optimal', 'u_market', 'gap', 'gap_rel', 'flow_distance', 'excess', 'steps'}
+  assert abs(gap['gap_rel']) < 0.01
+  assert gap['steps'] == network.steps
@@ -0,0 +1,46 @@
+import numpy as np
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.reporting.summary import summarize, summarize_steps
+import scenarios
+
+
+def make_network():
+  network = Network(scenarios.make_deviceset(), stepsize=0.3, maxsteps=200, backend='serial')
+  network.run()
+  return network
+
+
+def test_summarize_is_cached_until_price_or_s_set():
+  network = make_network()
+  summary = summarize(network)
+  assert summarize(network) is summary
+  network.set_price(network.price)
+  assert summarize(network) is not summary
+  summary = summarize(network)
+  network.s = network.s
+  assert summarize(network) is not summary
+
+
+def test_in_place_change_with_version_bump():
+  network = make_network()
+  summary = summarize(network)
+  network.s[0, :] += 1
+  network.version += 1
+  assert summarize(network).excess.sum() == summary.excess.sum() + len(network)
+
+
+def test_summary_stable_follows_network():
+  network = make_network()
+  assert summarize(network).stable
+  network.step_failures = [('q00', 'error')]
+  network.version += 1
+  assert not summarize(network).stable
+
+
+def test_summarize_steps_matches_summary_rows():
+  network = make_network()
+  row = summarize(network).to_row()
+  df = summarize_steps(network, np.array([network.steps]), network.price[None], network.s[None])
+  assert 'bytes_sent' not in df.columns
+  for (k, v) in df.iloc[0].items():
+    assert np.isclose(float(v), float(row[k])), k
@@ -0,0 +1,176 @@
+import time
+import socket
+import threading
+import numpy as np
+import pytest
+from device_kit_market_simulations import transport
+from device_kit_market_simulations.transport import (
+  AgentWorker, SocketAgentPool, AuthenticationError, pack_array, unpack_array, pack_bid, unpack_bid,
+  send_message, recv_message, parse_address, SETUP, STEP, ERROR, RESULT
+)
+from device_kit_market_simulations.compression import BidCodec
+from device_kit_market_simulations.network import agent_update
+import scenarios
+
+
+def ones(task):
+  (device, p, s0) = task[0:3]
+  return np.ones(device.shape)
+
+
+def echo(task):
+  return task[2]
+
+
+class Stub():
+  ''' Stands in for a device where the strategy doesn't use one. '''
+  shape = (1, 288)
+
+
+def slow(task):
+  time.sleep(0.5 if task[0].id == 'q00' else 0)
+  return ones(task)
+
+
+def start_worker(address, key=None):
+  worker = AgentWorker(address, key)
+  threading.Thread(target=worker.serve_forever, daemon=True).start()
+  (family, addr) = parse_address(address)
+  for i in range(0, 100):
+    try:
+      with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(addr)
+      return worker
+    except OSError:
+      time.sleep(0.01)
+  raise Exception('Worker did not start')
+
+
+def make_tasks(strategy, deviceset):
+  return [(strategy, device, np.zeros(len(deviceset)), np.zeros(device.shape), None, None) for device in deviceset.devices]
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32', 'int32'])
+def test_array_roundtrip(dtype):
+  a = np.arange(12, dtype=dtype).reshape(3, 4)
+  (b, offset) = unpack_array(pack_array(a) + b'tail')
+  assert b.dtype == a.dtype and (a == b).all()
+  assert offset == len(pack_array(a))
+
+
+def test_compressed_bid_roundtrip():
+  s0 = np.zeros((2, 6))
+  s = s0.copy()
+  s[1, 3] = 2.5
+  bid = BidCodec(bits=8).encode(s, s0)
+  (decoded, _offset) = unpack_bid(pack_bid(bid))
+  assert np.allclose(BidCodec().decode(decoded, s0), s, atol=0.05)
+
+
+def test_default_address_is_loopback():
+  assert parse_address(':9000') == (socket.AF_INET, ('127.0.0.1', 9000))
+
+
+def test_refuses_public_address_without_key(monkeypatch):
+  monkeypatch.delenv(transport.key_env, raising=False)
+  with pytest.raises(ValueError):
+    AgentWorker('tcp://0.0.0.0:9000')
+  AgentWorker('tcp://0.0.0.0:9000', key='secret')
+  AgentWorker('tcp://127.0.0.1:9000')
+
+
+def test_bad_mac_rejected():
+  (a, b) = socket.socketpair()
+  with a, b:
+    send_message(a, STEP, b'payload', b'wrong')
+    with pytest.raises(AuthenticationError):
+      recv_message(b, b'right')
+    send_message(a, STEP, b'payload', b'right')
+    assert recv_message(b, b'right') == (STEP, bytearray(b'payload'))
+
+
+def test_pool_solves_remotely(tmp_path):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address, key='secret')
+  deviceset = scenarios.make_deviceset()
+  with SocketAgentPool([address], key='secret') as pool:
+    results = pool.map(agent_update, make_tasks(ones, deviceset))
+  assert len(results) == len(deviceset.devices)
+  for ((s, error), device) in zip(results, deviceset.devices):
+    assert error is None and (s == np.ones(device.shape)).all()
+
+
+def test_pool_with_wrong_key_keeps_start_point(tmp_path):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address, key='secret')
+  deviceset = scenarios.make_deviceset()
+  with SocketAgentPool([address], timeout=1, retries=0, key='wrong') as pool:
+    results = pool.map(agent_update, make_tasks(ones, deviceset))
+  for ((s, error), device) in zip(results, deviceset.devices):
+    assert error and (s == 0).all()
+
+
+def test_pool_timeout(tmp_path):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address)
+  deviceset = scenarios.make_deviceset()
+  with SocketAgentPool([address]) as pool:
+    t = time.time()
+    results = pool.map(agent_update, make_tasks(slow, deviceset), timeout=0.1)
+    assert time.time() - t < 0.4
+    assert all(isinstance(r, TimeoutError) for r in results)
+    results = pool.map(agent_update, make_tasks(ones, deviceset), timeout=5)
+  assert all(error is None for (s, error) in results)
+
+
+def test_large_batch(tmp_path):
+  # Far more than fits in the socket buffers both ways: steps have to be sent while results are read.
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address)
+  tasks = [(echo, Stub(), np.zeros(288), np.full((1, 288), i, dtype=float), None, None) for i in range(0, 3000)]
+  with SocketAgentPool([address], timeout=20, retries=0) as pool:
+    results = pool.map(agent_update, tasks)
+  assert all(error is None for (s, error) in results)
+  assert [s[0, 0] for (s, error) in results] == list(range(0, 3000))
+
+
+def test_agents_are_set_up_once(tmp_path, monkeypatch):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address)
+  setups = []
+  _send_message = transport.send_message
+  def spy(sock, kind, payload, key=None):
+    if kind == SETUP:
+      setups.append(len(payload))
+    _send_message(sock, kind, payload, key)
+  monkeypatch.setattr(transport, 'send_message', spy)
+  deviceset = scenarios.make_deviceset()
+  tasks = make_tasks(ones, deviceset)
+  with SocketAgentPool([address]) as pool:
+    pool.map(agent_update, tasks)
+    results = pool.map(agent_update, tasks[1:])
+    assert len(setups) == 1
+    assert all(error is None and s.shape == device.shape for ((s, error), device) in zip(results, deviceset.devices[1:]))
+    pool.map(agent_update, tasks[2:] + tasks[0:1])
+    assert len(setups) == 1
+    pool.map(agent_update, make_tasks(ones, scenarios.make_deviceset())[0:1])
+    assert len(setups) == 2 and setups[1] < setups[0]
+
+
+def test_unknown_agent_is_an_error_result(tmp_path):
+  address = 'unix://%s' % (tmp_path/'w.sock',)
+  start_worker(address)
+  (family, addr) = parse_address(address)
+  with socket.socket(family, socket.SOCK_STREAM) as sock:
+    sock.settimeout(5)
+    sock.connect(addr)
+    step = transport._step.pack(7, 99, np.nan, np.nan) + pack_array(np.zeros(8)) + pack_array(np.zeros((1, 8)))
+    send_message(sock, STEP, step)
+    (kind, payload) = recv_message(sock)
+    assert kind == ERROR and transport._index.unpack_from(payload) == (7,)
+    assert b'KeyError' in bytes(payload)
+    device = scenarios.make_deviceset().devices[0]
+    send_message(sock, SETUP, transport.pickle.dumps(('device_kit_market_simulations.network.agent_update', [(99, (ones, device))])))
+    send_message(sock, STEP, step)
+    (kind, payload) = recv_message(sock)
+    assert kind == RESULT and transport._index.unpack_from(payload) == (7,)
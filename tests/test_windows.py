@@ -0,0 +1,36 @@
+import numpy as np
+from device_kit_market_simulations.windows import WindowedDevice, active_window
+from device_kit_market_simulations.network import Network
+from device_kit_market_simulations.compat import cost
+import scenarios
+
+
+def test_active_window():
+  device = scenarios.make_deviceset(T=8).devices[0]
+  (rows, cols) = active_window(device)
+  assert list(rows) == [0]
+  assert list(cols) == list(np.flatnonzero(device.hbounds))
+
+
+def test_windowed_device_matches_device():
+  device = scenarios.make_deviceset(T=8).devices[0]
+  windowed = WindowedDevice(device)
+  p = np.linspace(0, 1, 8)
+  s = np.ones(windowed.shape)
+  full = windowed.embed(s)
+  assert windowed.cost(s, windowed.compact_price(p)) == cost(device, full, p)
+  assert windowed.u(s, windowed.compact_price(p)) == -windowed.cost(s, windowed.compact_price(p))
+  assert np.allclose(windowed.deriv(s, windowed.compact_price(p)), windowed.compact(device.deriv(full, p)))
+  assert windowed.hess(s).shape == (s.size, s.size)
+  assert np.allclose(windowed.hess(s), np.eye(s.size)*2)
+
+
+def test_sparse_run_matches_dense():
+  dense = Network(scenarios.make_deviceset(T=12), stepsize=0.3, maxsteps=200, backend='serial')
+  sparse = Network(scenarios.make_deviceset(T=12), stepsize=0.3, maxsteps=200, backend='serial', sparse=True)
+  assert dense.run()
+  assert sparse.run()
+  assert sparse.steps > 1 and not any(sparse.failures.values())
+  assert all(len(device) < 12 for (device, _slice) in sparse.agents[0:-1])
+  assert np.allclose(sparse.s, dense.s, atol=1e-3)
+  assert np.allclose(sparse.price, dense.price, atol=1e-3)
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+''' Socket transport for running market agents in other processes, possibly on other machines. Start
+one or more workers:
+
+    ./transport.py tcp://127.0.0.1:9000
+    ./transport.py unix:///tmp/agents-0.sock
+
+Then point run.py at them with `--agent-workers tcp://127.0.0.1:9000,unix:///tmp/agents-0.sock`. Each
+worker solves its agents serially, so run about one worker per core.
+
+Workers unpickle the devices and entry point a coordinator sends them, so anyone who can connect to a
+worker can run code as its user. TCP workers bind to 127.0.0.1 by default. To listen on any other
+interface a shared key must be set in the environment of the worker and the coordinator:
+
+    export DKMS_AGENT_KEY=$(openssl rand -hex 32)
+    ./transport.py tcp://0.0.0.0:9000
+
+Every frame then carries an HMAC-SHA256 of it under the key, and frames that don't check out are
+dropped before anything is unpickled. Frames are authenticated, not encrypted: on an untrusted network
+tunnel the connection (over ssh, say).
+
+Messages are framed as (kind, length, payload). Arrays are sent in a compact binary form (dtype,
+shape, raw bytes) rather than pickled. Devices are only sent once per connection in SETUP messages;
+after that each step is just the price vector, start point, prox and timeout out, and the flow slice,
+sensitivities for function bids, and any error back. Arrays keep their dtype, so a float32 network
+(@see Network.dtype) sends half the bytes, and compressed bids (@see compression.py) are sent in their
+compressed form.
+'''
+import os
+import sys
+import time
+import hmac
+import struct
+import pickle
+import socket
+import argparse
+import importlib
+import contextlib
+import threading
+import ipaddress
+import logging
+import numpy as np
+from device_kit_market_simulations.compression import CompressedBid
+
+
+logger = logging.getLogger(__name__)
+
+SETUP, STEP, RESULT, ERROR = range(1, 5)  # Message kinds.
+_frame = struct.Struct('!BI')             # Message kind, payload length.
+_step = struct.Struct('!IIdd')            # Task index, agent index, prox, timeout (NaN for none).
+_index = struct.Struct('!I')              # Task index.
+_flag = struct.Struct('!B')               # Whether an optional array follows.
+_compressed = struct.Struct('!Bd')        # Whether indices follow, scale (NaN for none).
+_mac_size = 32                            # HMAC-SHA256 digest following each frame when keyed.
+key_env = 'DKMS_AGENT_KEY'                # Environment variable holding the shared key.
+
+
+class AgentTransportException(Exception):
+  ''' A remote agent solve failed. '''
+  pass
+
+
+class AuthenticationError(ConnectionError):
+  ''' A frame's authentication code didn't match. '''
+  pass
+
+
+def pack_array(a):
+  ''' Encode a numpy array as: dtype string, ndim, shape, raw C ordered data. '''
+  a = np.ascontiguousarray(a)
+  dtype = a.dtype.str.encode()
+  return struct.pack('!B%dsB%dI' % (len(dtype), a.ndim), len(dtype), dtype, a.ndim, *a.shape) + a.tobytes()
+
+
+def unpack_array(buf, offset=0):
+  ''' Inverse of pack_array(). Returns (array, offset of the first byte after the array). '''
+  (n,) = struct.unpack_from('!B', buf, offset)
+  dtype = np.dtype(bytes(buf[offset+1:offset+1+n]).decode())
+  offset += 1 + n
+  (ndim,) = struct.unpack_from('!B', buf, offset)
+  shape = struct.unpack_from('!%dI' % (ndim,), buf, offset+1)
+  offset += 1 + 4*ndim
+  count = int(np.prod(shape))
+  a = np.frombuffer(buf, dtype=dtype, count=count, offset=offset).reshape(shape)
+  return (a, offset + count*dtype.itemsize)
+
+
+def pack_bid(s):
+  ''' Encode an agent's flow slice, either an array or a CompressedBid, as: flag whether it's
+  compressed, then the array, or the shape, indices if any, scale and values.
+  '''
+  if not isinstance(s, CompressedBid):
+    return _flag.pack(False) + pack_array(s)
+  payload = _flag.pack(True) + pack_array(np.array(s.shape, dtype=np.uint32))
+  payload += _compressed.pack(s.indices is not None, _nan(s.scale))
+  payload += pack_array(s.indices) if s.indices is not None else b''
+  return payload + pack_array(s.values)
+
+
+def unpack_bid(buf, offset=0):
+  ''' Inverse of pack_bid(). Returns (flow slice, offset of the first byte after it). '''
+  (compressed,) = _flag.unpack_from(buf, offset)
+  if not compressed:
+    return unpack_array(buf, offset + _flag.size)
+  (shape, offset) = unpack_array(buf, offset + _flag.size)
+  (has_indices, scale) = _compressed.unpack_from(buf, offset)
+  offset += _compressed.size
+  indices = None
+  if has_indices:
+    (indices, offset) = unpack_array(buf, offset)
+  (values, offset) = unpack_array(buf, offset)
+  return (CompressedBid(shape.tolist(), indices, values, _none(scale)), offset)
+
+
+def send_message(sock, kind, payload, key=None):
+  ''' Send a frame, followed by its HMAC under `key` if given. '''
+  frame = _frame.pack(kind, len(payload)) + payload
+  sock.sendall(frame + (_mac(key, frame) if key else b''))
+
+
+def recv_message(sock, key=None):
+  ''' Receive a frame. With a `key` its HMAC is checked, and AuthenticationError raised if it's wrong. '''
+  header = _recv_exactly(sock, _frame.size)
+  (kind, length) = _frame.unpack(header)
+  payload = _recv_exactly(sock, length)
+  if key and not hmac.compare_digest(bytes(_recv_exactly(sock, _mac_size)), _mac(key, header + payload)):
+    raise AuthenticationError('Bad message authentication code')
+  return (kind, payload)
+
+
+def _mac(key, frame):
+  return hmac.new(key, frame, 'sha256').digest()
+
+
+def get_key(key=None):
+  ''' The shared key as bytes: `key` if given, else from the environment, else None. '''
+  key = key if key is not None else os.environ.get(key_env)
+  return key.encode() if isinstance(key, str) else key
+
+
+def _recv_exactly(sock, n):
+  buf = bytearray(n)
+  view = memoryview(buf)
+  got = 0
+  while got < n:
+    k = sock.recv_into(view[got:], n - got)
+    if not k:
+      raise ConnectionError('Connection closed by peer')
+    got += k
+  return buf
+
+
+def _nan(v):
+  return np.nan if v is None else v
+
+
+def _none(v):
+  return None if np.isnan(v) else v
+
+
+def parse_address(address):
+  ''' Parse "unix:///path/to.sock" or "[tcp://][host]:port" to (family, sockaddr). host defaults to
+  127.0.0.1.
+  '''
+  if address.startswith('unix://'):
+    return (socket.AF_UNIX, address[len('unix://'):])
+  if address.startswith('tcp://'):
+    address = address[len('tcp://'):]
+  (host, port) = address.rsplit(':', 1)
+  return (socket.AF_INET, (host or '127.0.0.1', int(port)))
+
+
+def is_local(family, addr):
+  ''' Whether a parsed address is only reachable from this machine. '''
+  if family == socket.AF_UNIX or addr[0] == 'localhost':
+    return True
+  try:
+    return ipaddress.ip_address(addr[0]).is_loopback
+  except ValueError:
+    return False
+
+
+def resolve_function(name):
+  ''' Load a function - an agent strategy or pool entry point - from its fully qualified name. Entry
+  points that are callable objects (@see network.CompressedAgentUpdate) are sent pickled instead.
+  '''
+  if not isinstance(name, str):
+    return name
+  (module, fn) = name.rsplit('.', 1)
+  return getattr(importlib.import_module(module), fn)
+
+
+class AgentWorker():
+  ''' Serves agent solves to coordinators (@see SocketAgentPool). A coordinator first sends a SETUP
+  message with the entry point function and the (index, (strategy, device)) of each agent it wants
+  solved on this connection - later SETUPs add agents - then a STEP message per agent per step. Each
+  STEP is answered with a RESULT holding the agent's flow slice and error message if any, or an ERROR
+  if the entry point itself raised or the agent is unknown. Each connection is served on its own
+  thread with its own agents.
+
+  Without a shared `key` (@see get_key()) the worker refuses to listen anywhere but loopback or a unix
+  socket, since SETUP messages are unpickled.
+  '''
+  address = None
+  key = None
+
+  def __init__(self, address, key=None):
+    self.address = address
+    self.key = get_key(key)
+    if not self.key and not is_local(*parse_address(address)):
+      raise ValueError('Refusing to listen on %s without a shared key. Set %s' % (address, key_env))
+
+  def serve_forever(self):
+    (family, addr) = parse_address(self.address)
+    if family == socket.AF_UNIX and os.path.exists(addr):
+      os.unlink(addr)
+    server = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+      server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(addr)
+    server.listen()
+    logger.info('Agent worker listening on %s', self.address)
+    with server:
+      while True:
+        (conn, peer) = server.accept()
+        threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+  def handle(self, conn):
+    agents = {}
+    fn = None
+    with conn:
+      while True:
+        try:
+          (kind, payload) = recv_message(conn, self.key)
+        except AuthenticationError as e:
+          logger.warning('Dropped connection [%s]', e)
+          return
+        except (ConnectionError, OSError):
+          return
+        if kind == SETUP:
+          (fn_name, added) = pickle.loads(payload)
+          fn = resolve_function(fn_name)
+          agents.update(added)
+          logger.info('Setup %d agents (%d in all) with %s', len(added), len(agents), fn_name)
+        elif kind == STEP:
+          (i, j, prox, timeout) = _step.unpack_from(payload)
+          try:
+            (p, offset) = unpack_array(payload, _step.size)
+            (s0, offset) = unpack_array(payload, offset)
+            (strategy, device) = agents[j]
+            (s, error) = fn((strategy, device, p, s0, _none(prox), _none(timeout)))
+            (s, sensitivity) = s if isinstance(s, tuple) else (s, None)
+            payload = _index.pack(i) + pack_bid(s) + _flag.pack(sensitivity is not None)
+            payload += pack_array(sensitivity) if sensitivity is not None else b''
+            (kind, payload) = (RESULT, payload + (error or '').encode())
+          except Exception as e:
+            (kind, payload) = (ERROR, _index.pack(i) + ('%s: %s' % (e.__class__.__name__, e)).encode())
+          try:
+            send_message(conn, kind, payload, self.key)
+          except OSError:
+            return
+
+
+class _AgentConnection():
+  ''' Coordinator side of one connection to an AgentWorker. Agents are set up on the worker once per
+  connection, under an index of their own, whatever subset of tasks later steps send.
+  '''
+  address = None
+  sock = None
+  key = None
+  fn = None           # Entry point the worker was last set up with.
+  agents = {}         # (strategy, id(device)) to (worker side index, device) of agents set up.
+  send_errors = []    # Error of the sender thread of the current steps, if it failed.
+
+  def __init__(self, address, timeout, key=None):
+    self.address = address
+    self.timeout = timeout
+    self.key = key
+
+  def connect(self):
+    (family, addr) = parse_address(self.address)
+    self.sock = socket.socket(family, socket.SOCK_STREAM)
+    self.sock.settimeout(self.timeout)
+    self.sock.connect(addr)
+    (self.fn, self.agents) = (None, {})
+
+  def close(self):
+    if self.sock:
+      self.sock.close()
+    self.sock = None
+
+  def send(self, fn, tasks):
+    ''' Send a step for each of `tasks`, a list of (index, (strategy, device, p, s0, prox, timeout)).
+    Only agents the worker hasn't got yet are sent in a SETUP first. The steps themselves are written
+    on a sender thread while recv() reads results: the worker answers each step as it reads it, so
+    with large batches both sides would otherwise block writing into full socket buffers.
+    '''
+    if self.sock is None:
+      self.connect()
+    (steps, added) = ([], [])
+    for (i, task) in tasks:
+      agent = (task[0], id(task[1]))
+      if agent not in self.agents:
+        self.agents[agent] = (len(self.agents), task[1])  # Holding the device keeps its id unique.
+        added.append((self.agents[agent][0], task[0:2]))
+      steps.append((i, self.agents[agent][0], task))
+    if added or fn != self.fn:
+      send_message(self.sock, SETUP, pickle.dumps((fn, added)), self.key)
+      self.fn = fn
+    self.send_errors = []
+    threading.Thread(target=self._send_steps, args=(self.sock, steps, self.send_errors), daemon=True).start()
+
+  def _send_steps(self, sock, steps, errors):
+    try:
+      for (i, j, (strategy, device, p, s0, prox, timeout)) in steps:
+        payload = _step.pack(i, j, _nan(prox), _nan(timeout)) + pack_array(p) + pack_array(s0)
+        send_message(sock, STEP, payload, self.key)
+    except OSError as e:
+      errors.append(e)
+      with contextlib.suppress(OSError):
+        sock.shutdown(socket.SHUT_RDWR)  # Wakes recv().
+
+  def recv(self, n, results=None, deadline=None):
+    ''' Receive `n` results into `results`, a dict of agent index to (flow slice, error) or an
+    AgentTransportException, and return it. No single receive waits past `deadline` (a time.time()).
+    '''
+    results = {} if results is None else results
+    while len(results) < n:
+      if deadline is not None:
+        self.sock.settimeout(max(min(self.timeout, deadline - time.time()), 1e-3))
+      try:
+        (kind, payload) = recv_message(self.sock, self.key)
+      except OSError:
+        if self.send_errors:
+          raise self.send_errors[0]
+        raise
+      (i,) = _index.unpack_from(payload)
+      if kind == ERROR:
+        results[i] = AgentTransportException(bytes(payload[_index.size:]).decode())
+      else:
+        (s, offset) = unpack_bid(payload, _index.size)
+        (has_sensitivity,) = _flag.unpack_from(payload, offset)
+        offset += _flag.size
+        if has_sensitivity:
+          (sensitivity, offset) = unpack_array(payload, offset)
+          s = (s, sensitivity)
+        results[i] = (s, bytes(payload[offset:]).decode() or None)
+    if deadline is not None:
+      self.sock.settimeout(self.timeout)
+    return results
+
+
+class SocketAgentPool():
+  ''' Stands in for the part of multiprocessing.Pool that Network uses - map() of an entry point
+  (network.agent_update) over agent tasks (strategy, device, p, s0, prox, timeout) - but sends each
+  agent's solve to a remote AgentWorker. Agents are assigned to workers round robin. Steps are sent
+  to all workers before any results are read so workers solve in parallel.
+
+  A worker that times out or drops the connection is reconnected and resent its agents up to
+  `retries` times. If it still fails the affected agents keep their previous bid (the start point s0)
+  for the step, with an error, so one bad worker doesn't stall the market.
+
+  Frames are authenticated with the shared `key` if there is one (@see get_key()).
+  '''
+  timeout = 60      # Seconds to wait on any single socket operation.
+  retries = 2
+  connections = []
+
+  def __init__(self, addresses, timeout=None, retries=None, key=None):
+    self.timeout = timeout if timeout is not None else self.timeout
+    self.retries = retries if retries is not None else self.retries
+    key = get_key(key)
+    self.connections = [_AgentConnection(address, self.timeout, key) for address in addresses]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    [conn.close() for conn in self.connections]
+
+  def map(self, fn, tasks, timeout=None):
+    ''' Map fn over tasks remotely. Like the other backends (@see backends.py) if `timeout` is given
+    any task without a result within timeout seconds of the call gets a TimeoutError instance as its
+    result. A worker that runs out the timeout isn't retried, and is reconnected on the next call.
+    '''
+    fn = '%s.%s' % (fn.__module__, fn.__name__) if hasattr(fn, '__name__') else fn
+    deadline = time.time() + timeout if timeout is not None else None
+    tasks = list(tasks)
+    n = len(self.connections)
+    batches = [[(i, tasks[i]) for i in range(k, len(tasks), n)] for k in range(0, n)]
+    results = [None]*len(tasks)
+    sent = [self._send(conn, fn, batch) for (conn, batch) in zip(self.connections, batches)]
+    for (conn, batch, ok) in zip(self.connections, batches, sent):
+      for attempt in range(0, self.retries + 1):
+        received = {}
+        try:
+          if not ok:
+            time.sleep(min(0.1*2**attempt, 2))
+            conn.send(fn, batch)
+          conn.recv(len(batch), received, deadline)
+          break
+        except OSError as e:
+          if deadline is not None and time.time() >= deadline:
+            logger.warning('Agent worker %s timed out after %.1fs', conn.address, timeout)
+            conn.close()
+            received.update({i: TimeoutError() for (i, task) in batch if i not in received})
+            break
+          logger.warning('Agent worker %s failed on attempt %d/%d [%s]', conn.address, attempt+1, self.retries+1, e)
+          conn.close()
+          ok = False
+        finally:
+          for (i, r) in received.items():
+            results[i] = r
+    for (i, r) in enumerate(results):
+      if r is None or (isinstance(r, Exception) and not isinstance(r, TimeoutError)):
+        results[i] = (tasks[i][3], str(r) if r else 'No response from agent worker')
+    return results
+
+  def _send(self, conn, fn, batch):
+    try:
+      conn.send(fn, batch)
+      return True
+    except OSError as e:
+      logger.warning('Agent worker %s failed on send [%s]', conn.address, e)
+      conn.close()
+      return False
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Serve market agent solves over a socket.')
+  parser.add_argument('address', action='store', nargs='?', default='tcp://127.0.0.1:9000',
+    help='address to listen on. Either [tcp://][host]:port or unix:///path/to.sock. Listening anywhere '
+      'but loopback or a unix socket requires a shared key in $%s' % (key_env,)
+  )
+  args = parser.parse_args()
+  AgentWorker(args.address).serve_forever()
+
+
+if __name__ == '__main__':
+  logging.basicConfig()
+  logging.getLogger().setLevel(logging.INFO)
+  main()
@@ -5,13 +5,90 @@ Script to process output of profiler. Gen prof data like this for ex:
     python3 -m cProfile -o prof device_kit_market_simulations/utils/central-solver.py scenario1.py
     time python3 -m cProfile -o prof ./run.py scenario/single_home_against_supply.py
 
+Or better, with run.py's --profile, which also profiles agent solves inside the workers and writes
+coordinator.prof, agents.prof (all agents merged) and agent-<id>.prof files to <output_dir>/profile/.
+
 Gen stats like this:
 
-    python3 ppstats.py  prof tot
+    python3 ppstats.py prof tot
+    python3 ppstats.py my-run/profile -s tottime    # Merge every profile in the dir.
+    python3 ppstats.py my-run/profile --agents      # Time per agent.
+    python3 ppstats.py my-run/profile/agents.prof --callers solve
 
 '''
+import os
+import re
 import sys
 import pstats
-sys.exit('Usage: stats <file> <sort>. See https://docs.python.org/3/library/profile.html#pstats.Stats.sort_stats') if len(sys.argv) != 3 else None
-p = pstats.Stats(sys.argv[1])
-p.strip_dirs().sort_stats(sys.argv[2]).print_stats(50)
+import argparse
+from glob import glob
+
+
+def expand(paths):
+  ''' Files given, and the *.prof files in any dirs given. Per agent files in a dir are left out when
+  the dir has the merged agents.prof, so they aren't counted twice.
+  '''
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      found = sorted(glob(os.path.join(path, '*.prof')))
+      if os.path.join(path, 'agents.prof') in found:
+        found = [f for f in found if not re.match(r'agent-.*\.prof$', os.path.basename(f))]
+      files += found
+    else:
+      files.append(path)
+  return files
+
+
+def agent_table(paths, limit):
+  ''' Print total time of each agent-<id>.prof found, most expensive first. '''
+  files = []
+  for path in paths:
+    files += sorted(glob(os.path.join(path, 'agent-*.prof'))) if os.path.isdir(path) else [path]
+  rows = []
+  for f in files:
+    stats = pstats.Stats(f)
+    agent = re.sub(r'^agent-(.*)\.prof$', r'\1', os.path.basename(f))
+    (func, tt) = max(((k, v[2]) for (k, v) in stats.stats.items()), key=lambda kv: kv[1])
+    rows.append((stats.total_tt, stats.total_calls, agent, '%s:%d(%s)' % (os.path.basename(func[0]), func[1], func[2]), tt))
+  total = sum(row[0] for row in rows)
+  print('%-24s %10s %7s %12s  %s' % ('agent', 'time', '%', 'calls', 'top function (own time)'))
+  for (tt, calls, agent, func, func_tt) in sorted(rows, reverse=True)[0:limit]:
+    print('%-24s %10.4f %6.1f%% %12d  %s (%.4f)' % (agent, tt, 100*tt/total if total else 0, calls, func, func_tt))
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Report on profiles. Several are merged.')
+  parser.add_argument('paths', nargs='+',
+    help='profile files, or dirs of them (@see run.py --profile)'
+  )
+  parser.add_argument('--sort', '-s', dest='sort', default='cumulative',
+    help='sort key. See https://docs.python.org/3/library/profile.html#pstats.Stats.sort_stats'
+  )
+  parser.add_argument('-n', dest='limit', default=50, type=int,
+    help='number of rows to print'
+  )
+  parser.add_argument('--agents', '-a', dest='agents', action='store_true',
+    help='print time per agent from per agent profiles instead'
+  )
+  parser.add_argument('--callers', dest='callers', default=None,
+    help='also print the callers of functions matching this'
+  )
+  args = parser.parse_args()
+  # Old usage: ppstats.py <file> <sort>.
+  if len(args.paths) == 2 and not os.path.exists(args.paths[1]):
+    args.sort = args.paths.pop()
+  if args.agents:
+    agent_table(args.paths, args.limit)
+    return
+  files = expand(args.paths)
+  if not files:
+    sys.exit('No profiles found in %s' % (args.paths,))
+  p = pstats.Stats(*files)
+  p.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+  if args.callers:
+    p.print_callers(args.callers)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,106 @@
+''' Restrict an agent's problem to its active time window. Many devices can only be flexible in a
+small part of the horizon - an EV that charges overnight say - and elsewhere their bounds fix the flow
+(usually at 0). A WindowedDevice presents just the rows and columns that have any free cell as the
+device to solve, holding the rest at their fixed value, so both the solve and the price/flow
+slices exchanged with the agent shrink to the window.
+'''
+import numpy as np
+from device_kit_market_simulations.compat import utility, cost
+
+
+def active_window(device):
+  ''' Get (rows, cols) index arrays of the rows and columns of `device` that have at least one cell
+  with lbound != hbound. Any other cell is fixed by its bounds.
+  '''
+  bounds = np.array(device.bounds).reshape(tuple(device.shape) + (2,))
+  free = bounds[..., 0] != bounds[..., 1]
+  return (np.flatnonzero(free.any(axis=1)), np.flatnonzero(free.any(axis=0)))
+
+
+class WindowedDevice():
+  ''' View of `device` restricted to the rows and cols of its active window (@see active_window()).
+  Looks enough like a device to be passed to device_kit.solve() and step(): flows and prices given to
+  it are compact (len(rows), len(cols)) and (len(cols),) arrays, and are embedded into the full
+  horizon - cells outside the window set to their fixed value - before calling the device.
+  '''
+  device = None
+  rows = cols = None
+  fixed = None      # Full flow matrix for device with fixed cells at their value and free cells 0.
+
+  def __init__(self, device, rows=None, cols=None):
+    if rows is None or cols is None:
+      (rows, cols) = active_window(device)
+    self.device = device
+    self.rows = rows
+    self.cols = cols
+    bounds = np.array(device.bounds, dtype=float)
+    self.fixed = np.where(bounds[:, 0] == bounds[:, 1], bounds[:, 0], 0).reshape(device.shape)
+    self._index = (rows.reshape(-1, 1)*device.shape[1] + cols).flatten()
+
+  def __len__(self):
+    return len(self.cols)
+
+  @property
+  def id(self):
+    return self.device.id
+
+  @property
+  def shape(self):
+    return (len(self.rows), len(self.cols))
+
+  @property
+  def bounds(self):
+    return np.array(self.device.bounds)[self._index]
+
+  @property
+  def constraints(self):
+    ''' The device's constraints over the embedded flow matrix. Jacobians are cut down to the window. '''
+    constraints = []
+    for constraint in self.device.constraints:
+      c = {
+        'type': constraint['type'],
+        'fun': lambda s, f=constraint['fun']: f(self.embed(s).flatten()),
+      }
+      if 'jac' in constraint:
+        c['jac'] = lambda s, f=constraint['jac']: np.asarray(f(self.embed(s).flatten()))[..., self._index]
+      constraints += [c]
+    return constraints
+
+  def u(self, s, p):
+    return utility(self.device, self.embed(s), self.embed_price(p))
+
+  def cost(self, s, p):
+    return cost(self.device, self.embed(s), self.embed_price(p))
+
+  def deriv(self, s, p):
+    return np.asarray(self.device.deriv(self.embed(s), self.embed_price(p))).reshape(self.device.shape)[np.ix_(self.rows, self.cols)]
+
+  def hess(self, s, p=0):
+    ''' The device's Hessian over the embedded flow matrix, cut down to the window. '''
+    return np.asarray(self.device.hess(self.embed(s), self.embed_price(p)))[np.ix_(self._index, self._index)]
+
+  def project(self, s):
+    return self.compact(self.device.project(self.embed(s)))
+
+  def embed(self, s):
+    ''' Compact flows to the full flow matrix for device. '''
+    full = self.fixed.copy()
+    full[np.ix_(self.rows, self.cols)] = np.asarray(s).reshape(self.shape)
+    return full
+
+  def embed_price(self, p):
+    ''' Compact price to a full price vector. Price outside the window doesn't matter since flows
+    there are fixed, so it's just 0.
+    '''
+    if np.ndim(p) == 0:
+      return p
+    full = np.zeros(self.device.shape[1])
+    full[self.cols] = p
+    return full
+
+  def compact(self, s):
+    ''' Full flow matrix for device to compact flows. '''
+    return np.asarray(s).reshape(self.device.shape)[np.ix_(self.rows, self.cols)]
+
+  def compact_price(self, p):
+    return p[self.cols] if np.ndim(p) else p